@@ -0,0 +1,127 @@
+"""
+Benchmark of the rendering modes of the Points actor.
+
+For each number of points and mode this reports the time taken to
+build the actor (including the clone and axes transform applied when
+the actor is added to a scene), the peak memory of the process and
+the time taken to render a frame offscreen.
+Each case runs in a separate process, so that peak memory is measured
+independently.
+
+Usage:
+    python benchmarks/points.py
+    python benchmarks/points.py --n 1000000 10000000 --modes glyph sprite
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+
+def run_case(n, mode, frames):
+    """
+    Builds and renders n points with the given mode,
+    returns the measured times and memory.
+    """
+    import vedo
+
+    from brainrender.actors import Points
+    from brainrender.render import mtx
+
+    vedo.settings.default_backend = "vtk"
+    rng = np.random.default_rng(0)
+    data = rng.uniform(0, 10000, (n, 3)).astype(np.float32)
+
+    start = time.perf_counter()
+    points = Points(data, mode=mode, radius=20, res=8)
+    mesh = points.mesh.clone().apply_transform(mtx)
+    build = time.perf_counter() - start
+
+    plotter = vedo.Plotter(offscreen=True, size=(1600, 1200))
+    plotter.add(mesh)
+
+    plotter.show(interactive=False, resetcam=True)
+
+    # the first frame includes uploading the data to the GPU
+    start = time.perf_counter()
+    plotter.render()
+    first = time.perf_counter() - start
+
+    times = []
+    for i in range(frames):
+        plotter.camera.Azimuth(5)
+        start = time.perf_counter()
+        plotter.render()
+        times.append(time.perf_counter() - start)
+    plotter.close()
+
+    return dict(
+        n=n,
+        mode=mode,
+        build=build,
+        first_frame=first,
+        frame=float(np.mean(times)) if times else float("nan"),
+        peak_rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--n", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument(
+        "--modes", nargs="+", default=["mesh", "glyph", "sprite"]
+    )
+    parser.add_argument(
+        "--frames", type=int, default=3, help="frames timed after the first"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=1800, help="seconds, for each case"
+    )
+    parser.add_argument("--case", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:  # run a single case in this process
+        n, mode = int(args.case[0]), args.case[1]
+        print(json.dumps(run_case(n, mode, args.frames)))
+        return
+
+    print(
+        f"{'N':>10} {'mode':>7} {'build (s)':>10} {'peak RSS (MB)':>14} "
+        + f"{'1st frame (s)':>14} {'frame (s)':>10}"
+    )
+    for n in args.n:
+        for mode in args.modes:
+            command = [sys.executable, __file__, "--case", str(n), mode]
+            command += ["--frames", str(args.frames)]
+            try:
+                out = subprocess.run(
+                    command,
+                    capture_output=True,
+                    text=True,
+                    timeout=args.timeout,
+                )
+            except subprocess.TimeoutExpired:
+                print(f"{n:>10} {mode:>7}   timed out after {args.timeout}s")
+                continue
+
+            if out.returncode != 0:
+                print(f"{n:>10} {mode:>7}   failed ({out.returncode})")
+                continue
+
+            res = json.loads(out.stdout.strip().splitlines()[-1])
+            print(
+                f"{n:>10} {mode:>7} {res['build']:>10.2f} "
+                + f"{res['peak_rss']:>14.0f} {res['first_frame']:>14.2f} "
+                + f"{res['frame']:>10.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
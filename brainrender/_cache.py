@@ -0,0 +1,182 @@
+"""
+Persistent binary cache of atlas region and neuron meshes.
+
+Each mesh is stored as a folder with three ``.npy`` files (float32
+vertices, int32 face offsets and int32 face connectivity) that can be
+memory-mapped and turned into VTK polydata without parsing any text.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from loguru import logger
+from vedo import Mesh
+from vtkmodules.util.numpy_support import numpy_to_vtk, vtk_to_numpy
+from vtkmodules.vtkCommonCore import vtkPoints
+from vtkmodules.vtkCommonDataModel import vtkCellArray, vtkPolyData
+
+cache_dir = Path.home() / ".brainglobe" / "brainrender" / "meshes"
+neurons_cache_dir = cache_dir / "neurons"
+
+MESH_FILES = ("vertices.npy", "offsets.npy", "connectivity.npy")
+
+
+def transform_key(transform):
+    """
+    Returns a short string identifying a transform matrix
+    so that cached meshes are invalidated if the transform changes.
+
+    :param transform: 4x4 transform matrix
+    """
+    mtx = np.asarray(transform, dtype=np.float64)
+    return hashlib.md5(mtx.tobytes()).hexdigest()[:10]
+
+
+def neuron_mesh_key(swc_file, neurite_radius, soma_radius, invert_dims):
+    """
+    Returns the name of the cache entry of a neuron's mesh. The key is
+    computed from the content of the .swc file, so that the mesh is
+    created again if the file changes, and from the meshing parameters.
+
+    :param swc_file: str or Path, path to the .swc file
+    :param neurite_radius: float, radius of axon/dendrites
+    :param soma_radius: float, radius of soma
+    :param invert_dims: bool, whether the coordinates' order is inverted
+    """
+    digest = hashlib.md5()
+    with open(swc_file, "rb") as fin:
+        for chunk in iter(lambda: fin.read(1 << 20), b""):
+            digest.update(chunk)
+    params = (
+        f"{float(neurite_radius)}_{float(soma_radius)}_{bool(invert_dims)}"
+    )
+    digest.update(params.encode())
+    return digest.hexdigest()
+
+
+def mesh_cache_folder(atlas_name, atlas_version):
+    """
+    Returns the folder with the cached meshes of an atlas.
+    Each version of an atlas has its own folder, the meshes
+    cached for other versions are kept (see prune_mesh_cache).
+
+    :param atlas_name: str, name of the atlas
+    :param atlas_version: str, version of the atlas
+    """
+    folder = cache_dir / f"{atlas_name}_v{atlas_version}"
+    folder.mkdir(parents=True, exist_ok=True)
+    return folder
+
+
+def prune_mesh_cache(atlas_name, keep_version=None):
+    """
+    Removes the cached meshes of an atlas. Folders are renamed before
+    being removed, so that a process still using an old version
+    never loads a partially removed mesh, it just creates it again.
+    Only call this when no other process is using the removed versions.
+
+    :param atlas_name: str, name of the atlas
+    :param keep_version: str, version of the atlas whose meshes are kept.
+        If None the meshes of all versions are removed.
+    """
+    keep = cache_dir / f"{atlas_name}_v{keep_version}"
+    for folder in cache_dir.glob(f"{atlas_name}_v*"):
+        if folder == keep or not folder.is_dir():
+            continue
+
+        logger.debug(f"Removing mesh cache: {folder}")
+        trash = folder.with_name(f".{folder.name}-{os.getpid()}-removed")
+        try:
+            os.replace(folder, trash)
+        except OSError:  # removed by another process in the meantime
+            continue
+        shutil.rmtree(trash, ignore_errors=True)
+
+
+def mesh_to_arrays(mesh):
+    """
+    Extracts vertices and faces connectivity from a mesh.
+
+    :param mesh: vedo Mesh
+    """
+    polys = mesh.dataset.GetPolys()
+    return (
+        np.asarray(mesh.vertices, dtype=np.float32),
+        vtk_to_numpy(polys.GetOffsetsArray()).astype(np.int32),
+        vtk_to_numpy(polys.GetConnectivityArray()).astype(np.int32),
+    )
+
+
+def arrays_to_mesh(vertices, offsets, connectivity):
+    """
+    Creates a vedo Mesh from vertices and faces connectivity arrays.
+
+    :param vertices: np.ndarray, Nx3 array of vertices coordinates
+    :param offsets: np.ndarray, offsets of each face in connectivity
+    :param connectivity: np.ndarray, vertices indices of all faces
+    """
+    points = vtkPoints()
+    points.SetData(
+        numpy_to_vtk(np.ascontiguousarray(vertices, np.float32), deep=True)
+    )
+
+    polys = vtkCellArray()
+    polys.SetData(
+        numpy_to_vtk(np.ascontiguousarray(offsets, np.int32), deep=True),
+        numpy_to_vtk(np.ascontiguousarray(connectivity, np.int32), deep=True),
+    )
+
+    poly = vtkPolyData()
+    poly.SetPoints(points)
+    poly.SetPolys(polys)
+    return Mesh(poly)
+
+
+def save_mesh(mesh, folder, key):
+    """
+    Saves a mesh to the cache. Files are first written to a
+    temporary folder which is then renamed, so that an interrupted
+    write never leaves a partial entry in the cache.
+
+    :param mesh: vedo Mesh
+    :param folder: Path, cache folder (see mesh_cache_folder)
+    :param key: str, name of the cache entry
+    """
+    if mesh.dataset.GetPolys().GetNumberOfCells() == 0:
+        return
+
+    dest = Path(folder) / key
+    tmp = Path(tempfile.mkdtemp(prefix=f".{key}-", dir=folder))
+    for fname, array in zip(MESH_FILES, mesh_to_arrays(mesh)):
+        np.save(tmp / fname, array)
+
+    try:
+        os.replace(tmp, dest)
+    except OSError:  # pragma: no cover
+        # another process or thread cached the same mesh in the meantime
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def load_mesh(folder, key):
+    """
+    Loads a mesh from the cache, returns None if it is not cached.
+
+    :param folder: Path, cache folder (see mesh_cache_folder)
+    :param key: str, name of the cache entry
+    """
+    path = Path(folder) / key
+    if not path.is_dir():
+        return None
+
+    try:
+        arrays = [np.load(path / fname, mmap_mode="r") for fname in MESH_FILES]
+    except (OSError, ValueError):  # pragma: no cover
+        logger.debug(f"Corrupted mesh cache entry, removing: {path}")
+        shutil.rmtree(path, ignore_errors=True)
+        return None
+
+    return arrays_to_mesh(*arrays)
@@ -1,3 +1,4 @@
+import random
 from pathlib import Path
 
 import requests
@@ -20,6 +21,20 @@ def connected_to_internet(url="http://www.google.com/", timeout=5):
     return False
 
 
+RETRY_BACKOFF = 0.5  # seconds, doubled after each failed attempt
+
+
+def retry_delay(attempt):
+    """
+    Seconds to wait before retrying a failed request: exponential
+    backoff with jitter, so that concurrent requests that failed
+    together are not retried together.
+
+    :param attempt: int, number of failed attempts so far minus one
+    """
+    return RETRY_BACKOFF * 2**attempt * random.uniform(0.5, 1.5)
+
+
 def fail_on_no_connection(func):
     """
     Decorator that throws an error if no internet connection is available
@@ -1,9 +1,16 @@
 import os
+import shlex
+import subprocess
+from queue import Queue
+from threading import Thread
 
+import vedo
 from loguru import logger
 from myterial import amber_light
 from rich import print
 from vedo import Video as VtkVideo
+from vtkmodules.util.numpy_support import vtk_to_numpy
+from vtkmodules.vtkRenderingCore import vtkWindowToImageFilter
 
 
 class Video(VtkVideo):
@@ -34,3 +41,166 @@ class Video(VtkVideo):
         out = os.system(command)
         self.tmp_dir.cleanup()
         return out, command
+
+
+class StreamingVideo:
+    def __init__(
+        self,
+        name="movie",
+        duration=None,
+        fps=24,
+        fmt="mp4",
+        size="1620x1050",
+        scale=1,
+        plotter=None,
+        buffer_size=16,
+    ):
+        """
+        Video class that grabs each frame from the render window and
+        streams it as raw RGB data to an ffmpeg process, so that the
+        video is encoded in a single pass without saving frames to disk.
+        Frames are written to ffmpeg by a separate thread through a
+        bounded queue, so that encoding overlaps with rendering.
+
+        :param name: str, path of the video file without extension
+        :param duration: float, not used, for compatibility with Video
+        :param fps: int, frame rate
+        :param fmt: str, video format (e.g. 'mp4')
+        :param size: str, size of video's frames in pixels (e.g. '1620x1050').
+            If None the size of the render window is used
+        :param scale: int, magnification of the frames grabbed from the window
+        :param plotter: vedo Plotter to grab frames from. If None vedo's
+            current plotter is used
+        :param buffer_size: int, max number of frames waiting to be encoded
+        """
+        self.name = str(name)
+        self.fps = fps
+        self.format = fmt
+        self.size = size
+        self.scale = scale
+        self.plotter = plotter
+
+        self.nframes = 0
+        self.frame_size = None
+        self.command = None
+        self._grabber = None
+        self._process = None
+        self._error = None
+        self._queue = Queue(maxsize=buffer_size)
+        self._writer = Thread(target=self._write_frames, daemon=True)
+
+    def _start(self, width, height):
+        """
+        Starts the ffmpeg process reading raw frames from its stdin.
+        """
+        # frames are read from the window bottom row first
+        filters = "vflip"
+        if not self.size:
+            # yuv420p needs even width and height
+            filters += ",pad=ceil(iw/2)*2:ceil(ih/2)*2"
+
+        command = [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-y",
+            "-f",
+            "rawvideo",
+            "-pix_fmt",
+            "rgb24",
+            "-s",
+            f"{width}x{height}",
+            "-r",
+            str(int(self.fps)),
+            "-i",
+            "-",
+            "-vf",
+            filters,
+            "-vcodec",
+            "libx264",
+            "-crf",
+            "28",
+            "-pix_fmt",
+            "yuv420p",
+        ]
+        if self.size:
+            command += ["-s", self.size]
+        command.append(f"{self.name}.{self.format}")
+
+        self.command = shlex.join(command)
+        logger.debug(f"Streaming video frames to: {self.command}")
+
+        self.frame_size = (width, height)
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE)
+        self._writer.start()
+
+    def _write_frames(self):
+        """
+        Writes the queued frames to ffmpeg until the video is closed.
+        """
+        while True:
+            frame = self._queue.get()
+            if frame is None:
+                break
+
+            if self._error is None:
+                try:
+                    self._process.stdin.write(frame)
+                except OSError as e:  # ffmpeg exited
+                    self._error = e
+
+    def add_frame(self):
+        """
+        Grabs the current content of the render window and
+        queues it to be encoded.
+        """
+        if self._grabber is None:
+            plotter = self.plotter or vedo.current_plotter()
+            self._grabber = vtkWindowToImageFilter()
+            self._grabber.SetInput(plotter.window)
+            self._grabber.SetScale(int(self.scale), int(self.scale))
+            self._grabber.ReadFrontBufferOff()  # read from the back buffer
+        else:
+            self._grabber.Modified()
+        self._grabber.Update()
+
+        image = self._grabber.GetOutput()
+        width, height, _ = image.GetDimensions()
+        if self._process is None:
+            self._start(width, height)
+        elif (width, height) != self.frame_size:
+            raise ValueError(
+                f"All video frames should have the same size {self.frame_size}, "
+                + f"got a frame of size {(width, height)}"
+            )
+
+        # copy the frame, the image is overwritten at the next grab
+        frame = vtk_to_numpy(image.GetPointData().GetScalars())
+        self._queue.put(frame.tobytes())  # blocks if ffmpeg falls behind
+        self.nframes += 1
+        return self
+
+    def close(self):
+        """
+        Waits for all frames to be encoded and closes the video file.
+        """
+        print(f"[{amber_light}]Saving video")
+        logger.debug(f"[{amber_light}]Saving video")
+
+        if self._process is None:
+            logger.warning("No frames were added to the video")
+            return 1, self.command
+
+        self._queue.put(None)
+        self._writer.join()
+        try:
+            self._process.stdin.close()
+        except OSError:  # pragma: no cover
+            pass
+        out = self._process.wait()
+
+        if self._error is not None:
+            logger.error(f"Failed to stream frames to ffmpeg: {self._error}")
+            out = out or 1
+        return out, self.command
@@ -129,9 +129,11 @@ class Actor:
         False  # has been transformed to correct axes orientation
     )
     _is_added: bool = False  # has the actor been added to the scene already
+    _style: str | None = None  # shader style applied to the meshes, if any
 
     labels: list[Actor] = []
     silhouette: Actor | None = None
+    _lod_meshes: list[Mesh] = []  # ._mesh at lower levels of detail
 
     def __init__(
         self,
@@ -5,3 +5,4 @@ from brainrender.actors.cylinder import Cylinder
 from brainrender.actors.volume import Volume
 from brainrender.actors.streamlines import Streamlines
 from brainrender.actors.line import Line
+from brainrender.actors.region_set import RegionSet
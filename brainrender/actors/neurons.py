@@ -1,3 +1,5 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
 
 from loguru import logger
@@ -5,11 +7,27 @@ from morphapi.morphology.morphology import Neuron as MorphoNeuron
 from pyinspect.utils import _class_name
 from vedo import Mesh
 
+from brainrender import settings
+from brainrender._cache import (
+    arrays_to_mesh,
+    load_mesh,
+    mesh_to_arrays,
+    neuron_mesh_key,
+    neurons_cache_dir,
+    save_mesh,
+)
 from brainrender.actor import Actor
 
 
 def make_neurons(
-    *neurons, alpha=1, color=None, neurite_radius=8, soma_radius=15, name=None
+    *neurons,
+    alpha=1,
+    color=None,
+    neurite_radius=8,
+    soma_radius=15,
+    invert_dims=True,
+    name=None,
+    n_workers=None,
 ):
     """
     Returns a list of Neurons given a variable number of inputs
@@ -18,19 +36,116 @@ def make_neurons(
     :param color: str
     :param neurite_radius: float, radius of axon/dendrites
     :param soma_radius: float, radius of soma
+    :param invert_dims: bool, exchange the first and last dimension coordinates
+        when loading from a .swc file
     :param name: str, actor name
+    :param n_workers: int, number of processes used to create the meshes
+        of the neurons loaded from .swc files. Meshes are created
+        serially if None or 1.
     """
-    return [
-        Neuron(
-            n,
+    # mesh .swc files in parallel, each file only once
+    meshes = {}
+    if n_workers is not None and n_workers > 1:
+        files = list(
+            dict.fromkeys(
+                str(n)
+                for n in neurons
+                if isinstance(n, (str, Path))
+                and Path(n).suffix == ".swc"
+                and Path(n).exists()
+            )
+        )
+
+        # cached meshes are loaded here, without sending them across processes
+        if settings.CACHE_MESHES:
+            for f in files:
+                key = neuron_mesh_key(
+                    f, neurite_radius, soma_radius, invert_dims
+                )
+                mesh = load_mesh(neurons_cache_dir, key)
+                if mesh is not None:
+                    meshes[f] = mesh
+            files = [f for f in files if f not in meshes]
+
+        if len(files) > 1:
+            logger.debug(
+                f"Creating {len(files)} neuron meshes with {n_workers} workers"
+            )
+            with ProcessPoolExecutor(max_workers=n_workers) as pool:
+                arrays = pool.map(
+                    _swc_mesh_arrays,
+                    files,
+                    repeat(neurite_radius),
+                    repeat(soma_radius),
+                    repeat(invert_dims),
+                    repeat(settings.CACHE_MESHES),
+                )
+                for f, a in zip(files, arrays):
+                    meshes[f] = arrays_to_mesh(*a)
+
+    actors, used = [], set()
+    for n in neurons:
+        mesh = meshes.get(str(n)) if isinstance(n, (str, Path)) else None
+        if mesh is not None:
+            # files given more than once get a copy of the mesh each
+            if str(n) in used:
+                mesh = mesh.clone()
+            used.add(str(n))
+        neuron = Neuron(
+            n if mesh is None else mesh,
             alpha=alpha,
             color=color,
             neurite_radius=neurite_radius,
             soma_radius=soma_radius,
+            invert_dims=invert_dims,
             name=name,
         )
-        for n in neurons
-    ]
+        if mesh is not None:
+            neuron.name = Path(n).name  # as if loaded from the file
+        actors.append(neuron)
+    return actors
+
+
+def _swc_mesh(swc_file, neurite_radius, soma_radius, invert_dims, use_cache):
+    """
+    Creates the mesh of a neuron from a .swc file. Meshes are saved to
+    (and loaded from) a binary cache indexed by the file's content and
+    by the meshing parameters.
+
+    :param swc_file: str or Path, path to the .swc file
+    :param neurite_radius: float, radius of axon/dendrites
+    :param soma_radius: float, radius of soma
+    :param invert_dims: bool, exchange the first and last dimension coordinates
+    :param use_cache: bool, if True the cache is used
+    """
+    if use_cache:
+        key = neuron_mesh_key(
+            swc_file, neurite_radius, soma_radius, invert_dims
+        )
+        mesh = load_mesh(neurons_cache_dir, key)
+        if mesh is not None:
+            return mesh
+
+    # morphapi's cache is not used, see Neuron._from_morphapi_neuron
+    neuron = MorphoNeuron(data_file=swc_file, invert_dims=invert_dims)
+    _, mesh = neuron.create_mesh(
+        neurite_radius=neurite_radius,
+        soma_radius=soma_radius,
+        use_cache=False,
+    )
+
+    if use_cache:
+        neurons_cache_dir.mkdir(parents=True, exist_ok=True)
+        save_mesh(mesh, neurons_cache_dir, key)
+    return mesh
+
+
+def _swc_mesh_arrays(*args):
+    """
+    Like _swc_mesh but returns the mesh as arrays, which
+    are sent back efficiently from worker processes.
+    """
+    return mesh_to_arrays(_swc_mesh(*args))
 
 
 class Neuron(Actor):
@@ -101,6 +216,10 @@ class Neuron(Actor):
 
         self.name = self.name or path.name
 
-        return self._from_morphapi_neuron(
-            MorphoNeuron(data_file=neuron, invert_dims=invert_dims)
+        return _swc_mesh(
+            path,
+            self.neurite_radius,
+            self.soma_radius,
+            invert_dims,
+            settings.CACHE_MESHES,
         )
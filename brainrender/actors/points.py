@@ -5,9 +5,37 @@ from loguru import logger
 from pyinspect.utils import _class_name
 from vedo import Points as vPoints
 from vedo import Sphere, Spheres
+from vedo.colors import get_color
+from vtkmodules.util.numpy_support import (
+    numpy_to_vtk,
+    numpy_to_vtkIdTypeArray,
+)
+from vtkmodules.vtkCommonCore import vtkPoints
+from vtkmodules.vtkCommonDataModel import vtkCellArray, vtkPolyData
+from vtkmodules.vtkFiltersSources import vtkSphereSource
+from vtkmodules.vtkRenderingCore import (
+    vtkGlyph3DMapper,
+    vtkPointGaussianMapper,
+)
 
 from brainrender.actor import Actor
 
+# fragment shader used by the "sprite" mode to draw each point sprite as
+# a shaded sphere impostor instead of a flat gaussian splat
+_SPHERE_SPLAT_SHADER = """
+//VTK::Color::Impl
+float dist = dot(offsetVCVSOutput.xy, offsetVCVSOutput.xy);
+if (dist > 1.0) {
+  discard;
+} else {
+  float scale = (1.0 - dist);
+  ambientColor *= scale;
+  diffuseColor *= scale;
+}
+"""
+
+POINTS_MODES = ("mesh", "glyph", "sprite")
+
 
 class Point(Actor):
     def __init__(
@@ -28,6 +56,126 @@ class Point(Actor):
         Actor.__init__(self, mesh, name=name, br_class="Point")
 
 
+class InstancedPoints(vPoints):
+    def __init__(
+        self, data, radius=20, colors="salmon", alpha=1, res=8, mode="glyph"
+    ):
+        """
+        Point cloud rendered by instancing a single shared sphere
+        template at each point (mode="glyph") or as screen aligned
+        sphere sprites (mode="sprite"). Only the Nx3 coordinates are kept
+        in memory, the per point radius and color are stored as
+        point data arrays and used by the mapper at render time.
+
+        :param data: np.ndarray, Nx3 array with coordinates
+        :param radius: float or np.ndarray of length N with each point's radius
+        :param colors: str, or list of str with color names or hex codes
+        :param alpha: float
+        :param res: int, resolution of the sphere template (glyph mode only)
+        :param mode: str, either "glyph" or "sprite"
+        """
+        if mode not in ("glyph", "sprite"):
+            raise ValueError(
+                f'Instanced points mode should be "glyph" or "sprite", not: {mode}'
+            )
+
+        vPoints.__init__(self, self._make_polydata(data))
+        self.mode = mode
+        self.res = res
+
+        N = self.dataset.GetNumberOfPoints()
+        radii = np.broadcast_to(
+            np.asarray(radius, dtype=np.float32), (N,)
+        ).copy()
+        radii_array = numpy_to_vtk(radii, deep=True)
+        radii_array.SetName("radius")
+        self.dataset.GetPointData().AddArray(radii_array)
+
+        if not isinstance(colors, str):
+            # map each unique color only once
+            names, inverse = np.unique(
+                np.asarray(colors, dtype=str), return_inverse=True
+            )
+            lut = np.array([get_color(c) for c in names]) * 255
+            rgb = lut[inverse].astype(np.uint8)
+            rgb_array = numpy_to_vtk(rgb, deep=True)
+            rgb_array.SetName("rgb")
+            self.dataset.GetPointData().AddArray(rgb_array)
+
+        self._set_mapper()
+        self.c(colors if isinstance(colors, str) else "white").alpha(alpha)
+        self.properties.SetRepresentationToSurface()
+        self.properties.LightingOn()
+
+    @staticmethod
+    def _make_polydata(data):
+        """
+        Builds the polydata with float32 coordinates and one vertex
+        cell per point without looping over the points in python.
+        """
+        coords = np.ascontiguousarray(data, dtype=np.float32)
+        N = len(coords)
+
+        points = vtkPoints()
+        points.SetData(numpy_to_vtk(coords, deep=True))
+
+        verts = vtkCellArray()
+        verts.SetData(
+            numpy_to_vtkIdTypeArray(np.arange(N + 1), deep=True),
+            numpy_to_vtkIdTypeArray(np.arange(N), deep=True),
+        )
+
+        poly = vtkPolyData()
+        poly.SetPoints(points)
+        poly.SetVerts(verts)
+        return poly
+
+    def _set_mapper(self):
+        """
+        Replaces vedo's polydata mapper with an instancing mapper.
+        """
+        if self.mode == "glyph":
+            template = vtkSphereSource()
+            template.SetRadius(1)
+            template.SetThetaResolution(self.res)
+            template.SetPhiResolution(self.res)
+
+            mapper = vtkGlyph3DMapper()
+            mapper.SetSourceConnection(template.GetOutputPort())
+            mapper.SetScaleArray("radius")
+            mapper.SetScaleModeToScaleByMagnitude()
+            mapper.ScalingOn()
+        else:
+            mapper = vtkPointGaussianMapper()
+            mapper.SetScaleArray("radius")
+            mapper.SetScaleFactor(1)
+            mapper.SetSplatShaderCode(_SPHERE_SPLAT_SHADER)
+            mapper.EmissiveOff()
+
+        mapper.SetInputData(self.dataset)
+        if self.dataset.GetPointData().HasArray("rgb"):
+            mapper.SetScalarModeToUsePointFieldData()
+            mapper.SelectColorArray("rgb")
+            mapper.SetColorModeToDirectScalars()
+            mapper.ScalarVisibilityOn()
+        else:
+            mapper.ScalarVisibilityOff()
+
+        self.mapper = mapper
+        self.actor.SetMapper(mapper)
+
+    def clone(self, deep=True):
+        """
+        Clone the point cloud keeping the instancing mapper.
+        """
+        cloned = vPoints.clone(self, deep=deep)
+        cloned.__class__ = InstancedPoints
+        cloned.mode = self.mode
+        cloned.res = self.res
+        cloned._set_mapper()
+        return cloned
+
+
 class PointsBase:
     def __init__(
         self,
@@ -49,9 +197,23 @@ class PointsBase:
                 )  # pragma: no cover
 
         self.name = self.name or "Points"
-        mesh = Spheres(
-            data, r=self.radius, c=self.colors, alpha=self.alpha, res=self.res
-        )
+        if self.mode == "mesh":
+            mesh = Spheres(
+                data,
+                r=self.radius,
+                c=self.colors,
+                alpha=self.alpha,
+                res=self.res,
+            )
+        else:
+            mesh = InstancedPoints(
+                data,
+                radius=self.radius,
+                colors=self.colors,
+                alpha=self.alpha,
+                res=self.res,
+                mode=self.mode,
+            )
         return mesh
 
     def _from_file(self, data, colors="salmon", alpha=1):
@@ -77,22 +239,41 @@ class PointsBase:
 
 class Points(PointsBase, Actor):
     def __init__(
-        self, data, name=None, colors="salmon", alpha=1, radius=20, res=8
+        self,
+        data,
+        name=None,
+        colors="salmon",
+        alpha=1,
+        radius=20,
+        res=8,
+        mode="mesh",
     ):
         """
         Creates an actor representing multiple points (more efficient than
         creating many Point instances).
 
         :param data: np.ndarray, Nx3 array or path to .npy file with coords data
-        :param radius: float
+        :param radius: float, or np.ndarray with one radius per point
+            (only with mode "glyph" or "sprite")
         :param color: str, or list of str with color names or hex codes
         :param alpha: float
         :param name: str, actor name
         :param res: int. Resolution of sphere actors
+        :param mode: str. "mesh" merges one sphere per point into a single
+            mesh, "glyph" renders a single shared sphere template instanced
+            at each point and "sprite" renders each point as a sphere sprite.
+            "glyph" and "sprite" are much faster and lighter for large
+            numbers of points.
         """
         PointsBase.__init__(self)
         logger.debug("Creating a Points actor")
 
+        if mode not in POINTS_MODES:
+            raise ValueError(
+                f"Points mode should be one of {POINTS_MODES}, not: {mode}"
+            )
+
+        self.mode = mode
         self.radius = radius
         self.colors = colors
         self.alpha = alpha
@@ -110,6 +291,42 @@ class Points(PointsBase, Actor):
 
         Actor.__init__(self, mesh, name=self.name, br_class="Points")
 
+    @classmethod
+    def filter_by_region(
+        cls, data, atlas, regions, include_descendants=True, **kwargs
+    ):
+        """
+        Creates a Points actor with only the points that fall
+        in a set of brain regions.
+
+        :param data: np.ndarray, Nx3 array or path to .npy file with coords data (in microns)
+        :param atlas: brainrender Atlas used to look up the regions
+        :param regions: str, int or list of region acronyms or IDs
+        :param include_descendants: bool. If True points in the regions'
+            descendants (e.g. cortical layers) are kept too
+        :param kwargs: keyword arguments for Points
+        """
+        if isinstance(data, (str, Path)):
+            path = Path(data)
+            if not path.exists():
+                raise FileExistsError(f"File {data} does not exist")
+            kwargs["name"] = kwargs.get("name") or path.name
+            data = np.load(path)
+
+        inside = atlas.in_region(
+            data, regions, include_descendants=include_descendants
+        )
+        logger.debug(
+            f"Keeping {inside.sum()}/{len(data)} points in regions: {regions}"
+        )
+
+        # per point colors and radii need to be filtered too
+        for key in ("colors", "radius"):
+            value = kwargs.get(key)
+            if value is not None and np.ndim(value) == 1:
+                kwargs[key] = np.asarray(value)[inside]
+        return cls(data[inside], **kwargs)
+
 
 class PointsDensity(Actor):
     def __init__(
@@ -0,0 +1,176 @@
+import numpy as np
+from loguru import logger
+from vedo import merge
+from vedo.colors import get_color
+from vtkmodules.util.numpy_support import vtk_to_numpy
+from vtkmodules.vtkCommonCore import vtkLookupTable, vtkVariant
+
+from brainrender.actor import Actor
+
+
+class RegionSet(Actor):
+    def __init__(self, regions, ids=None, alpha=1, name=None):
+        """
+        Creates a single actor from the meshes of many brain regions.
+        The meshes are merged into one polydata in which each cell
+        stores the ID of the region it belongs to ("region_id").
+        Region colors and transparency come from a lookup table
+        indexed by region ID, so that individual regions can be
+        recolored or hidden without splitting the mesh.
+
+        :param regions: list of brain region Actors (see Atlas.get_region)
+        :param ids: list of int, ID of each region. If None the regions
+            are numbered in order.
+        :param alpha: float, transparency of all regions
+        :param name: str, actor name
+        """
+        logger.debug(f"Creating a region set with {len(regions)} regions")
+        ids = list(range(len(regions))) if ids is None else list(ids)
+        if len(ids) != len(regions):
+            raise ValueError(
+                "When passing region IDs, there should be one ID per region"
+            )
+        if len(set(ids)) != len(ids):
+            raise ValueError("Region IDs should be unique")
+
+        self.regions = [str(r.name) for r in regions]
+        self.ids = [int(i) for i in ids]
+        self._colors = np.array([r.mesh.color() for r in regions])
+        self._alphas = np.full(len(regions), alpha, dtype=float)
+        self._visible = np.ones(len(regions), dtype=bool)
+
+        self.lut = vtkLookupTable()
+        self.lut.IndexedLookupOn()
+        self.lut.SetNumberOfTableValues(len(regions))
+        for region, rid in zip(self.regions, self.ids):
+            self.lut.SetAnnotation(vtkVariant(rid), region)
+
+        mesh = self._merge([r.mesh for r in regions])
+        Actor.__init__(
+            self, mesh, name=name or "Region set", br_class="region set"
+        )
+
+        # meshes loaded from the cache are already transformed
+        if all("_mesh" in r.__dict__ for r in regions):
+            self._mesh = self._merge([r._mesh for r in regions])
+            self._is_transformed = True
+
+            # regions without a level of detail are used at full detail
+            n_levels = max(len(r._lod_meshes) for r in regions)
+            self._lod_meshes = [
+                self._merge(
+                    [
+                        (
+                            r._lod_meshes[level]
+                            if level < len(r._lod_meshes)
+                            else r._mesh
+                        )
+                        for r in regions
+                    ]
+                )
+                for level in range(n_levels)
+            ]
+
+        self._update_lut()
+
+    def _merge(self, meshes):
+        """
+        Merges the regions' meshes tagging each cell with its region ID.
+        The meshes are copied, so that the regions are left unchanged.
+        """
+        copies = []
+        for mesh, rid in zip(meshes, self.ids):
+            mesh = mesh.clone(deep=False)
+            mesh.celldata["region_id"] = np.full(mesh.ncells, rid, np.int32)
+            copies.append(mesh)
+
+        merged = merge(*copies)
+        merged.dataset.GetCellData().SetActiveScalars("region_id")
+        merged.mapper.SetLookupTable(self.lut)
+        merged.mapper.SetScalarModeToUseCellData()
+        merged.mapper.UseLookupTableScalarRangeOn()
+        merged.mapper.ScalarVisibilityOn()
+        merged.alpha(1)  # transparency is set per region by the lut
+        return merged
+
+    def _update_lut(self):
+        """
+        Writes the regions' colors and transparency in the lookup table.
+        """
+        alphas = np.where(self._visible, self._alphas, 0)
+        for i, (color, alpha) in enumerate(zip(self._colors, alphas)):
+            self.lut.SetTableValue(i, *color, alpha)
+        self.lut.Modified()
+
+    def _index(self, region):
+        """
+        Index of a region given its name or ID.
+        """
+        if region in self.regions:
+            return self.regions.index(region)
+        elif region in self.ids:
+            return self.ids.index(region)
+        raise ValueError(f"Region {region} is not in the region set")
+
+    def region_from_cell(self, cell_id):
+        """
+        Returns the name of the region a mesh cell belongs to
+        (e.g. a cell picked by clicking on the rendered mesh).
+
+        :param cell_id: int, ID of a cell of the rendered mesh, which
+            is a lower level of detail's mesh when one is rendered
+        """
+        # ._mesh only exists once the actor has been transformed, its
+        # mapper renders the dataset of the current level of detail
+        if "_mesh" in self.__dict__:
+            dataset = self._mesh.mapper.GetInput()
+        else:
+            dataset = self.mesh.dataset
+        region_ids = vtk_to_numpy(dataset.GetCellData().GetArray("region_id"))
+        return self.regions[self.ids.index(int(region_ids[cell_id]))]
+
+    def set_color(self, region, color):
+        """
+        Changes the color of a region.
+
+        :param region: str or int, name or ID of the region
+        :param color: str or list, new color
+        """
+        self._colors[self._index(region)] = get_color(color)
+        self._update_lut()
+        return self
+
+    def set_alpha(self, region, alpha):
+        """
+        Changes the transparency of a region.
+
+        :param region: str or int, name or ID of the region
+        :param alpha: float, new transparency
+        """
+        self._alphas[self._index(region)] = alpha
+        self._update_lut()
+        return self
+
+    def hide(self, *regions):
+        """
+        Hides some of the regions.
+
+        :param regions: str or int, names or IDs of the regions
+        """
+        for region in regions:
+            self._visible[self._index(region)] = False
+        self._update_lut()
+        return self
+
+    def show(self, *regions):
+        """
+        Shows regions previously hidden, all regions
+        are shown if none is passed.
+
+        :param regions: str or int, names or IDs of the regions
+        """
+        regions = regions or self.regions
+        for region in regions:
+            self._visible[self._index(region)] = True
+        self._update_lut()
+        return self
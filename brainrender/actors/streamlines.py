@@ -1,24 +1,48 @@
+import os
+import tempfile
+from itertools import chain
+from operator import itemgetter
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
 from loguru import logger
-from vedo import merge
-from vedo.shapes import Spheres, Tube
+from vedo import Mesh, merge
+from vedo.shapes import Spheres
+from vtkmodules.util.numpy_support import numpy_to_vtk
+from vtkmodules.vtkCommonCore import vtkPoints
+from vtkmodules.vtkCommonDataModel import vtkCellArray, vtkPolyData
+from vtkmodules.vtkFiltersCore import vtkTubeFilter
 
+from brainrender import settings
 from brainrender.actor import Actor
+from brainrender.actors.volume import Volume
+from brainrender.render import mtx
 
 
 def make_streamlines(
-    *streamlines, color="salmon", alpha=1, radius=10, show_injection=True
+    *streamlines,
+    color="salmon",
+    alpha=1,
+    radius=10,
+    show_injection=True,
+    lines_only=False,
+    tolerance=None,
+    lod=False,
 ):
     """
     Creates instances of Streamlines from data.
-    :param streamlines: pd.dataframes with streamlines data
+    :param streamlines: StreamlinesData or pd.dataframes with streamlines data
     :param radius: float. Radius of the Tube mesh used to render streamlines
     :param color: str, name of the color to be used
     :param alpha: float, transparency
     :param show_injection: bool. If true spheres mark the injection sites
+    :param lines_only: bool. If true streamlines are rendered as lines
+        instead of tubes
+    :param tolerance: float, max error (in microns) of the simplified
+        streamlines. If None the streamlines are not simplified
+    :param lod: bool. If true meshes at lower levels of detail are made
+        (see Streamlines)
     """
     return [
         Streamlines(
@@ -27,15 +51,283 @@ def make_streamlines(
             alpha=alpha,
             radius=radius,
             show_injection=show_injection,
+            lines_only=lines_only,
+            tolerance=tolerance,
+            lod=lod,
         )
         for s in streamlines
     ]
 
 
+def _point_to_dict(point):
+    return dict(x=float(point[0]), y=float(point[1]), z=float(point[2]))
+
+
+def _concat_ranges(starts, stops):
+    """
+    Concatenates np.arange(start, stop) for each start and stop.
+
+    :param starts: np.ndarray, first value of each range
+    :param stops: np.ndarray, end (excluded) of each range
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.asarray(stops, dtype=np.int64) - starts
+    shift = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return shift + np.arange(lengths.sum())
+
+
+def _simplify_lines(points, offsets, tolerance):
+    """
+    Simplifies polylines with the Douglas-Peucker algorithm, run on all
+    polylines at once: at each step every range of points is split at
+    the point farthest from the segment joining its ends, until all the
+    points of a range are within tolerance of that segment.
+    Returns a mask of the points kept and the max distance of the
+    dropped points from the simplified polylines.
+
+    :param points: np.ndarray, Nx3 array with the points of all polylines
+    :param offsets: np.ndarray, index of the first point of each polyline
+        in points, followed by the total number of points
+    :param tolerance: float, max distance of the dropped points
+    """
+    points = np.asarray(points, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.diff(offsets)
+
+    # the ends of each polyline are always kept
+    keep = np.zeros(len(points), dtype=bool)
+    keep[offsets[:-1][lengths > 0]] = True
+    keep[offsets[1:][lengths > 0] - 1] = True
+
+    error = 0.0
+    first = offsets[:-1][lengths > 2]
+    last = offsets[1:][lengths > 2] - 1
+    while len(first):
+        # distance of the points inside each range from its segment
+        n = last - first - 1
+        inner = _concat_ranges(first + 1, last)
+        rng = np.repeat(np.arange(len(first)), n)
+        start = points[first][rng]
+        segment = points[last][rng] - start
+        vec = points[inner] - start
+        sqlen = np.einsum("ij,ij->i", segment, segment)
+        t = np.einsum("ij,ij->i", vec, segment) / np.where(sqlen, sqlen, 1)
+        dist = np.linalg.norm(
+            vec - np.clip(t, 0, 1)[:, None] * segment, axis=1
+        )
+
+        # farthest point in each range
+        dmax = np.maximum.reduceat(dist, np.cumsum(n) - n)
+        farthest = np.flatnonzero(dist == dmax[rng])
+        first_max = np.ones(len(farthest), dtype=bool)
+        first_max[1:] = rng[farthest[1:]] != rng[farthest[:-1]]
+        farthest = farthest[first_max]
+        split = dmax > tolerance
+        if not split.all():
+            error = max(error, dmax[~split].max())
+
+        mid = inner[farthest[split]]
+        keep[mid] = True
+        first = np.concatenate([first[split], mid])
+        last = np.concatenate([mid, last[split]])
+        inside = last - first > 1
+        first, last = first[inside], last[inside]
+
+    return keep, float(error)
+
+
+class StreamlinesData:
+    """
+    Streamlines of an experiment stored as flat arrays: the points of
+    all streamlines one after the other and the offset of the first
+    point of each streamline, plus the injection sites' coordinates.
+    """
+
+    def __init__(self, points, offsets, injection_sites=None):
+        """
+        :param points: np.ndarray, Nx3 array with the points of all streamlines
+        :param offsets: np.ndarray, index of the first point of each
+            streamline in points, followed by the total number of points
+        :param injection_sites: np.ndarray, Mx3 array with the coordinates
+            of the injection sites
+        """
+        self.points = np.asarray(points, dtype=np.float32).reshape(-1, 3)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        if injection_sites is None:
+            injection_sites = np.empty((0, 3))
+        self.injection_sites = np.asarray(
+            injection_sites, dtype=np.float32
+        ).reshape(-1, 3)
+
+        if self.offsets[0] != 0 or self.offsets[-1] != len(self.points):
+            raise ValueError(
+                "Streamlines offsets should start at 0 and end with the number of points"
+            )
+
+        self.max_error = 0.0  # max distance from the original streamlines
+        self._simplified = {}
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __repr__(self):  # pragma: no cover
+        return f"StreamlinesData({len(self)} streamlines, {len(self.points)} points)"
+
+    @property
+    def lines(self):
+        """
+        List with an array of points for each streamline.
+        """
+        return np.split(self.points, self.offsets[1:-1])
+
+    def simplify(self, tolerance):
+        """
+        Returns the streamlines simplified with the Douglas-Peucker
+        algorithm, keeping only the points needed for every dropped
+        point to be within tolerance of the simplified streamlines.
+        The max_error attribute of the simplified data is the measured
+        max distance of the original streamlines from the simplified
+        ones. Simplified data are cached for each tolerance.
+
+        :param tolerance: float, max distance in microns
+        """
+        if not tolerance or tolerance <= 0:
+            return self
+
+        if tolerance not in self._simplified:
+            keep, error = _simplify_lines(self.points, self.offsets, tolerance)
+            kept = np.concatenate([[0], np.cumsum(keep)])
+            simplified = StreamlinesData(
+                self.points[keep], kept[self.offsets], self.injection_sites
+            )
+            simplified.max_error = error
+            self._simplified[tolerance] = simplified
+        return self._simplified[tolerance]
+
+    @classmethod
+    def from_lines(cls, lines, injection_sites=None):
+        """
+        Creates streamlines data from a list of arrays of points.
+
+        :param lines: list of Nx3 np.ndarray, points of each streamline
+        :param injection_sites: np.ndarray, Mx3 array with the coordinates
+            of the injection sites
+        """
+        offsets = np.cumsum([0] + [len(line) for line in lines])
+        points = [np.reshape(line, (-1, 3)) for line in lines]
+        points = np.concatenate(points) if points else np.empty((0, 3))
+        return cls(points, offsets, injection_sites)
+
+    @classmethod
+    def from_dataframe(cls, data):
+        """
+        Creates streamlines data from a pd.DataFrame in the format
+        of the json files saved by previous versions of brainrender.
+
+        :param data: pd.DataFrame with 'lines' and 'injection_sites' columns
+        """
+        if len(data["lines"]) == 1:
+            try:
+                lines_data = data["lines"][0]
+            except KeyError:  # pragma: no cover
+                lines_data = data["lines"]["0"]  # pragma: no cover
+        else:
+            lines_data = data["lines"]
+
+        get_xyz = itemgetter("x", "y", "z")
+        offsets = np.cumsum([0] + [len(line) for line in lines_data])
+        points = np.fromiter(
+            chain.from_iterable(
+                get_xyz(point) for line in lines_data for point in line
+            ),
+            dtype=np.float32,
+            count=3 * offsets[-1],
+        )
+
+        sites = data["injection_sites"].iloc[0]
+        injection_sites = [get_xyz(site) for site in sites]
+        return cls(points, offsets, injection_sites)
+
+    def to_dataframe(self):
+        """
+        Returns the streamlines data as a pd.DataFrame in the format
+        of the json files saved by previous versions of brainrender.
+        """
+        lines = [[_point_to_dict(p) for p in line] for line in self.lines]
+        sites = [_point_to_dict(p) for p in self.injection_sites]
+        return pd.DataFrame({"lines": [lines], "injection_sites": [sites]})
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads streamlines data from a .npz file (see StreamlinesData.save)
+        or from a .json file saved by previous versions of brainrender.
+
+        :param path: str or Path, path to the file
+        """
+        path = Path(path)
+        if path.suffix == ".json":
+            return cls.from_dataframe(pd.read_json(path))
+
+        with np.load(path) as data:
+            return cls(
+                data["points"], data["offsets"], data["injection_sites"]
+            )
+
+    def save(self, path):
+        """
+        Saves the streamlines data to a .npz file. The file is first
+        written to a temporary file which is then renamed, so that an
+        interrupted write never leaves a partial file.
+
+        :param path: str or Path, path to the file
+        """
+        path = Path(path)
+        fd, tmp = tempfile.mkstemp(
+            prefix=f".{path.stem}-", suffix=".npz", dir=path.parent
+        )
+        try:
+            with os.fdopen(fd, "wb") as fout:
+                np.savez(
+                    fout,
+                    points=self.points,
+                    offsets=self.offsets,
+                    injection_sites=self.injection_sites,
+                )
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+
+def _lines_to_polydata(points, offsets):
+    """
+    Creates a polydata with one polyline per streamline.
+
+    :param points: np.ndarray, Nx3 array with the points of all streamlines
+    :param offsets: np.ndarray, index of the first point of each streamline
+        in points, followed by the total number of points
+    """
+    vpoints = vtkPoints()
+    vpoints.SetData(numpy_to_vtk(np.ascontiguousarray(points), deep=True))
+
+    # points are stored one streamline after the other
+    lines = vtkCellArray()
+    lines.SetData(
+        numpy_to_vtk(np.asarray(offsets, dtype=np.int64), deep=True),
+        numpy_to_vtk(np.arange(len(points), dtype=np.int64), deep=True),
+    )
+
+    poly = vtkPolyData()
+    poly.SetPoints(vpoints)
+    poly.SetLines(lines)
+    return poly
+
+
 class Streamlines(Actor):
     """
     Streamliens actor class.
-    Creates an actor from streamlines data (from a json file parsed with: get_streamlines_data)
+    Creates an actor from streamlines data (e.g. from get_streamlines_data)
     """
 
     def __init__(
@@ -46,66 +338,232 @@ class Streamlines(Actor):
         alpha=1,
         show_injection=True,
         name=None,
+        lines_only=False,
+        tolerance=None,
+        lod=False,
     ):
         """
         Turns streamlines data to a mesh.
-        :param data: pd.DataFrame with streamlines points data
+        With lod=True, meshes of the streamlines simplified with increasing
+        tolerance (see settings.STREAMLINES_LOD_TOLERANCES) are used as
+        lower levels of detail.
+        :param data: StreamlinesData, pd.DataFrame with streamlines
+            points data or path to a .npz or .json file with the data
         :param radius: float. Radius of the Tube mesh used to render streamlines
         :param color: str, name of the color to be used
         :param alpha: float, transparency
         :param name: str, name of the actor.
         :param show_injection: bool. If true spheres mark the injection sites
+        :param lines_only: bool. If true streamlines are rendered as lines
+            instead of tubes, which is much faster for large datasets
+        :param tolerance: float, max error (in microns) of the simplified
+            streamlines. If None the streamlines are not simplified
+        :param lod: bool. If true meshes at lower levels of detail are
+            made too, this takes longer but large sets of streamlines are
+            then faster to render when small on screen or while the
+            camera moves (if settings.USE_LOD is True)
         """
         logger.debug("Creating a streamlines actor")
         if isinstance(data, (str, Path)):
-            data = pd.read_json(data)
-        elif not isinstance(data, pd.DataFrame):
-            raise TypeError("Input data should be a dataframe")
+            data = StreamlinesData.load(data)
+        elif isinstance(data, pd.DataFrame):
+            data = StreamlinesData.from_dataframe(data)
+        elif not isinstance(data, StreamlinesData):
+            raise TypeError(
+                "Input data should be StreamlinesData or a dataframe"
+            )
 
         self.radius = radius
+        self.lines_only = lines_only
+        self.tolerance = tolerance
+        simplified = data.simplify(tolerance)
         mesh = (
-            self._make_mesh(data, show_injection=show_injection)
+            self._make_mesh(simplified, show_injection=show_injection)
             .c(color)
             .alpha(alpha)
-            .clean()
         )
 
         name = name or "Streamlines"
         Actor.__init__(self, mesh, name=name, br_class="Streamliness")
 
+        # max distance from the original streamlines at each level of detail
+        self.max_errors = [simplified.max_error]
+        if lod and settings.USE_LOD:
+            levels = [
+                data.simplify(tol)
+                for tol in settings.STREAMLINES_LOD_TOLERANCES
+                if tol > (tolerance or 0)
+            ]
+            # like atlas regions', lower levels are made in render space
+            self._lod_meshes = [
+                self._make_mesh(
+                    level, show_injection=show_injection
+                ).apply_transform(mtx)
+                for level in levels
+            ]
+            self.max_errors += [level.max_error for level in levels]
+
     def _make_mesh(self, data, show_injection=True):
-        lines = []
-        if len(data["lines"]) == 1:
-            try:
-                lines_data = data["lines"][0]
-            except KeyError:  # pragma: no cover
-                lines_data = data["lines"]["0"]  # pragma: no cover
-        else:
-            lines_data = data["lines"]
+        # streamlines with a single point can't be drawn
+        lengths = np.diff(data.offsets)
+        drawn = lengths > 1
+        points = data.points[np.repeat(drawn, lengths)]
+        offsets = np.concatenate([[0], np.cumsum(lengths[drawn])])
 
-        for line in lines_data:
-            points = [[lin["x"], lin["y"], lin["z"]] for lin in line]
-            lines.append(
-                Tube(
-                    points,
-                    r=self.radius,
-                    res=8,
-                )
-            )
+        # all streamlines are turned to tubes by a single filter, duplicated
+        # points are removed first as tubes can't be made through them
+        mesh = Mesh(_lines_to_polydata(points, offsets)).clean()
+        if self.lines_only:
+            mesh.lw(3).render_lines_as_tubes()
+        else:
+            tubes = vtkTubeFilter()
+            tubes.SetInputData(mesh.dataset)
+            tubes.SetRadius(self.radius)
+            tubes.SetNumberOfSides(8)
+            tubes.CappingOn()
+            tubes.Update()
+            mesh = Mesh(tubes.GetOutput()).phong()
 
-        if show_injection:
-            coords = np.vstack(
-                [
-                    list(point.values())
-                    for point in data.injection_sites.iloc[0]
-                ]
-            )
-            lines.append(
+        if show_injection and len(data.injection_sites):
+            mesh = merge(
+                mesh,
                 Spheres(
-                    coords,
+                    data.injection_sites,
                     r=self.radius * 10,
                     res=8,
-                )
+                ),
             )
 
-        return merge(*lines)
+        return mesh
+
+
+def _rasterize_streamlines(points, offsets, shape, voxel_size):
+    """
+    Computes the length of streamlines within each voxel of a grid.
+    Each segment is split where it crosses the planes between voxels,
+    and the length of each piece is added to the voxel it's in.
+
+    :param points: np.ndarray, Nx3 array with the points of all streamlines
+    :param offsets: np.ndarray, index of the first point of each streamline
+        in points, followed by the total number of points
+    :param shape: tuple, number of voxels along each axis
+    :param voxel_size: float, size of each voxel in microns
+    """
+    if len(points) == 0:
+        return np.zeros(shape)
+
+    # segments between consecutive points of the same streamline
+    starts = np.ones(len(points), dtype=bool)
+    starts[np.asarray(offsets[1:], dtype=np.int64) - 1] = False
+    starts = np.flatnonzero(starts)
+    p0 = points[starts].astype(np.float64)
+    delta = points[starts + 1] - p0
+    length = np.linalg.norm(delta, axis=1)
+
+    cell0 = np.floor(p0 / voxel_size).astype(np.int64)
+    cell1 = np.floor((p0 + delta) / voxel_size).astype(np.int64)
+
+    # segments within a single voxel are added as a whole
+    crossing = np.any(cell0 != cell1, axis=1)
+    cells, weights = [cell0[~crossing]], [length[~crossing]]
+
+    # the others are split at the planes between voxels: get the position
+    # along each segment (0 to 1) of its ends and of the planes it crosses
+    p0, delta, length = p0[crossing], delta[crossing], length[crossing]
+    cell0, cell1 = cell0[crossing], cell1[crossing]
+    segment = [np.arange(len(p0))] * 2
+    t = [np.zeros(len(p0)), np.ones(len(p0))]
+    for axis in range(3):
+        ncross = np.abs(cell1[:, axis] - cell0[:, axis])
+        seg = np.repeat(np.arange(len(p0)), ncross)
+        first = np.cumsum(ncross) - ncross
+        plane = np.minimum(cell0, cell1)[seg, axis] + (
+            np.arange(len(seg)) - first[seg] + 1
+        )
+        segment.append(seg)
+        t.append((plane * voxel_size - p0[seg, axis]) / delta[seg, axis])
+
+    segment, t = np.concatenate(segment), np.clip(np.concatenate(t), 0, 1)
+    order = np.lexsort((t, segment))
+    segment, t = segment[order], t[order]
+
+    # pieces between consecutive positions along the same segment
+    same = segment[1:] == segment[:-1]
+    seg = segment[1:][same]
+    mid = (t[1:] + t[:-1])[same] / 2
+    cells.append(
+        np.floor((p0[seg] + mid[:, None] * delta[seg]) / voxel_size).astype(
+            np.int64
+        )
+    )
+    weights.append((t[1:] - t[:-1])[same] * length[seg])
+
+    cells, weights = np.concatenate(cells), np.concatenate(weights)
+    inside = np.all((cells >= 0) & (cells < shape), axis=1)
+    keys = np.ravel_multi_index(tuple(cells[inside].T), shape)
+    density = np.bincount(keys, weights[inside], minlength=np.prod(shape))
+    return density.reshape(shape)
+
+
+def make_streamlines_density(
+    *streamlines,
+    atlas,
+    voxel_size=100,
+    per_region=False,
+    cmap="Reds",
+    name=None,
+    **kwargs,
+):
+    """
+    Creates a Volume actor with the projection density of a set of
+    streamlines on the atlas grid: the length (in microns) of all
+    streamlines in each voxel.
+
+    :param streamlines: StreamlinesData or pd.dataframes with streamlines data
+    :param atlas: brainrender Atlas, defines the grid's extent
+    :param voxel_size: float, size of each voxel in microns
+    :param per_region: bool. If True each voxel shows the mean
+        density of the brain region it's in
+    :param cmap: str, name of the colormap to use
+    :param name: str, name of the actor
+    :param kwargs: keyword arguments for Volume
+    """
+    logger.debug(
+        f"Creating the density volume of {len(streamlines)} streamlines"
+    )
+    streamlines = [
+        (
+            s
+            if isinstance(s, StreamlinesData)
+            else StreamlinesData.from_dataframe(s)
+        )
+        for s in streamlines
+    ]
+    shape = tuple(
+        int(np.ceil(n / voxel_size)) for n in np.asarray(atlas.shape_um)
+    )
+
+    density = np.zeros(shape)
+    for data in streamlines:
+        density += _rasterize_streamlines(
+            data.points, data.offsets, shape, voxel_size
+        )
+
+    if per_region:
+        # region at the center of each voxel
+        centers = np.indices(shape).reshape(3, -1).T * voxel_size
+        regions = atlas.structures_from_coords(centers + voxel_size / 2)
+        _, labels = np.unique(regions, return_inverse=True)
+
+        mean = np.bincount(labels, density.ravel()) / np.bincount(labels)
+        density = np.where(regions == 0, 0, mean[labels]).reshape(shape)
+
+    # volumes' axes are ordered as in Allen's grid data (ML, DV, AP)
+    return Volume(
+        density.transpose(2, 1, 0).astype(np.float32),
+        voxel_size=voxel_size,
+        as_surface=False,
+        c=cmap,
+        name=name or "Streamlines density",
+        **kwargs,
+    )
@@ -1,17 +1,58 @@
 """Atlas subclass adding region and plane Actor support for scenes."""
 
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
 from typing import Any
 
 import numpy as np
 import numpy.typing as npt
 from brainglobe_atlasapi.bg_atlas import BrainGlobeAtlas
 from loguru import logger
-from vedo import Plane
+from vedo import Mesh, Plane
+from vtkmodules.vtkFiltersCore import vtkQuadricClustering
 
 from brainrender import settings
+from brainrender._cache import (
+    load_mesh,
+    mesh_cache_folder,
+    save_mesh,
+    transform_key,
+)
 from brainrender._io import load_mesh_from_file
-from brainrender._utils import return_list_smart
+from brainrender._utils import listify, return_list_smart
 from brainrender.actor import Actor
+from brainrender.render import mtx
+
+
+def _decimate(mesh: Mesh, fraction: float) -> Mesh:
+    """
+    Decimate a mesh by quadric clustering of its vertices.
+
+    The clustering grid is sized so that about *fraction* of the
+    vertices are kept. This is much faster than quadric decimation
+    and good enough for meshes rendered small on screen.
+
+    Parameters
+    ----------
+    mesh
+        Mesh to decimate, it is not modified.
+    fraction
+        Approximate fraction of the vertices to keep.
+
+    Returns
+    -------
+    Mesh
+    """
+    size = np.ptp(mesh.bounds().reshape(3, 2), axis=1)
+    cell_size = np.sqrt(mesh.area() / (fraction * mesh.npoints))
+    divisions = np.maximum(np.ceil(size / cell_size), 1).astype(int)
+
+    clustering = vtkQuadricClustering()
+    clustering.SetInputData(mesh.dataset)
+    clustering.AutoAdjustNumberOfDivisionsOff()
+    clustering.SetNumberOfDivisions(*divisions.tolist())
+    clustering.Update()
+    return Mesh(clustering.GetOutput())
 
 
 class Atlas(BrainGlobeAtlas):
@@ -73,15 +114,134 @@ class Atlas(BrainGlobeAtlas):
             x / 255 for x in self._get_from_structure(region, "rgb_triplet")
         ]
 
+    def _load_region_mesh(self, region: str | int) -> tuple[Mesh, Mesh | None]:
+        """
+        Load a region's mesh and its copy transformed to brainrender's
+        axes orientation.
+
+        If ``settings.CACHE_MESHES`` is True the transformed mesh is
+        loaded from (or saved to) the binary mesh cache, skipping the
+        parsing of the ``.obj`` file and the transform.
+
+        Parameters
+        ----------
+        region
+            Region acronym or ID.
+
+        Returns
+        -------
+        tuple
+            The mesh in atlas space and the transformed mesh, which is
+            None if meshes caching is disabled.
+
+        Raises
+        ------
+        FileNotFoundError
+            If the region has no mesh file in the atlas.
+        """
+        obj_file = str(self.meshfile_from_structure(region))
+        if not settings.CACHE_MESHES:
+            return load_mesh_from_file(obj_file), None
+
+        folder = mesh_cache_folder(self.atlas_name, self.metadata["version"])
+        key = f"{self._get_from_structure(region, 'id')}_{transform_key(mtx)}"
+
+        transformed = load_mesh(folder, key)
+        if transformed is None:
+            mesh = load_mesh_from_file(obj_file)
+            transformed = mesh.clone().apply_transform(mtx)
+            save_mesh(transformed, folder, key)
+        else:
+            # go back to atlas space without re-loading the .obj file
+            inv = np.linalg.inv(mtx)
+            mesh = transformed.clone()
+            mesh.vertices = transformed.vertices @ inv[:3, :3].T + inv[:3, 3]
+
+        return mesh, transformed
+
+    def _load_region_lods(
+        self, region: str | int, mesh: Mesh, transformed: Mesh | None
+    ) -> list[Mesh]:
+        """
+        Load a region's mesh at lower levels of detail.
+
+        One decimated mesh is created for each level in
+        ``settings.LOD_LEVELS`` after the first (full detail) one.
+        Decimated meshes are cached like the full resolution meshes if
+        ``settings.CACHE_MESHES`` is True.
+
+        Parameters
+        ----------
+        region
+            Region acronym or ID.
+        mesh
+            The region's mesh in atlas space.
+        transformed
+            The region's mesh transformed to brainrender's axes
+            orientation, if None it is created from *mesh* when needed.
+
+        Returns
+        -------
+        list of Mesh
+            Empty if ``settings.USE_LOD`` is False or the mesh has
+            fewer than ``settings.LOD_MIN_VERTICES`` vertices.
+        """
+        if not settings.USE_LOD or mesh.npoints < settings.LOD_MIN_VERTICES:
+            return []
+
+        if settings.CACHE_MESHES:
+            folder = mesh_cache_folder(
+                self.atlas_name, self.metadata["version"]
+            )
+            key = f"{self._get_from_structure(region, 'id')}_{transform_key(mtx)}"
+
+        lods = []
+        for fraction in settings.LOD_LEVELS[1:]:
+            lod = None
+            if settings.CACHE_MESHES:
+                lod_key = f"{key}_lod{round(fraction * 100)}"
+                lod = load_mesh(folder, lod_key)
+
+            if lod is None:
+                if transformed is None:
+                    transformed = mesh.clone().apply_transform(mtx)
+                lod = _decimate(transformed, fraction)
+                if settings.CACHE_MESHES:
+                    save_mesh(lod, folder, lod_key)
+            lods.append(lod)
+        return lods
+
+    def _try_load_region_mesh(
+        self, region: str | int, lod: bool = False
+    ) -> tuple[Mesh, Mesh | None, list[Mesh]] | None:
+        """
+        Like ``_load_region_mesh`` but return None if the region has no
+        mesh. The region's lower levels of detail (see
+        ``_load_region_lods``) are returned too if *lod* is True.
+        """
+        try:
+            mesh, transformed = self._load_region_mesh(region)
+        except FileNotFoundError:
+            return None
+
+        lods = self._load_region_lods(region, mesh, transformed) if lod else []
+        return mesh, transformed, lods
+
     def get_region(
         self,
         *regions: str | int,
         alpha: float = 1,
         color: str | list[float] | None = None,
+        n_workers: int | None = None,
+        executor: Executor | None = None,
+        lod: bool = False,
     ) -> Actor | list[Actor] | None:
         """
         Get brain regions meshes as Actors.
 
+        Meshes can be loaded concurrently, the returned actors are
+        always in the same order as *regions*.
+
         Parameters
         ----------
         *regions
@@ -90,6 +250,19 @@ class Atlas(BrainGlobeAtlas):
             Mesh transparency. Default 1.
         color
             Uses atlas RGB colour if None.
+        n_workers
+            Number of threads used to load the meshes. Meshes are loaded
+            serially if None or 1.
+        executor
+            Executor used to load the meshes, takes precedence over
+            *n_workers*. Must be able to run bound methods (e.g. a
+            ``ThreadPoolExecutor``).
+        lod
+            If True, meshes at lower levels of detail (see
+            ``settings.LOD_LEVELS``) are made too, which takes longer
+            and uses more disk space in the mesh cache, but large
+            regions are then faster to render when small on screen or
+            while the camera moves. Default False.
 
         Returns
         -------
@@ -98,8 +271,7 @@ class Atlas(BrainGlobeAtlas):
         if not regions:
             return None
 
-        _color = color
-        actors = []
+        valid = []
         for region in regions:
             if (
                 region not in self.lookup_df.acronym.values
@@ -109,30 +281,214 @@ class Atlas(BrainGlobeAtlas):
                     f"The region {region} doesn't seem to belong to the atlas being used: {self.atlas_name}. Skipping"
                 )
                 continue
+            valid.append(region)
+
+        # Get meshes
+        load = partial(self._try_load_region_mesh, lod=lod)
+        if executor is not None:
+            loaded = list(executor.map(load, valid))
+        elif n_workers is not None and n_workers > 1 and len(valid) > 1:
+            with ThreadPoolExecutor(max_workers=n_workers) as pool:
+                loaded = list(pool.map(load, valid))
+        else:
+            loaded = [load(region) for region in valid]
 
-            # Get mesh
-            obj_file = str(self.meshfile_from_structure(region))
-            try:
-                mesh = load_mesh_from_file(obj_file, color=color, alpha=alpha)
-            except FileNotFoundError:
+        actors = []
+        for region, meshes in zip(valid, loaded):
+            if meshes is None:
                 print(
                     f"The region {region} is in the ontology but does not have a corresponding volume in the atlas being used: {self.atlas_name}. Skipping"
                 )
                 continue
-
-            # Get color
-            color = color or self._get_region_color(region)
+            mesh, transformed, lods = meshes
 
             # Make actor
             actor = Actor(mesh, name=region, br_class="brain region")
-            actor.c(color).alpha(alpha)
+            actor._lod_meshes = lods
+            actor.c(color or self._get_region_color(region)).alpha(alpha)
+            if transformed is not None:
+                # mesh already in brainrender's orientation, mirror what
+                # Render._prepare_actor would do
+                transformed.copy_properties_from(mesh)
+                actor._mesh = transformed
+                actor._is_transformed = True
+                actor.mesh.reverse()
             actors.append(actor)
 
-            # reset color to input
-            color = _color
-
         return return_list_smart(actors)
 
+    def _idx_from_coords_array(
+        self, coords: npt.ArrayLike, microns: bool
+    ) -> tuple[npt.NDArray[np.intp], npt.NDArray[np.bool_]]:
+        """
+        Convert an array of coordinates to voxel indices.
+
+        Indices are truncated towards zero like in ``_idx_from_coords``.
+
+        Parameters
+        ----------
+        coords
+            Array of shape (N, 3) with coordinates.
+        microns
+            If True, coordinates are interpreted in microns.
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            (N, 3) voxel indices and (N,) mask of the indices falling
+            inside the atlas volume. Indices outside the volume are
+            set to 0.
+        """
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+        if microns:
+            coords = coords / np.asarray(self.resolution)
+
+        idx = np.trunc(coords).astype(np.intp)
+        inside = np.all((idx >= 0) & (idx < np.asarray(self.shape)), axis=1)
+        idx[~inside] = 0
+        return idx, inside
+
+    def structures_from_coords(
+        self,
+        coords: npt.ArrayLike,
+        microns: bool = True,
+        as_acronym: bool = False,
+        hierarchy_lev: int | None = None,
+        key_error_string: str = "Outside atlas",
+    ) -> npt.NDArray:
+        """
+        Get the structure at each of a set of coordinates.
+
+        Vectorized version of ``structure_from_coords``, the annotation
+        volume is indexed once for all coordinates.
+
+        Parameters
+        ----------
+        coords
+            Array of shape (N, 3) with coordinates.
+        microns
+            If True, coordinates are interpreted in microns. Default True.
+        as_acronym
+            If True, return acronyms instead of IDs. Default False.
+        hierarchy_lev
+            If given, return the ancestor at this hierarchy level.
+        key_error_string
+            Acronym used for coordinates outside the atlas or not
+            matching any structure. Default ``"Outside atlas"``.
+
+        Returns
+        -------
+        numpy.ndarray
+            (N,) array of structure IDs (0 outside the atlas) or acronyms.
+        """
+        idx, inside = self._idx_from_coords_array(coords, microns)
+        rids = np.where(inside, self.annotation[tuple(idx.T)], 0)
+
+        if hierarchy_lev is None and not as_acronym:
+            return rids
+
+        # map each unique ID only once
+        unique, inverse = np.unique(rids, return_inverse=True)
+        if hierarchy_lev is not None:
+            unique = np.array(
+                [
+                    (
+                        self.structures[rid]["structure_id_path"][
+                            hierarchy_lev
+                        ]
+                        if rid in self.structures
+                        else rid
+                    )
+                    for rid in unique
+                ]
+            )
+
+        if as_acronym:
+            unique = np.array(
+                [
+                    (
+                        self.structures[rid]["acronym"]
+                        if rid in self.structures
+                        else key_error_string
+                    )
+                    for rid in unique
+                ]
+            )
+
+        return unique[inverse]
+
+    def hemispheres_from_coords(
+        self,
+        coords: npt.ArrayLike,
+        microns: bool = True,
+        as_string: bool = False,
+    ) -> npt.NDArray:
+        """
+        Get the hemisphere at each of a set of coordinates.
+
+        Vectorized version of ``hemisphere_from_coords``.
+
+        Parameters
+        ----------
+        coords
+            Array of shape (N, 3) with coordinates.
+        microns
+            If True, coordinates are interpreted in microns. Default True.
+        as_string
+            If True, return ``"left"``/``"right"``. Default False.
+
+        Returns
+        -------
+        numpy.ndarray
+            (N,) array with 1 (left), 2 (right) or 0 (outside the atlas),
+            or the matching strings (``"outside"`` for 0).
+        """
+        idx, inside = self._idx_from_coords_array(coords, microns)
+        hems = np.where(inside, self.hemispheres[tuple(idx.T)], 0)
+
+        if as_string:
+            return np.array(["outside", "left", "right"])[hems]
+        return hems
+
+    def in_region(
+        self,
+        coords: npt.ArrayLike,
+        regions: str | int | list[str | int],
+        include_descendants: bool = True,
+        microns: bool = True,
+    ) -> npt.NDArray[np.bool_]:
+        """
+        Get a mask of the coordinates falling in any of a set of regions.
+
+        Parameters
+        ----------
+        coords
+            Array of shape (N, 3) with coordinates.
+        regions
+            Region acronym(s) or ID(s).
+        include_descendants
+            If True, coordinates in the regions' descendants (e.g. the
+            layers of a cortical area) are included. Default True.
+        microns
+            If True, coordinates are interpreted in microns. Default True.
+
+        Returns
+        -------
+        numpy.ndarray
+            (N,) boolean mask.
+        """
+        ids = set(self._get_from_structure(listify(regions), "id"))
+
+        if include_descendants:
+            ids = {
+                s["id"]
+                for s in self.structures_list
+                if ids.intersection(s["structure_id_path"])
+            }
+
+        rids = self.structures_from_coords(coords, microns=microns)
+        return np.isin(rids, list(ids))
+
     def get_plane(
         self,
         pos: npt.ArrayLike | None = None,
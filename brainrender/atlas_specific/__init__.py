@@ -2,5 +2,6 @@ from brainrender.atlas_specific.allen_brain_atlas.gene_expression import (
     GeneExpressionAPI,
 )
 from brainrender.atlas_specific.allen_brain_atlas.streamlines import (
+    StreamlinesIndex,
     get_streamlines_for_region,
 )
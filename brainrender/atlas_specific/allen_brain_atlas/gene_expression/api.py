@@ -1,19 +1,37 @@
 import os
 import sys
-from time import sleep
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+import numpy as np
 import pandas as pd
 import requests
 from loguru import logger
+from rich.progress import track
+from vedo.colors import color_map
 
-from brainrender import base_dir
-from brainrender._io import fail_on_no_connection, request
-from brainrender.actors import Volume
+from brainrender import base_dir, settings
+from brainrender._io import retry_delay
+from brainrender._utils import listify, return_list_smart
+from brainrender.actors import RegionSet, Volume
 from brainrender.atlas_specific.allen_brain_atlas.gene_expression.ge_utils import (
-    check_gene_cached,
+    DOWNLOAD_RETRIES,
+    DOWNLOAD_TIMEOUT,
+    DOWNLOAD_WORKERS,
+    GeneStore,
+    aggregate_by_label,
     download_and_cache,
-    load_cached_gene,
+    get_gene_cache,
+    grid_annotation,
+    is_retryable,
+    load_genes_catalogue,
+    make_session,
+    read_raw,
+    sample_grid,
+    save_genes_catalogue,
 )
+from brainrender.render import mtx
 
 
 class GeneExpressionAPI:
@@ -35,71 +53,122 @@ class GeneExpressionAPI:
         + "rma::criteria,[failed$eq'false'],products[abbreviation$eq'Mouse'],genes[acronym$eq'-GENE_SYMBOL-']"
     )
 
-    download_url = "http://api.brain-map.org/grid_data/download/EXP_ID?include=energy,intensity,density"
+    download_url = (
+        "http://api.brain-map.org/grid_data/download/EXP_ID?include=METRICS"
+    )
+    metrics = ["energy", "intensity", "density"]
 
     gene_expression_cache = base_dir / "GeneExpressionCache"
+    genes_catalogue = "genes.npz"
     gene_name = None
 
     def __init__(self):
         # Get metadata about all available genes
-        self.genes = None  # when necessary gene data can be downloaded with self.get_all_genes
+        self.genes = None  # when necessary gene data are loaded with self.load_all_genes
+        self._id_by_symbol = None
+        self._symbol_by_id = None
+        self._grid_annotations = {}
         self.gene_expression_cache.mkdir(exist_ok=True)
+        self.cache = get_gene_cache(self.gene_expression_cache)
+        self.session = make_session(DOWNLOAD_WORKERS)
+
+    def _query(self, url, session=None):
+        """
+        Queries the Allen API and returns the 'msg' field of the response.
+        Failed requests and responses that aren't valid JSON (returned
+        when the API is overloaded) are retried with jittered exponential
+        backoff.
+
+        :param url: str, query url
+        :param session: requests.Session used for the request,
+            if None the API's session is used
+        """
+        session = session or self.session
+        for attempt in range(DOWNLOAD_RETRIES + 1):
+            try:
+                response = session.get(url, timeout=DOWNLOAD_TIMEOUT)
+                response.raise_for_status()
+                return response.json()["msg"]
+            except Exception as e:
+                if attempt == DOWNLOAD_RETRIES or not is_retryable(e):
+                    raise
+                delay = retry_delay(attempt)
+                logger.debug(
+                    f"Allen API query failed ({e}), retrying in {delay:.1f}s"
+                )
+                time.sleep(delay)
 
-    @fail_on_no_connection
     def get_all_genes(self):
         """
         Download metadata about all the genes available in the Allen gene expression dataset
         """
-        res = request(self.all_genes_url)
-        return pd.DataFrame(res.json()["msg"])
+        return pd.DataFrame(self._query(self.all_genes_url))
+
+    def load_all_genes(self, force_download=False):
+        """
+        Loads the metadata about all the genes from the catalogue saved
+        in the cache, which is downloaded again when it's older than
+        settings.GENE_CATALOGUE_TTL days. Gene symbols and ids are
+        indexed for fast lookups.
+
+        :param force_download: bool, if True the catalogue is downloaded
+            even if it's in the cache
+        """
+        path = self.gene_expression_cache / self.genes_catalogue
+        genes = None
+        if not force_download:
+            genes = load_genes_catalogue(path, settings.GENE_CATALOGUE_TTL)
+
+        if genes is None:
+            try:
+                genes = self.get_all_genes()
+            except (requests.RequestException, ValueError):
+                genes = load_genes_catalogue(path)  # outdated but usable
+                if genes is None:
+                    raise
+                logger.warning("Failed to update the genes catalogue")
+            else:
+                save_genes_catalogue(genes, path)
+
+        # the first gene with each symbol or id is used, as in the table
+        symbols = genes.gene_symbol.astype(str).to_numpy()
+        ids = genes.id.astype(str).to_numpy()
+        self._id_by_symbol = dict(zip(symbols[::-1], ids[::-1]))
+        self._symbol_by_id = dict(zip(ids[::-1], symbols[::-1]))
+        self.genes = genes
+        return genes
 
     def get_gene_id_by_name(self, gene_name):
         self.gene_name = self.gene_name or gene_name
-        if self.genes is None:
-            self.genes = self.get_all_genes()
+        if self._id_by_symbol is None:
+            self.load_all_genes()
 
-        if gene_name not in self.genes.gene_symbol.values:
+        if gene_name not in self._id_by_symbol:
             print(
                 f"Gene name {gene_name} doesn't appear in the genes dataset, nothing to return\n"
                 + "You can search for you gene here: https://mouse.brain-map.org/"
             )
             return None
         else:
-            return int(
-                self.genes.loc[self.genes.gene_symbol == gene_name].id.values[
-                    0
-                ]
-            )
+            return int(self._id_by_symbol[gene_name])
 
     def get_gene_symbol_by_id(self, gene_id):
-        if self.genes is None:
-            self.genes = self.get_all_genes()
+        if self._symbol_by_id is None:
+            self.load_all_genes()
 
-        return self.genes.loc[
-            self.genes.id == str(gene_id)
-        ].gene_symbol.values[0]
+        return self._symbol_by_id[str(gene_id)]
 
-    @fail_on_no_connection
-    def get_gene_experiments(self, gene):
+    def get_gene_experiments(self, gene, session=None):
         """
         Given a gene_symbol it returns the list of ISH
         experiments for this gene
 
         :param gene_symbol: str
+        :param session: requests.Session used for the request,
+            if None the API's session is used
         """
         url = self.gene_experiments_url.replace("-GENE_SYMBOL-", gene)
-        max_retries = 8
-        delay = 4
-        data = None
-
-        for i in range(max_retries):
-            try:
-                data = request(url).json()["msg"]
-                break
-            except requests.exceptions.JSONDecodeError:
-                print(f"Unable to connect to Allen API, retrying in {delay}")
-                sleep(delay)
-                delay *= 2
+        data = self._query(url, session=session)
 
         if not len(data):
             print(f"No experiment found for gene {gene}")
@@ -107,15 +176,17 @@ class GeneExpressionAPI:
         else:
             return [d["id"] for d in data]
 
-    @fail_on_no_connection
-    def download_gene_data(self, gene):
+    def download_gene_data(self, gene, metrics=None):
         """
         Downloads a gene's data from the Allen Institute
         Gene Expression dataset and saves to cache.
         See: http://help.brain-map.org/display/api/Downloading+3-D+Expression+Grid+Data
 
         :param gene: int, the gene_id for the gene being downloaded.
+        :param metrics: list of str, metrics to download (e.g. ['energy']).
+            If None all metrics are downloaded
         """
+        metrics = metrics or self.metrics
         # Get the gene's experiment id
         exp_ids = self.get_gene_experiments(gene)
 
@@ -125,10 +196,114 @@ class GeneExpressionAPI:
         # download experiment data
         for eid in exp_ids:
             print(f"Downloading data for {gene} - experiment: {eid}")
-            url = self.download_url.replace("EXP_ID", str(eid))
-            download_and_cache(
-                url, os.path.join(self.gene_expression_cache, f"{gene}-{eid}")
-            )
+            self._download_experiment(gene, eid, metrics)
+
+    def _download_experiment(self, gene, exp_id, metrics, session=None):
+        """
+        Downloads a gene experiment's data and adds them to the cache,
+        which is only updated once all files are extracted.
+
+        :param gene: str, gene symbol
+        :param exp_id: int, experiment id
+        :param metrics: list of str, metrics to download (e.g. ['energy'])
+        :param session: requests.Session used for the requests,
+            if None the API's session is used
+        """
+        url = self.download_url.replace("EXP_ID", str(exp_id)).replace(
+            "METRICS", ",".join(metrics)
+        )
+        download_and_cache(
+            url,
+            self.cache.folder_for(gene, exp_id),
+            metrics,
+            session=session or self.session,
+        )
+        self.cache.add(gene, exp_id)
+
+    def fetch_genes(
+        self,
+        genes,
+        metric="energy",
+        use_cache=True,
+        max_concurrency=DOWNLOAD_WORKERS,
+    ):
+        """
+        Gets the data of all the ISH experiments of many genes,
+        downloading the experiments that aren't cached concurrently.
+        Experiments that can't be downloaded are skipped.
+        Returns a dictionary with, for each gene, a dictionary with
+        the grid data of each experiment.
+
+        :param genes: list of str, gene symbols
+        :param metric: str, e.g. 'energy'
+        :param use_cache: bool, if False the data are downloaded again
+        :param max_concurrency: int, max number of requests at the same time
+        """
+        genes = list(dict.fromkeys(genes))
+        session = (
+            self.session
+            if max_concurrency <= DOWNLOAD_WORKERS
+            else make_session(max_concurrency)
+        )
+
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            # get the experiments of each gene
+            futures = {
+                executor.submit(
+                    self.get_gene_experiments, gene, session=session
+                ): gene
+                for gene in genes
+            }
+            experiments = {}
+            for future in as_completed(futures):
+                gene = futures[future]
+                try:
+                    experiments[gene] = future.result() or []
+                except Exception as e:
+                    logger.warning(
+                        f"Failed to get the experiments of gene {gene}: {e}"
+                    )
+                    experiments[gene] = []
+
+            # download those not in the cache
+            missing = [
+                (gene, eid)
+                for gene in genes
+                for eid in experiments[gene]
+                if not use_cache or self.cache.get(gene, eid, metric) is None
+            ]
+            futures = {
+                executor.submit(
+                    self._download_experiment,
+                    gene,
+                    eid,
+                    [metric],
+                    session=session,
+                ): (gene, eid)
+                for gene, eid in missing
+            }
+            for future in track(
+                as_completed(futures),
+                total=len(futures),
+                description="Downloading gene expression data...",
+                disable=not futures,
+            ):
+                gene, eid = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.warning(
+                        f"Failed to download gene {gene} experiment {eid}: {e}"
+                    )
+
+        data = {}
+        for gene in genes:
+            data[gene] = {}
+            for eid in experiments[gene]:
+                path = self.cache.get(gene, eid, metric)
+                if path is not None:
+                    data[gene][eid] = self._read(path)
+        return data
 
     def get_gene_data(self, gene, exp_id, use_cache=True, metric="energy"):
         """
@@ -139,26 +314,189 @@ class GeneExpressionAPI:
 
         # Check if gene-experiment cached
         if use_cache:
-            cache = check_gene_cached(self.gene_expression_cache, gene, exp_id)
+            path = self.cache.get(gene, exp_id, metric)
         else:
-            cache = False
+            path = None
 
-        if not cache:  # then download it
-            self.download_gene_data(gene)
-            cache = check_gene_cached(self.gene_expression_cache, gene, exp_id)
-            if not cache:
+        if path is None:  # then download it
+            self.download_gene_data(gene, [metric])
+            path = self.cache.get(gene, exp_id, metric)
+            if path is None:
                 raise ValueError(  # pragma: no cover
                     "Something went wrong and data were not cached"
                 )
 
         # Load from cache
-        data = load_cached_gene(cache, metric, self.grid_size)
+        return self._read(path)
+
+    def _read(self, path):
+        """
+        Loads a cached grid data file.
+
+        :param path: Path, path to the .raw file
+        """
+        data = read_raw(path, self.grid_size)
 
         if sys.platform == "darwin":
             data = data.T
 
         return data
 
+    def get_gene_store(self, metric="energy"):
+        """
+        Returns a GeneStore with the data of all cached gene experiments
+        stacked in one memory-mapped (n_experiments, *grid_size) array.
+        The store is updated when new experiments are cached.
+
+        :param metric: str, e.g. 'energy'
+        """
+        return GeneStore.open(self.cache, metric, self.grid_size)
+
+    def get_grid_annotation(self, atlas):
+        """
+        Returns the atlas' annotation downsampled to the gene expression
+        grid (see ge_utils.grid_annotation). It is computed once per
+        atlas and saved in the cache.
+
+        :param atlas: brainrender Atlas
+        """
+        name = f"{atlas.atlas_name}_v{atlas.metadata['version']}"
+        if name not in self._grid_annotations:
+            folder = self.gene_expression_cache / ".annotations"
+            path = folder / f"{name}_{self.voxel_size}um.npy"
+            try:
+                annotation = np.load(path)
+            except (OSError, ValueError):
+                annotation = grid_annotation(
+                    atlas, self.grid_size, self.voxel_size
+                )
+                folder.mkdir(exist_ok=True)
+                fd, tmp = tempfile.mkstemp(suffix=".npy", dir=folder)
+                try:
+                    with os.fdopen(fd, "wb") as fout:
+                        np.save(fout, annotation)
+                    os.replace(tmp, path)
+                except BaseException:
+                    os.remove(tmp)
+                    raise
+            self._grid_annotations[name] = annotation
+        return self._grid_annotations[name]
+
+    def get_region_expression(self, data, atlas, regions=None, stat="mean"):
+        """
+        Computes the mean or max expression in brain regions (including
+        their subregions) of many gene grids at once. Returns a
+        pd.DataFrame with one row per grid and one column per region.
+
+        :param data: np.ndarray with a grid or a stack of grids
+            (n_grids, *grid_size), a GeneStore, or a dictionary
+            of grids (e.g. from fetch_genes)
+        :param atlas: brainrender Atlas
+        :param regions: list of str, acronyms of the regions. If None
+            all regions with voxels in the grid are used
+        :param stat: str, 'mean' or 'max'
+        """
+        if stat not in ("mean", "max"):
+            raise ValueError(f"stat should be 'mean' or 'max', not {stat}")
+
+        # stack grids, with a name for each
+        if isinstance(data, GeneStore):
+            names, data = data.keys, data.data
+        elif isinstance(data, dict):
+            grids = {}
+            for key, value in data.items():
+                if isinstance(value, dict):  # {gene: {exp_id: grid}}
+                    grids.update({f"{key}-{e}": g for e, g in value.items()})
+                else:
+                    grids[key] = value
+            names = list(grids)
+            data = np.stack(list(grids.values())) if grids else np.empty(0)
+        else:
+            data = np.asarray(data)
+            if data.ndim == 3:
+                names, data = [self.gene_name], data[None]
+            else:
+                names = list(range(len(data)))
+        data = np.reshape(data, (len(names), -1))
+
+        annotation = self.get_grid_annotation(atlas).ravel()
+        ids, labels = np.unique(annotation, return_inverse=True)
+        labels[annotation == 0] = -1  # voxels outside of the brain
+
+        # ancestors of the structure labelling each voxel
+        paths = {}
+        for sid in ids[ids > 0]:
+            try:
+                paths[sid] = atlas.structures[int(sid)]["structure_id_path"]
+            except KeyError:
+                logger.debug(f"Structure {sid} isn't in the atlas")
+
+        if regions is None:
+            region_ids = sorted({rid for p in paths.values() for rid in p})
+            regions = [atlas.structures[rid]["acronym"] for rid in region_ids]
+        else:
+            region_ids = [atlas.structures[r]["id"] for r in regions]
+
+        # which labels are in each region
+        column = {rid: j for j, rid in enumerate(region_ids)}
+        members = np.zeros((len(ids), len(regions)), dtype=bool)
+        for i, sid in enumerate(ids):
+            for rid in paths.get(sid, []):
+                if rid in column:
+                    members[i, column[rid]] = True
+
+        if stat == "mean":
+            agg = aggregate_by_label(data, labels, len(ids), ("sum", "count"))
+            with np.errstate(invalid="ignore", divide="ignore"):
+                values = (agg["sum"] @ members) / (agg["count"] @ members)
+        else:
+            agg = aggregate_by_label(data, labels, len(ids), ("max",))
+            values = np.full((len(data), len(regions)), np.nan)
+            for j in range(len(regions)):
+                if members[:, j].any():
+                    values[:, j] = np.fmax.reduce(
+                        agg["max"][:, members[:, j]], axis=1
+                    )
+
+        return pd.DataFrame(values, index=names, columns=regions)
+
+    def color_regions(
+        self, actors, values, cmap="viridis", vmin=None, vmax=None
+    ):
+        """
+        Colors brain region actors (e.g. from Scene.add_brain_region)
+        by a value for each region, such as a row of the table returned
+        by get_region_expression. Regions without a value are not changed.
+
+        :param actors: list of brain region Actors or RegionSets
+        :param values: pd.Series or dict with a value for each region
+        :param cmap: str, name of the colormap
+        :param vmin: float, value mapped to the first color,
+            the smallest value if None
+        :param vmax: float, value mapped to the last color,
+            the largest value if None
+        """
+        values = pd.Series(values, dtype=float).dropna()
+        if values.empty:
+            return actors
+
+        vmin = values.min() if vmin is None else vmin
+        vmax = values.max() if vmax is None else vmax
+        colors = dict(
+            zip(values.index, color_map(values.values, cmap, vmin, vmax))
+        )
+
+        for actor in listify(actors):
+            if isinstance(actor, RegionSet):
+                for region in actor.regions:
+                    if region in colors:
+                        actor.set_color(region, colors[region])
+            elif actor.name in colors:
+                actor.mesh.c(colors[actor.name])
+                if "_mesh" in actor.__dict__:  # the rendered copy
+                    actor._mesh.c(colors[actor.name])
+        return actors
+
     def griddata_to_volume(
         self,
         griddata,
@@ -186,3 +524,56 @@ class GeneExpressionAPI:
             name=self.gene_name,
             br_class="Gene Data",
         )
+
+    def griddata_to_regions(
+        self, griddata, actors, cmap="bwr", vmin=None, vmax=None
+    ):
+        """
+        Colors the surface of brain region actors (e.g. from
+        Atlas.get_region) with gene expression data: the grid is
+        trilinearly interpolated at each vertex of the regions' meshes
+        and the values are used as point scalars. All regions share the
+        same color scale. Vertices without data are colored in gray.
+
+        :param griddata: np.ndarray, 3d array with gene expression data
+        :param actors: list of brain region Actors
+        :param cmap: str, name of the colormap
+        :param vmin: float, value mapped to the first color,
+            the smallest sampled value if None
+        :param vmax: float, value mapped to the last color,
+            the largest sampled value if None
+        """
+        to_atlas = np.linalg.inv(mtx)
+        actors = listify(actors)
+
+        # meshes of each actor with the coordinates of their
+        # vertices in atlas space
+        meshes = []
+        for actor in actors:
+            meshes.append((actor.mesh, actor.mesh.vertices))
+            transformed = [actor.__dict__.get("_mesh")] + actor._lod_meshes
+            for mesh in transformed:
+                if mesh is not None:
+                    points = mesh.vertices @ to_atlas[:3, :3].T
+                    meshes.append((mesh, points + to_atlas[:3, 3]))
+
+        values = [
+            sample_grid(griddata, points, self.voxel_size)
+            for _, points in meshes
+        ]
+        if values and vmin is None:
+            vmin = np.nanmin(np.concatenate(values))
+        if values and vmax is None:
+            vmax = np.nanmax(np.concatenate(values))
+
+        for (mesh, _), vals in zip(meshes, values):
+            mesh.cmap(
+                cmap,
+                vals,
+                on="points",
+                name="expression",
+                vmin=vmin,
+                vmax=vmax,
+            )
+            mesh.mapper.GetLookupTable().SetNanColor(0.5, 0.5, 0.5, 1)
+        return return_list_smart(actors)
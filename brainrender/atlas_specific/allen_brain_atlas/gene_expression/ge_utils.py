@@ -1,57 +1,492 @@
-import io
+import json
 import os
+import shutil
 import sys
+import tempfile
+import threading
+import time
 import zipfile
+from contextlib import contextmanager
+from pathlib import Path
 
 import numpy as np
+import pandas as pd
+import requests
+from loguru import logger
+from requests.adapters import HTTPAdapter
 
-from brainrender._io import check_file_exists, request
-from brainrender._utils import get_subdirs, listdir
+from brainrender import settings
+from brainrender._io import check_file_exists, retry_delay
 
 # ----------------------------------- Cache ---------------------------------- #
 
+MANIFEST = "manifest.json"
+
+
+LOCK_TIMEOUT = 60  # seconds waited for another process to save the manifest
+LOCK_STALE = (
+    60  # seconds after which a lock left by a crashed process is ignored
+)
+
+
+@contextmanager
+def file_lock(path, timeout=LOCK_TIMEOUT, stale=LOCK_STALE):
+    """
+    Context manager holding a lock shared by all processes: the lock is
+    a file created exclusively and removed on exit. Locks older than
+    stale seconds are considered left by a process that crashed.
+
+    :param path: str or Path, path to the lock file
+    :param timeout: float, seconds to wait for the lock before
+        raising TimeoutError
+    :param stale: float, age in seconds of locks that are ignored
+    """
+    path = Path(path)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - path.stat().st_mtime > stale:
+                    logger.debug(f"Removing stale lock: {path}")
+                    path.unlink(missing_ok=True)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Could not acquire lock: {path}")
+            time.sleep(0.01)
+    try:
+        yield
+    finally:
+        path.unlink(missing_ok=True)
+
+
+class GeneCache:
+    """
+    Index of the gene expression data saved in a cache folder.
+    Each gene-experiment is saved in a folder named gene-exp_id, the
+    manifest file maps each gene, experiment and metric to the path
+    and size of its data file, so that cached data are found without
+    scanning the cache folder. Data files whose size doesn't match
+    the manifest (e.g. truncated) are considered not cached.
+    The manifest can be shared by several processes: changes are
+    merged with the manifest on disk while holding a lock file.
+    When the cache is bigger than settings.GENE_CACHE_MAX_SIZE, the
+    least recently used experiments are removed: each lookup touches
+    the gene-experiment folder, so its modification time is the time
+    it was last used.
+    """
+
+    def __init__(self, folder):
+        """
+        :param folder: str or Path, path to the cache folder
+        """
+        self.folder = Path(folder)
+        self.path = self.folder / MANIFEST
+        self._lock = threading.RLock()
+        self._mtime = None
+
+        self.entries = self._read()
+        if self.entries is None:
+            if self.path.exists():
+                logger.debug(f"Corrupted gene cache manifest: {self.path}")
+            self.entries = scanned = self._scan()
+
+            def merge(entries):
+                # another process may have saved a manifest meanwhile
+                for key, entry in scanned.items():
+                    entries.setdefault(key, entry)
+
+            if scanned or self.path.exists():
+                self._update(merge)
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def _key(gene, exp_id):
+        return f"{gene}-{exp_id}"
+
+    @property
+    def size(self):
+        """
+        Total size in bytes of the cached data files.
+        """
+        return sum(
+            f["size"]
+            for entry in self.entries.values()
+            for f in entry["files"].values()
+        )
+
+    def _index_folder(self, folder):
+        """
+        Returns the path and size of each data file in
+        a gene-experiment folder, by metric (e.g. 'energy').
+        """
+        files = {}
+        for f in sorted(Path(folder).iterdir()):
+            if f.is_file() and f.suffix != ".mhd" and f.name[0] != ".":
+                files[f.stem] = dict(
+                    path=f.relative_to(self.folder).as_posix(),
+                    size=f.stat().st_size,
+                )
+        return files
+
+    def _scan(self):
+        """
+        Indexes the data cached before the manifest was introduced.
+        """
+        entries = {}
+        if not self.folder.is_dir():
+            return entries
+
+        for sub in sorted(self.folder.iterdir()):
+            if sub.is_dir() and not sub.name.startswith("."):
+                entries[sub.name] = dict(files=self._index_folder(sub))
+        return entries
+
+    def _read(self):
+        """
+        Returns the entries of the manifest on disk, or None if
+        it doesn't exist or is corrupted.
+        """
+        try:
+            mtime = self.path.stat().st_mtime_ns
+            with open(self.path) as fin:
+                entries = json.load(fin)["entries"]
+        except (OSError, ValueError, KeyError):
+            return None
+        self._mtime = mtime
+        return entries
+
+    def _refresh(self):
+        """
+        Reloads the manifest if another process changed it.
+        """
+        try:
+            changed = self.path.stat().st_mtime_ns != self._mtime
+        except FileNotFoundError:
+            return
+        if changed:
+            entries = self._read()
+            if entries is not None:
+                self.entries = entries
+
+    def _save(self):
+        """
+        Saves the manifest. It is first written to a temporary file
+        which is then renamed, so that an interrupted write never
+        leaves a partial manifest.
+        """
+        self.folder.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(
+            prefix=".manifest-", suffix=".json", dir=self.folder
+        )
+        try:
+            with os.fdopen(fd, "w") as fout:
+                json.dump(dict(entries=self.entries), fout)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        self._mtime = self.path.stat().st_mtime_ns
+
+    def _update(self, change):
+        """
+        Applies a change to the entries and saves the manifest. While
+        holding the lock file, the manifest is read again so that the
+        entries saved by other processes since it was read aren't lost.
+
+        :param change: callable, takes the dictionary of entries
+            and changes it in place
+        """
+        self.folder.mkdir(parents=True, exist_ok=True)
+        with self._lock, file_lock(self.folder / f".{MANIFEST}.lock"):
+            entries = self._read()
+            if entries is not None:
+                self.entries = entries
+            change(self.entries)
+            self._save()
+
+    def folder_for(self, gene, exp_id):
+        """
+        Returns the folder in which a gene-experiment's data are saved.
+
+        :param gene: str, gene symbol
+        :param exp_id: int, experiment id
+        """
+        return self.folder / self._key(gene, exp_id)
+
+    def get(self, gene, exp_id, metric=None):
+        """
+        Returns the path to a cached data file, or to the gene-experiment
+        folder if no metric is given. Returns None if it is not cached.
+
+        :param gene: str, gene symbol
+        :param exp_id: int, experiment id
+        :param metric: str, e.g. 'energy'
+        """
+        key = self._key(gene, exp_id)
+        with self._lock:
+            if key not in self.entries:  # maybe cached by another process
+                self._refresh()
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+
+            if metric is None:
+                path = self.folder / key
+                valid = path.is_dir()
+            elif metric in entry["files"]:
+                path = self.folder / entry["files"][metric]["path"]
+                try:
+                    size = path.stat().st_size
+                except FileNotFoundError:
+                    size = None
+                valid = size == entry["files"][metric]["size"]
+            else:
+                return None
+
+            if not valid:  # removed or changed from outside brainrender
+                logger.debug(f"Cached gene data not found or changed: {path}")
+                self._update(lambda entries: entries.pop(key, None))
+                return None
+
+            os.utime(self.folder / key)  # mark as recently used
+        return path
+
+    def add(self, gene, exp_id):
+        """
+        Adds the data saved in a gene-experiment folder to the index,
+        then removes the least recently used data if the cache is
+        too big.
+
+        :param gene: str, gene symbol
+        :param exp_id: int, experiment id
+        """
+        folder = self.folder_for(gene, exp_id)
+        entry = dict(files=self._index_folder(folder))
+
+        def change(entries):
+            entries[folder.name] = entry
+            self._evict(entries, keep=folder.name)
+
+        self._update(change)
+
+    def remove(self, gene, exp_id):
+        """
+        Removes a gene-experiment's data from the cache.
+
+        :param gene: str, gene symbol
+        :param exp_id: int, experiment id
+        """
+        key = self._key(gene, exp_id)
+
+        def change(entries):
+            entries.pop(key, None)
+            shutil.rmtree(self.folder / key, ignore_errors=True)
+
+        self._update(change)
+
+    def _evict(self, entries, keep=None):
+        """
+        Removes the least recently used data until the cache
+        is smaller than settings.GENE_CACHE_MAX_SIZE.
+
+        :param entries: dict, entries of the manifest, changed in place
+        :param keep: str, entry that shouldn't be removed
+        """
+        max_size = settings.GENE_CACHE_MAX_SIZE
+        if max_size is None:
+            return
+
+        def last_used(key):
+            try:
+                return (self.folder / key).stat().st_mtime
+            except FileNotFoundError:
+                return 0
+
+        size = sum(
+            f["size"]
+            for entry in entries.values()
+            for f in entry["files"].values()
+        )
+        by_use = sorted(entries, key=last_used)
+        for key in by_use:
+            if size <= max_size:
+                break
+            if key == keep:
+                continue
+
+            logger.debug(f"Removing gene data from cache: {key}")
+            entry = entries.pop(key)
+            size -= sum(f["size"] for f in entry["files"].values())
+            shutil.rmtree(self.folder / key, ignore_errors=True)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_gene_cache(cache_folder):
+    """
+    Returns the GeneCache of a cache folder, the manifest
+    is read once and shared by all users of the folder.
+
+    :param cache_folder: str or Path, path to the cache folder
+    """
+    folder = Path(cache_folder).resolve()
+    with _caches_lock:
+        if folder not in _caches:
+            _caches[folder] = GeneCache(folder)
+        return _caches[folder]
+
 
 def check_gene_cached(cache_folder, gene_id, exp_id):
     """
     A gene is saved in a folder in cache_folder
-    with gene_id-exp_id as name. If the folder doesn't
-    exist the gene is not cached.
+    with gene_id-exp_id as name. If the folder isn't
+    in the cache's index the gene is not cached.
 
     :param cache_folder: str, path to general cache folder for all data
     :param gene_id: str name of gene
     :param exp_id: id of experiment
     """
-    cache = [
-        sub
-        for sub in get_subdirs(cache_folder)
-        if f"{gene_id}-{exp_id}" == os.path.basename(sub)
-    ]
-    if not cache:
-        return False
-    elif len(cache) > 1:
-        raise ValueError("Found too many folders")
-    else:
-        return cache[0]
+    path = get_gene_cache(cache_folder).get(gene_id, exp_id)
+    return False if path is None else str(path)
+
+
+DOWNLOAD_WORKERS = 8  # experiments downloaded at the same time
+DOWNLOAD_RETRIES = 3  # attempts after a failed request
+DOWNLOAD_TIMEOUT = 60  # seconds
+RETRY_STATUS = (429, 500, 502, 503, 504)  # server errors worth retrying
+
+
+def make_session(max_workers=DOWNLOAD_WORKERS):
+    """
+    Creates a requests session with a connection pool
+    shared by all download threads.
+
+    :param max_workers: int, number of threads using the session
+    """
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def is_retryable(error):
+    """
+    Whether a request that failed with an error should be tried again:
+    connection errors, timeouts and server errors (see RETRY_STATUS).
+
+    :param error: Exception raised by the request
+    """
+    if isinstance(error, requests.HTTPError):
+        return error.response.status_code in RETRY_STATUS
+    return isinstance(error, (requests.RequestException, ValueError))
+
+
+def _stream_to_file(url, path, session=None, chunk_size=1 << 20):
+    """
+    Streams the content of a url to a file. If the file exists
+    the download is resumed from its end (with an HTTP Range request).
+    Raises ValueError if fewer bytes than announced by the server
+    were received, the partial file is kept to resume the download.
+
+    :param url: str, url to download
+    :param path: Path, file to write to
+    :param session: requests.Session used for the request, if None
+        a new connection is made
+    :param chunk_size: int, number of bytes written at once
+    """
+    start = path.stat().st_size if path.exists() else 0
+    headers = {"Range": f"bytes={start}-"} if start else {}
+
+    with (session or requests).get(
+        url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT
+    ) as response:
+        if response.status_code == 416:  # nothing left to download
+            return
+        response.raise_for_status()
+        if response.status_code != 206:  # the server sent the whole file
+            start = 0
+
+        # the length of compressed responses isn't that of the content
+        expected = response.headers.get("Content-Length")
+        if response.headers.get("Content-Encoding"):
+            expected = None
+        with open(path, "ab" if start else "wb") as fout:
+            for chunk in response.iter_content(chunk_size):
+                fout.write(chunk)
+
+    if expected is not None and path.stat().st_size != start + int(expected):
+        raise ValueError(f"Incomplete download from {url}")
 
 
-def download_and_cache(url, cachedir):
+def download_and_cache(url, cachedir, metrics=None, session=None):
     """
     Given a url to download a gene's ISH experiment data,
-    this function download and unzips the data
+    this function download and unzips the data.
+    The zipped data are streamed to a temporary file, so that
+    interrupted downloads are resumed (after a jittered exponential
+    backoff, see retry_delay), and only the files of
+    the requested metrics are extracted. Extracted files are
+    verified against the checksums (CRC) stored in the zip file.
 
     :param url: str, utl to download data
     :param cachedir: str, path to folder where data will be downloaded
+    :param metrics: list of str, metrics to extract (e.g. ['energy']).
+        If None all files are extracted
+    :param session: requests.Session used for the requests, if None
+        new connections are made
     """
+    cachedir = Path(cachedir)
+    part = cachedir.parent / f".{cachedir.name}.zip.part"
+
     # Get data
-    req = request(url)
+    for attempt in range(DOWNLOAD_RETRIES + 1):
+        try:
+            _stream_to_file(url, part, session=session)
+            break
+        except Exception as e:
+            if attempt == DOWNLOAD_RETRIES or not is_retryable(e):
+                raise
+            delay = retry_delay(attempt)
+            logger.debug(
+                f"Download of {url} failed ({e}), resuming in {delay:.1f}s"
+            )
+            time.sleep(delay)
 
     # Create cache dir
-    if not os.path.isdir(cachedir):
-        os.mkdir(cachedir)
+    cachedir.mkdir(exist_ok=True)
+
+    # Unzip to cache dir, files are renamed once complete
+    try:
+        with zipfile.ZipFile(part) as z:
+            for name in z.namelist():
+                filename = Path(name).name
+                if metrics is not None and not any(
+                    m in filename for m in metrics
+                ):
+                    continue
 
-    # Unzip to cache dir
-    z = zipfile.ZipFile(io.BytesIO(req.content))
-    z.extractall(cachedir)
+                fd, tmp = tempfile.mkstemp(prefix=".", dir=cachedir)
+                try:
+                    with z.open(name) as fin, os.fdopen(fd, "wb") as fout:
+                        shutil.copyfileobj(fin, fout)
+                    os.replace(tmp, cachedir / filename)
+                except BaseException:
+                    os.remove(tmp)
+                    raise
+    except zipfile.BadZipFile as e:
+        raise ValueError(f"Corrupted download from {url}: {e}") from e
+    finally:
+        part.unlink(missing_ok=True)
 
 
 def load_cached_gene(cache, metric, grid_size):
@@ -59,7 +494,9 @@ def load_cached_gene(cache, metric, grid_size):
     Loads a gene's data from cache
     """
     files = [
-        f for f in listdir(cache) if metric in f and not f.endswith(".mhd")
+        f.path
+        for f in os.scandir(cache)
+        if metric in f.name and not f.name.endswith(".mhd")
     ]
     if not files:
         return None
@@ -69,7 +506,74 @@ def load_cached_gene(cache, metric, grid_size):
         return read_raw(files[0], grid_size)
 
 
+# ----------------------------- Genes catalogue ----------------------------- #
+def save_genes_catalogue(genes, path):
+    """
+    Saves the table of all genes to a .npz file, with one array
+    of strings per column. The file is first written to a temporary
+    file which is then renamed, so that an interrupted write never
+    leaves a partial file.
+
+    :param genes: pd.DataFrame, table of genes (see get_all_genes)
+    :param path: str or Path, path to the file
+    """
+    path = Path(path)
+    columns = {
+        col: genes[col].fillna("").astype(str).to_numpy(dtype=str)
+        for col in genes.columns
+    }
+    fd, tmp = tempfile.mkstemp(
+        prefix=f".{path.stem}-", suffix=".npz", dir=path.parent
+    )
+    try:
+        with os.fdopen(fd, "wb") as fout:
+            np.savez(fout, **columns)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def load_genes_catalogue(path, max_age=None):
+    """
+    Loads the table of all genes saved by save_genes_catalogue,
+    returns None if the file doesn't exist or is older than max_age.
+
+    :param path: str or Path, path to the file
+    :param max_age: float, max age of the file in days. If None
+        the file is loaded however old it is
+    """
+    path = Path(path)
+    try:
+        age = (time.time() - path.stat().st_mtime) / (24 * 3600)
+    except FileNotFoundError:
+        return None
+    if max_age is not None and age > max_age:
+        return None
+
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            return pd.DataFrame({col: data[col] for col in data.files})
+    except (OSError, ValueError) as e:
+        logger.debug(f"Corrupted genes catalogue {path}: {e}")
+        return None
+
+
 # --------------------------------- Open .raw -------------------------------- #
+def memmap_raw(filepath, grid_size):
+    """
+    Memory-maps a .raw file with gene expression data, the data
+    are only read from disk when accessed. The array is copy-on-write:
+    it can be modified without changing the file.
+
+    :param filepath: str or Path object
+    :param grid_size: list, number of voxels along each direction
+    """
+    return np.memmap(
+        str(filepath), dtype="float32", mode="c", shape=tuple(grid_size)
+    )
+
+
 @check_file_exists
 def read_raw(filepath, grid_size):
     """
@@ -81,16 +585,299 @@ def read_raw(filepath, grid_size):
 
     :param filepath: str or Path object
     """
-    filepath = str(filepath)
-
-    # Read bytes
-    with open(filepath, "rb") as test:
-        content = test.read()
-
-    # Create np array and return
-    data = np.frombuffer(content, dtype="float32").reshape(grid_size)
+    data = memmap_raw(filepath, grid_size)
 
     if sys.platform == "darwin":
         data = data.T  # TODO figure out why this is necessary on Mac OS?
 
     return data
+
+
+# ------------------------------- Gene store -------------------------------- #
+STORE_FOLDER = ".store"
+
+
+class GeneStore:
+    """
+    The cached grids of one metric (e.g. 'energy') of all gene
+    experiments, stacked in a single memory-mapped array with shape
+    (n_experiments, *grid_size) saved in the cache folder. Rows are
+    indexed by gene and experiment, so that queries across many genes
+    don't need to load each gene's file.
+    """
+
+    def __init__(self, path):
+        """
+        Opens a store saved by GeneStore.build.
+
+        :param path: str or Path, path to the store's .npy file
+        """
+        self.path = Path(path)
+        self.data = np.load(self.path, mmap_mode="r")
+        with open(self.path.with_suffix(".json")) as fin:
+            self.keys = json.load(fin)["keys"]
+
+        if len(self.keys) != len(self.data):
+            raise ValueError(
+                f"Gene store index doesn't match its data: {path}"
+            )
+        self._rows = {key: row for row, key in enumerate(self.keys)}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __repr__(self):  # pragma: no cover
+        return f"GeneStore({len(self)} experiments, {self.path.stem})"
+
+    @property
+    def genes(self):
+        """
+        Gene symbol of each row.
+        """
+        return [key.rsplit("-", 1)[0] for key in self.keys]
+
+    @property
+    def exp_ids(self):
+        """
+        Experiment id of each row.
+        """
+        return [int(key.rsplit("-", 1)[1]) for key in self.keys]
+
+    def row(self, gene, exp_id):
+        """
+        Index of the row with a gene-experiment's data.
+
+        :param gene: str, gene symbol
+        :param exp_id: int, experiment id
+        """
+        return self._rows[f"{gene}-{exp_id}"]
+
+    def get(self, gene, exp_id):
+        """
+        Returns a gene-experiment's grid, a view of the memory-mapped data.
+
+        :param gene: str, gene symbol
+        :param exp_id: int, experiment id
+        """
+        return self.data[self.row(gene, exp_id)]
+
+    def gene_rows(self, gene):
+        """
+        Indices of the rows with the data of all experiments of a gene.
+
+        :param gene: str, gene symbol
+        """
+        return [row for row, g in enumerate(self.genes) if g == gene]
+
+    @classmethod
+    def open(cls, cache, metric, grid_size):
+        """
+        Opens the store of a metric, it is built or updated if
+        it doesn't have the data of all cached gene experiments.
+
+        :param cache: GeneCache
+        :param metric: str, e.g. 'energy'
+        :param grid_size: list, number of voxels along each direction
+        """
+        path = cache.folder / STORE_FOLDER / f"{metric}.npy"
+        with cache._lock:
+            keys = sorted(
+                key
+                for key, entry in cache.entries.items()
+                if metric in entry["files"]
+            )
+
+            store = None
+            if path.exists():
+                try:
+                    store = cls(path)
+                except (OSError, ValueError, KeyError):
+                    logger.debug(f"Corrupted gene store, rebuilding: {path}")
+
+            if store is None or store.keys != keys:
+                store = cls.build(cache, metric, grid_size, keys, store)
+        return store
+
+    @classmethod
+    def build(cls, cache, metric, grid_size, keys, previous=None):
+        """
+        Stacks the cached grids in a new store. Files are first
+        written to temporary files which are then renamed, so that
+        an interrupted build never leaves a partial store.
+
+        :param cache: GeneCache
+        :param metric: str, e.g. 'energy'
+        :param grid_size: list, number of voxels along each direction
+        :param keys: list of str, gene-experiments to store
+        :param previous: GeneStore, rows already in it are copied from it
+        """
+        logger.debug(f"Building gene store for {metric} ({len(keys)} grids)")
+        folder = cache.folder / STORE_FOLDER
+        folder.mkdir(parents=True, exist_ok=True)
+        path = folder / f"{metric}.npy"
+
+        fd, tmp = tempfile.mkstemp(prefix=f".{metric}-", dir=folder)
+        os.close(fd)
+        try:
+            data = np.lib.format.open_memmap(
+                tmp,
+                mode="w+",
+                dtype=np.float32,
+                shape=(len(keys), *grid_size),
+            )
+            for row, key in enumerate(keys):
+                if previous is not None and key in previous._rows:
+                    data[row] = previous.data[previous._rows[key]]
+                else:
+                    filepath = cache.folder / (
+                        cache.entries[key]["files"][metric]["path"]
+                    )
+                    data[row] = memmap_raw(filepath, grid_size)
+            data.flush()
+            del data
+
+            index = path.with_suffix(".json")
+            with open(tmp + ".json", "w") as fout:
+                json.dump(dict(keys=keys), fout)
+            os.replace(tmp, path)
+            os.replace(tmp + ".json", index)
+        except BaseException:
+            for f in (tmp, tmp + ".json"):
+                if os.path.exists(f):
+                    os.remove(f)
+            raise
+
+        return cls(path)
+
+
+# ---------------------------- Region aggregation --------------------------- #
+def grid_annotation(atlas, grid_size, voxel_size):
+    """
+    Downsamples an atlas' annotation to the gene expression grid:
+    each grid voxel gets the label of the atlas voxel at its center.
+    Grid axes are ordered as in Allen's grid data (ML, DV, AP),
+    voxels outside of the atlas are labelled 0.
+
+    :param atlas: brainrender Atlas
+    :param grid_size: list, number of voxels along each direction
+    :param voxel_size: float, size of the grid voxels in microns
+    """
+    centers = (np.indices(grid_size).reshape(3, -1).T + 0.5) * voxel_size
+
+    # atlas voxels are ordered as (AP, DV, ML)
+    idx = np.floor(centers[:, ::-1] / atlas.resolution).astype(np.int64)
+    inside = np.all((idx >= 0) & (idx < atlas.annotation.shape), axis=1)
+
+    labels = np.zeros(len(idx), dtype=atlas.annotation.dtype)
+    labels[inside] = atlas.annotation[tuple(idx[inside].T)]
+    return labels.reshape(grid_size)
+
+
+def aggregate_by_label(
+    data, labels, n_labels, stats=("sum", "count"), chunk_size=64
+):
+    """
+    Computes the sum, number or max of the values of each row of
+    data over the voxels with each label. Negative values (which
+    mark voxels without data in Allen's grids) are ignored, as are
+    voxels with a negative label.
+    Returns a dictionary with an array with shape (n_rows, n_labels)
+    for each statistic, maxima are NaN where a label has no valid voxel.
+
+    :param data: np.ndarray, (n_rows, n_voxels) array
+    :param labels: np.ndarray, label (0 to n_labels - 1) of each voxel
+    :param n_labels: int, number of labels
+    :param stats: tuple of str, 'sum', 'count' and/or 'max'
+    :param chunk_size: int, number of rows processed at once
+    """
+    unknown = set(stats) - {"sum", "count", "max"}
+    if unknown:
+        raise ValueError(f"Unknown statistics: {unknown}")
+
+    # labelled voxels are sorted by label, so that each label's
+    # values are reduced as a contiguous run in every row
+    labels = np.asarray(labels, dtype=np.int64)
+    order = np.flatnonzero(labels >= 0)
+    order = order[np.argsort(labels[order], kind="stable")]
+    sorted_labels = labels[order]
+    sizes = np.bincount(sorted_labels, minlength=n_labels)
+    present = sizes > 0
+    starts = np.searchsorted(sorted_labels, np.flatnonzero(present))
+
+    result = {
+        stat: np.full((len(data), n_labels), np.nan if stat == "max" else 0.0)
+        for stat in stats
+    }
+    for first in range(0, len(data), chunk_size):
+        block = np.asarray(data[first : first + chunk_size])[:, order]
+        rows = slice(first, first + len(block))
+        if not len(order):
+            continue
+
+        # voxels without data are usually few: they're counted
+        # apart and zeroed only when there are any
+        invalid = ~(block >= 0)  # True for NaNs too
+        rows_invalid, cols_invalid = np.nonzero(invalid)
+        has_invalid = len(rows_invalid) > 0
+
+        if "sum" in stats:
+            values = np.where(invalid, 0, block) if has_invalid else block
+            result["sum"][rows, present] = np.add.reduceat(
+                values, starts, axis=1, dtype=np.float64
+            )
+        if "count" in stats:
+            missing = np.bincount(
+                rows_invalid * n_labels + sorted_labels[cols_invalid],
+                minlength=len(block) * n_labels,
+            ).reshape(len(block), n_labels)
+            result["count"][rows] = sizes - missing
+        if "max" in stats:
+            values = np.where(invalid, np.nan, block) if has_invalid else block
+            result["max"][rows, present] = np.fmax.reduceat(
+                values, starts, axis=1
+            )
+    return result
+
+
+# ----------------------------- Surface sampling ---------------------------- #
+def sample_grid(griddata, points, voxel_size):
+    """
+    Trilinearly interpolates a gene expression grid at many points.
+    Grid axes are ordered as in Allen's grid data (ML, DV, AP) and
+    the value of each voxel is taken to be at its center.
+    Voxels without data (negative values) are left out of the
+    interpolation, points outside of the grid or surrounded only by
+    voxels without data get NaN.
+
+    :param griddata: np.ndarray, 3d array with gene expression data
+    :param points: np.ndarray, (N, 3) array of coordinates in microns,
+        in atlas space (AP, DV, ML)
+    :param voxel_size: float, size of the grid voxels in microns
+    """
+    griddata = np.asarray(griddata, dtype=np.float64)
+    shape = np.array(griddata.shape)
+    coords = np.asarray(points, dtype=np.float64)[:, ::-1] / voxel_size - 0.5
+
+    # points within half a voxel of the grid's border
+    # take the value of the border voxels
+    inside = np.all((coords >= -0.5) & (coords <= shape - 0.5), axis=1)
+    coords = np.clip(coords, 0, shape - 1)
+    lower = np.minimum(np.floor(coords).astype(np.int64), shape - 2)
+    lower = np.maximum(lower, 0)
+    frac = coords - lower
+
+    total = np.zeros(len(coords))
+    weights = np.zeros(len(coords))
+    for corner in np.ndindex(2, 2, 2):
+        corner = np.array(corner)
+        idx = np.minimum(lower + corner, shape - 1)
+        value = griddata[tuple(idx.T)]
+        weight = np.prod(np.where(corner, frac, 1 - frac), axis=1)
+        weight[~(value >= 0)] = 0  # no data (or NaN)
+        total += weight * np.where(weight > 0, value, 0)
+        weights += weight
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        values = total / weights
+    values[~inside | (weights == 0)] = np.nan
+    return values
@@ -1,9 +1,16 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
 import pandas as pd
 import requests
 from loguru import logger
 from myterial import orange
+from requests.adapters import HTTPAdapter
 from rich import print
 from rich.progress import track
+from urllib3.util.retry import Retry
 
 try:
     from allensdk.api.queries.mouse_connectivity_api import (
@@ -17,15 +24,26 @@ except ModuleNotFoundError:  # pragma: no cover
 
 try:
     import cloudvolume
+    from cloudvolume.exceptions import SkeletonDecodeError
 
     cloudvolume_installed = True
 except ModuleNotFoundError:  # pragma: no cover
     cloudvolume_installed = False  # pragma: no cover
 
+    class SkeletonDecodeError(Exception):  # pragma: no cover
+        pass
+
+
 from brainglobe_atlasapi import BrainGlobeAtlas
 
 from brainrender import base_dir
+from brainrender._io import RETRY_BACKOFF, retry_delay
 from brainrender._utils import listify
+from brainrender.actors.streamlines import (
+    Streamlines,
+    StreamlinesData,
+    _concat_ranges,
+)
 
 streamlines_folder = base_dir / "streamlines"
 streamlines_folder.mkdir(exist_ok=True)
@@ -36,6 +54,11 @@ ALLEN_MESOSCALE_URL = (
 ALLEN_API_URL = "https://api.brain-map.org/api/v2/data/query.json"
 VOXEL_SIZE_NM = 1000  # skeleton vertices are in nanometers
 
+DOWNLOAD_WORKERS = 8  # experiments downloaded at the same time
+DOWNLOAD_RETRIES = 3  # attempts after a failed download
+
+INDEX_CELL_SIZE = 200  # um, size of the cells of StreamlinesIndex
+
 _ml_extent_um_cache = None
 
 
@@ -81,7 +104,29 @@ def experiments_source_search(SOI):
     )
 
 
-def _get_injection_site_um(eid, ml_extent_um):
+def _make_session(max_workers=DOWNLOAD_WORKERS):
+    """
+    Creates a requests session with a connection pool shared by all
+    download threads, which retries failed requests with exponential
+    backoff.
+
+    :param max_workers: int, number of threads using the session
+    """
+    retry = Retry(
+        total=DOWNLOAD_RETRIES,
+        backoff_factor=RETRY_BACKOFF,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET",),
+    )
+    adapter = HTTPAdapter(pool_maxsize=max_workers, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _get_injection_site_um(eid, ml_extent_um, session=None):
     """
     Fetches the injection site coordinates for an experiment from the Allen
     Brain Atlas API. Coordinates are in Allen CCF um space with the Z (ML)
@@ -89,6 +134,8 @@ def _get_injection_site_um(eid, ml_extent_um):
 
     :param eid: int, experiment ID
     :param ml_extent_um: float, full ML extent of the atlas in um for LR flip
+    :param session: requests.Session used for the request, if None
+        a new connection is made
     :return: dict with x, y, z keys or None if not found
     """
     try:
@@ -98,7 +145,7 @@ def _get_injection_site_um(eid, ml_extent_um):
             f"rma::criteria,[is_injection$eqtrue],"
             f"rma::options[num_rows$eq1][order$eq'projection_volume desc']"
         )
-        response = requests.get(url, timeout=10)
+        response = (session or requests).get(url, timeout=10)
         data = response.json()
         if data["success"] and data["num_rows"] > 0:
             voxel = data["msg"][0]
@@ -114,64 +161,146 @@ def _get_injection_site_um(eid, ml_extent_um):
     return None
 
 
-def _skeleton_to_dataframe(skeleton, eid, ml_extent_um):
+def _ccf_to_brainrender_um(vertices, ml_extent_um):
     """
-    Converts a cloudvolume Skeleton object to the pd.DataFrame format
-    expected by brainrender's Streamlines actor.
-
-    Vertices are in nanometers in Allen CCF space. We:
+    Converts skeleton vertices from nanometers in Allen CCF space to
+    microns in brainrender's space:
     1. Convert nm -> um (divide by VOXEL_SIZE_NM)
     2. Flip Z (ML) axis to match brainrender's hemisphere convention
 
     X (AP) and Y (DV) are passed through as-is because brainrender's
     brain mesh uses the same orientation as the Allen CCF for those axes.
 
+    :param vertices: np.ndarray, Nx3 array of vertices in nm
+    :param ml_extent_um: float, full ML extent of the atlas in um for LR flip
+    """
+    verts_um = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+    verts_um = verts_um / VOXEL_SIZE_NM
+    verts_um[:, 2] = ml_extent_um - verts_um[:, 2]
+    return verts_um
+
+
+def _skeleton_to_streamlines(skeleton, eid, ml_extent_um, session=None):
+    """
+    Converts a cloudvolume Skeleton object to StreamlinesData, with one
+    streamline per connected component of the skeleton.
+    The vertices of all components are converted at once
+    (see _ccf_to_brainrender_um).
+
     :param skeleton: cloudvolume Skeleton object
     :param eid: int, experiment ID used to fetch real injection coordinates
     :param ml_extent_um: float, full ML extent of the atlas in um for LR flip
-    :return: pd.DataFrame with 'lines' and 'injection_sites' columns
+    :param session: requests.Session used to fetch the injection site
+    :return: StreamlinesData
     """
-    components = skeleton.components()
+    components = [c.vertices for c in skeleton.components()]
+    offsets = np.cumsum([0] + [len(c) for c in components])
+    vertices = np.concatenate(components) if components else np.empty((0, 3))
+    points = _ccf_to_brainrender_um(vertices, ml_extent_um)
 
-    lines = []
-    for component in components:
-        verts_um = component.vertices / VOXEL_SIZE_NM
-        points = [
-            {
-                "x": float(v[0]),
-                "y": float(v[1]),
-                "z": float(ml_extent_um - v[2]),
-            }
-            for v in verts_um
-        ]
-        lines.append(points)
-
-    injection_site = _get_injection_site_um(eid, ml_extent_um)
+    injection_site = _get_injection_site_um(eid, ml_extent_um, session)
     if injection_site is None:
         logger.warning(
             f"Falling back to centroid for injection site of experiment {eid}"
         )
-        all_verts_um = skeleton.vertices / VOXEL_SIZE_NM
-        centroid = all_verts_um.mean(axis=0)
-        injection_site = {
-            "x": float(centroid[0]),
-            "y": float(centroid[1]),
-            "z": float(ml_extent_um - centroid[2]),
-        }
+        centroid = np.mean(skeleton.vertices, axis=0)
+        injection_site = _ccf_to_brainrender_um(centroid, ml_extent_um)[0]
+    else:
+        injection_site = [injection_site[k] for k in ("x", "y", "z")]
 
-    return pd.DataFrame(
-        {"lines": [lines], "injection_sites": [[injection_site]]}
+    return StreamlinesData(points, offsets, [injection_site])
+
+
+def _load_cached_streamlines(eid):
+    """
+    Loads the cached streamlines data of an experiment, returns None
+    if they are not cached. Streamlines cached as json files by previous
+    versions of brainrender are converted to the .npz format.
+
+    :param eid: int, experiment ID
+    """
+    npzpath = streamlines_folder / f"{eid}.npz"
+    if npzpath.exists():
+        return StreamlinesData.load(npzpath)
+
+    jsonpath = streamlines_folder / f"{eid}.json"
+    if jsonpath.exists():
+        logger.debug(f"Converting cached streamlines to .npz: {jsonpath}")
+        data = StreamlinesData.load(jsonpath)
+        data.save(npzpath)
+        jsonpath.unlink()
+        return data
+
+    return None
+
+
+def _get_skeleton(cv, eid):
+    """
+    Fetches the skeleton of an experiment, retrying with jittered
+    exponential backoff if the download fails.
+
+    :param cv: cloudvolume.CloudVolume with the streamlines data
+    :param eid: int, experiment ID
+    """
+    for attempt in range(DOWNLOAD_RETRIES + 1):
+        try:
+            return cv.skeleton.get(int(eid))
+        except SkeletonDecodeError:
+            raise  # the data is missing, trying again won't help
+        except Exception as e:
+            if attempt == DOWNLOAD_RETRIES:
+                raise
+            delay = retry_delay(attempt)
+            logger.debug(
+                f"Downloading streamlines for experiment {eid} failed ({e}), "
+                + f"retrying in {delay:.1f}s"
+            )
+            time.sleep(delay)
+
+
+def _download_streamlines(eid, ml_extent_um, session, local):
+    """
+    Downloads the streamlines of an experiment and saves them in the cache.
+
+    :param eid: int, experiment ID
+    :param ml_extent_um: float, full ML extent of the atlas in um for LR flip
+    :param session: requests.Session shared by all download threads
+    :param local: threading.local storing each thread's CloudVolume
+    """
+    if not hasattr(local, "cv"):
+        local.cv = cloudvolume.CloudVolume(
+            ALLEN_MESOSCALE_URL,
+            use_https=True,
+            progress=False,
+        )
+
+    skeleton = _get_skeleton(local.cv, eid)
+    streamlines = _skeleton_to_streamlines(
+        skeleton, int(eid), ml_extent_um, session
     )
 
+    # written atomically, an interrupted download is just downloaded again
+    streamlines.save(streamlines_folder / f"{eid}.npz")
+    return streamlines
 
-def get_streamlines_data(eids, force_download=False):
+
+def get_streamlines_data(
+    eids, force_download=False, max_workers=DOWNLOAD_WORKERS, as_arrays=False
+):
     """
     Given a list of experiment IDs, downloads streamline data from the
     Allen mesoscale connectivity dataset hosted on Google Cloud Storage
-    via cloud-volume, and saves them as JSON files.
+    via cloud-volume, and saves them as .npz files.
+    Experiments are downloaded concurrently, cached experiments
+    are loaded without connecting to the server.
 
     :param eids: list of integers with experiment IDs
     :param force_download: bool, if True re-download even if cached
+    :param max_workers: int, max number of experiments downloaded at once
+    :param as_arrays: bool, if True StreamlinesData are returned, which
+        are much faster to create and to render than the pd.DataFrames
+        returned by default (see StreamlinesData.to_dataframe)
+    :return: list of pd.DataFrame or StreamlinesData
     """
     if not cloudvolume_installed:
         print(
@@ -180,37 +309,49 @@ def get_streamlines_data(eids, force_download=False):
         )
         return []
 
-    ml_extent_um = _get_ml_extent_um()
-
-    cv = cloudvolume.CloudVolume(
-        ALLEN_MESOSCALE_URL,
-        use_https=True,
-        progress=False,
-    )
-
-    data = []
-    for eid in track(eids, total=len(eids), description="downloading"):
-        jsonpath = streamlines_folder / f"{eid}.json"
-
-        if not jsonpath.exists() or force_download:
-            try:
-                skeleton = cv.skeleton.get(int(eid))
-            except Exception as e:
-                logger.warning(
-                    f"Could not fetch streamlines for experiment {eid}: {e}"
-                )
-                continue
-
-            df = _skeleton_to_dataframe(skeleton, int(eid), ml_extent_um)
-            df.to_json(str(jsonpath))
-            data.append(df)
-        else:
-            data.append(pd.read_json(str(jsonpath)))
-
+    data = {}
+    if not force_download:
+        for eid in eids:
+            cached = _load_cached_streamlines(eid)
+            if cached is not None:
+                data[eid] = cached
+
+    to_download = [eid for eid in eids if eid not in data]
+    if to_download:
+        ml_extent_um = _get_ml_extent_um()
+        local = threading.local()
+        with (
+            _make_session(max_workers) as session,
+            ThreadPoolExecutor(max_workers=max_workers) as pool,
+        ):
+            futures = {
+                pool.submit(
+                    _download_streamlines, eid, ml_extent_um, session, local
+                ): eid
+                for eid in to_download
+            }
+            for future in track(
+                as_completed(futures),
+                total=len(futures),
+                description="downloading",
+            ):
+                eid = futures[future]
+                try:
+                    data[eid] = future.result()
+                except Exception as e:
+                    logger.warning(
+                        f"Could not fetch streamlines for experiment {eid}: {e}"
+                    )
+
+    data = [data[eid] for eid in eids if eid in data]
+    if not as_arrays:
+        data = [d.to_dataframe() for d in data]
     return data
 
 
-def get_streamlines_for_region(region, force_download=False):
+def get_streamlines_for_region(
+    region, force_download=False, max_workers=DOWNLOAD_WORKERS, as_arrays=False
+):
     """
     Using the Allen Mouse Connectivity data and corresponding API, this function finds experiments
     whose injections were targeted to the region of interest and downloads the corresponding
@@ -220,6 +361,9 @@ def get_streamlines_for_region(region, force_download=False):
 
     :param region: str with region to use for search
     :param force_download: bool, if True re-download even if cached
+    :param max_workers: int, max number of experiments downloaded at once
+    :param as_arrays: bool, if True StreamlinesData are returned instead
+        of pd.DataFrames (see get_streamlines_data)
     """
     logger.debug(f"Getting streamlines data for region: {region}")
     region_experiments = experiments_source_search(region)
@@ -228,5 +372,309 @@ def get_streamlines_for_region(region, force_download=False):
         return None
 
     return get_streamlines_data(
-        region_experiments.id.values, force_download=force_download
+        region_experiments.id.values,
+        force_download=force_download,
+        max_workers=max_workers,
+        as_arrays=as_arrays,
     )
+
+
+def _label_planes(annotation, labels):
+    """
+    Finds which labels are in each plane of an annotation volume, along
+    each axis, in a single pass through the volume.
+    Returns a list with a boolean array with shape (n_planes, n_labels)
+    for each axis, labels not in the list are ignored.
+
+    :param annotation: np.ndarray, 3d array with a label for each voxel
+    :param labels: list of int, labels to look for
+    """
+    labels = np.asarray(labels)
+    order = np.argsort(labels)
+    sorted_labels = labels[order]
+    n = len(labels)
+
+    # the last column collects the voxels with other labels
+    planes = [np.zeros((size, n + 1), dtype=bool) for size in annotation.shape]
+    _, height, width = annotation.shape
+    row_starts = np.zeros(height * width, dtype=bool)
+    row_starts[::width] = True
+    columns = np.tile(np.arange(width) * (n + 1), height)
+    for i, plane in enumerate(annotation):
+        # labels are looked up once for each run of equal voxels in a row
+        flat = plane.ravel()
+        starts = row_starts.copy()
+        starts[1:] |= flat[1:] != flat[:-1]
+        starts = np.flatnonzero(starts)
+        values = flat[starts]
+        idx = np.minimum(np.searchsorted(sorted_labels, values), n - 1)
+        cols = np.where(sorted_labels[idx] == values, order[idx], n)
+
+        planes[0][i, cols] = True
+        planes[1][starts // width, cols] = True
+        lengths = np.diff(np.append(starts, len(flat)))
+        planes[2].ravel()[columns + np.repeat(cols, lengths)] = True
+    return [p[:, :n] for p in planes]
+
+
+class StreamlinesIndex:
+    """
+    Spatial index of the segments of a set of streamlines, to find
+    which experiments have fibres passing through a brain region, a box
+    or near a point without going through all of the streamlines' points.
+
+    Points are hashed in a grid of cubic cells: the cell of each point
+    is stored in a sorted array, so that the points in a range of cells
+    are found by bisection. A segment (two consecutive points of a
+    streamline) matches a query if either of its end points does.
+    """
+
+    def __init__(self, streamlines, eids=None, cell_size=INDEX_CELL_SIZE):
+        """
+        :param streamlines: list of StreamlinesData
+        :param eids: list of int, experiment ID of each StreamlinesData.
+            If None experiments are numbered in order
+        :param cell_size: float, size in um of the index's cells
+        """
+        self.eids = np.asarray(
+            range(len(streamlines)) if eids is None else eids
+        )
+        if len(self.eids) != len(streamlines):
+            raise ValueError("There should be one experiment ID per dataset")
+        self.data = list(streamlines)
+        self.cell_size = cell_size
+
+        # all experiments' points one after the other
+        npoints = [len(d.points) for d in self.data]
+        self.points = np.concatenate(
+            [d.points for d in self.data] or [np.empty((0, 3), np.float32)]
+        )
+        self._experiment = np.repeat(np.arange(len(self.data)), npoints)
+
+        # segments are identified by the index of their first point,
+        # the last point of each streamline doesn't start a segment
+        first = np.concatenate(
+            [
+                d.offsets[:-1] + n
+                for d, n in zip(self.data, np.cumsum([0] + npoints))
+            ]
+            or [np.empty(0, np.int64)]
+        )
+        lengths = np.diff(np.append(first, len(self.points)))
+        self._is_first = np.zeros(len(self.points), dtype=bool)
+        self._is_first[first[lengths > 0]] = True
+        self._is_last = np.roll(self._is_first, -1)
+        if len(self.points):
+            self._is_last[-1] = True
+
+        # hash points by cell
+        cells = np.floor(self.points / cell_size).astype(np.int64)
+        self._origin = cells.min(axis=0) if len(cells) else np.zeros(3, int)
+        cells -= self._origin
+        self._shape = cells.max(axis=0) + 1 if len(cells) else np.ones(3, int)
+        keys = np.ravel_multi_index(tuple(cells.T), self._shape)
+        self._order = np.argsort(keys, kind="stable")
+        self._keys = keys[self._order]
+
+        # labels in each plane of the atlases' annotations, by atlas
+        self._atlas_planes = {}
+
+        logger.debug(
+            f"Indexed {len(self.points)} streamlines points "
+            + f"from {len(self.data)} experiments"
+        )
+
+    def __len__(self):
+        return len(self.data)
+
+    @classmethod
+    def from_cache(cls, cell_size=INDEX_CELL_SIZE):
+        """
+        Creates an index of all the streamlines cached locally
+        (see get_streamlines_data).
+
+        :param cell_size: float, size in um of the index's cells
+        """
+        eids = sorted(
+            {
+                int(path.stem)
+                for ext in ("npz", "json")
+                for path in streamlines_folder.glob(f"*.{ext}")
+                if path.stem.isdigit()
+            }
+        )
+        data = [_load_cached_streamlines(eid) for eid in eids]
+        return cls(data, eids, cell_size=cell_size)
+
+    def _points_in_bounds(self, bounds):
+        """
+        Indices of the points within a box.
+
+        :param bounds: list, box bounds [xmin, xmax, ymin, ymax, zmin, zmax]
+        """
+        lo, hi = np.reshape(bounds, (3, 2)).T
+        cell_lo = np.floor(lo / self.cell_size).astype(np.int64)
+        cell_hi = np.floor(hi / self.cell_size).astype(np.int64)
+        cell_lo = np.maximum(cell_lo - self._origin, 0)
+        cell_hi = np.minimum(cell_hi - self._origin, self._shape - 1)
+        if len(self.points) == 0 or np.any(cell_lo > cell_hi):
+            return np.empty(0, dtype=np.int64)
+
+        # cells along the last axis have consecutive keys, so the points
+        # of each row of cells are found with a single bisection
+        x, y = np.meshgrid(
+            np.arange(cell_lo[0], cell_hi[0] + 1),
+            np.arange(cell_lo[1], cell_hi[1] + 1),
+            indexing="ij",
+        )
+        x, y = x.ravel(), y.ravel()
+        key_lo = np.ravel_multi_index(
+            (x, y, np.full_like(x, cell_lo[2])), self._shape
+        )
+        key_hi = np.ravel_multi_index(
+            (x, y, np.full_like(x, cell_hi[2])), self._shape
+        )
+        starts = np.searchsorted(self._keys, key_lo, side="left")
+        stops = np.searchsorted(self._keys, key_hi, side="right")
+        candidates = self._order[_concat_ranges(starts, stops)]
+
+        points = self.points[candidates]
+        inside = np.all((points >= lo) & (points <= hi), axis=1)
+        return np.sort(candidates[inside])
+
+    def _segments_from_points(self, points):
+        """
+        Segments starting or ending at a set of points.
+
+        :param points: np.ndarray, indices of points
+        """
+        starting = points[~self._is_last[points]]
+        ending = points[~self._is_first[points]] - 1
+        return np.union1d(starting, ending)
+
+    def segments_in_box(self, bounds):
+        """
+        Segments with a point within a box.
+
+        :param bounds: list, box bounds [xmin, xmax, ymin, ymax, zmin, zmax]
+        :return: np.ndarray with the segments' indices
+        """
+        return self._segments_from_points(self._points_in_bounds(bounds))
+
+    def segments_near(self, point, radius):
+        """
+        Segments with a point at less than a radius from a point.
+
+        :param point: list, coordinates of the point
+        :param radius: float, max distance in um
+        :return: np.ndarray with the segments' indices
+        """
+        point = np.asarray(point, dtype=np.float64)
+        bounds = np.column_stack([point - radius, point + radius]).ravel()
+        candidates = self._points_in_bounds(bounds)
+
+        distance = np.linalg.norm(self.points[candidates] - point, axis=1)
+        return self._segments_from_points(candidates[distance <= radius])
+
+    def _region_bounds(self, atlas, ids):
+        """
+        Bounds of the voxels of a set of regions in an atlas' annotation.
+        The labels present in each plane of the annotation are found once
+        per atlas (see _label_planes), so that the bounds of any set of
+        regions are found without going through the annotation again.
+        Returns None if the regions have no voxels.
+
+        :param atlas: brainrender Atlas
+        :param ids: set of int, IDs of the regions
+        """
+        if atlas.atlas_name not in self._atlas_planes:
+            labels = [s["id"] for s in atlas.structures_list]
+            self._atlas_planes[atlas.atlas_name] = (
+                {label: col for col, label in enumerate(labels)},
+                _label_planes(atlas.annotation, labels),
+            )
+        columns, planes = self._atlas_planes[atlas.atlas_name]
+
+        cols = [columns[i] for i in ids if i in columns]
+        bounds = []
+        for axis_planes in planes:
+            found = np.flatnonzero(axis_planes[:, cols].any(axis=1))
+            if not len(found):
+                return None
+            bounds += [found[0], found[-1] + 1]
+        resolution = np.repeat(np.asarray(atlas.resolution, np.float64), 2)
+        return np.array(bounds) * resolution
+
+    def segments_in_region(self, atlas, regions, include_descendants=True):
+        """
+        Segments with a point within a set of brain regions.
+
+        :param atlas: brainrender Atlas used to look up the regions
+        :param regions: str, int or list of region acronyms or IDs
+        :param include_descendants: bool. If True segments in the regions'
+            descendants (e.g. cortical layers) are included too
+        :return: np.ndarray with the segments' indices
+        """
+        regions = listify(regions)
+        try:
+            ids = set(atlas._get_from_structure(regions, "id"))
+        except KeyError as e:
+            raise ValueError(
+                f"Region {e} is not in the atlas: {atlas.atlas_name}"
+            ) from e
+        if include_descendants:
+            ids = {
+                s["id"]
+                for s in atlas.structures_list
+                if ids.intersection(s["structure_id_path"])
+            }
+
+        bounds = self._region_bounds(atlas, ids)
+        if bounds is None:  # the regions have no voxels
+            return np.empty(0, dtype=np.int64)
+        candidates = self._points_in_bounds(bounds)
+
+        inside = atlas.in_region(
+            self.points[candidates],
+            regions,
+            include_descendants=include_descendants,
+        )
+        return self._segments_from_points(candidates[inside])
+
+    def experiments(self, segments):
+        """
+        IDs of the experiments with any of a set of segments.
+
+        :param segments: np.ndarray with segments' indices
+        """
+        return self.eids[np.unique(self._experiment[segments])]
+
+    def streamlines(self, segments, **kwargs):
+        """
+        Creates a Streamlines actor with only a set of segments.
+        Consecutive segments are joined in a single streamline.
+
+        :param segments: np.ndarray with segments' indices
+        :param kwargs: keyword arguments for Streamlines
+        """
+        segments = np.unique(np.asarray(segments, dtype=np.int64))
+
+        # runs of consecutive segments make a streamline
+        if len(segments):
+            breaks = np.flatnonzero(np.diff(segments) != 1) + 1
+            starts = segments[np.r_[0, breaks]]
+            stops = segments[np.r_[breaks - 1, len(segments) - 1]] + 2
+        else:
+            starts = stops = segments
+        points = self.points[_concat_ranges(starts, stops)]
+        offsets = np.r_[0, np.cumsum(stops - starts)]
+
+        injection_sites = np.concatenate(
+            [
+                self.data[i].injection_sites
+                for i in np.unique(self._experiment[starts])
+            ]
+            or [np.empty((0, 3))]
+        )
+        data = StreamlinesData(points, offsets, injection_sites)
+        return Streamlines(data, **kwargs)
@@ -25,9 +25,9 @@ def get_camera(camera: str) -> dict:
     Returns
     -------
     dict
-        Camera parameters dictionary.
+        Copy of the camera parameters dictionary.
     """
-    return cameras[camera]
+    return dict(cameras[camera])
 
 
 def check_camera_param(camera: str | dict) -> dict:
@@ -3,6 +3,7 @@
 from __future__ import annotations
 
 from datetime import datetime
+from itertools import product
 from pathlib import Path
 from typing import TYPE_CHECKING, Any
 
@@ -31,9 +32,45 @@ mtx = [[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, -1, 0], [0, 0, 0, 1]]
 mtx_swap_x_z = [[0, 0, 1, 0], [0, 1, 0, 0], [1, 0, 0, 0], [0, 0, 0, 1]]
 
 
+def _screen_size(renderer: Any, bounds: Any) -> float:
+    """
+    Size in pixels of the projection of a bounding box on screen.
+
+    Parameters
+    ----------
+    renderer
+        VTK renderer whose active camera is used for the projection.
+    bounds
+        Bounding box as (xmin, xmax, ymin, ymax, zmin, zmax).
+
+    Returns
+    -------
+    float
+        Largest side of the projected box, ``inf`` if part of the box
+        is behind the camera.
+    """
+    corners = np.array(list(product(*np.reshape(bounds, (3, 2)))))
+    camera = renderer.GetActiveCamera()
+    matrix = camera.GetCompositeProjectionTransformMatrix(
+        renderer.GetTiledAspectRatio(), -1, 1
+    )
+    projection = np.array(
+        [[matrix.GetElement(i, j) for j in range(4)] for i in range(4)]
+    )
+
+    projected = np.c_[corners, np.ones(len(corners))] @ projection.T
+    if np.any(projected[:, 3] <= 0):
+        return np.inf
+    ndc = projected[:, :2] / projected[:, 3:]
+    extent = np.ptp(ndc, axis=0) / 2 * np.array(renderer.GetSize())
+    return float(extent.max())
+
+
 class Render:
     is_rendered = False
     plotter = None
+    lod = None  # level of detail forced by render/screenshot
+    _style = None  # shader style used in the last render
 
     axes_names = ("AP", "DV", "LR")
     axes_lookup = {"x": "AP", "y": "DV", "z": "LR"}
@@ -48,11 +85,16 @@ class Render:
         plotter
             Existing vedo Plotter to use. A new one is created if None.
         """
+        # actors to prepare and style at the next render, used as an
+        # ordered set so that renders only touch actors that changed
+        self._dirty_actors: dict[Actor, None] = {}
+
         if plotter is None:
             self._get_plotter()
         else:
             self.plotter = plotter
             self.plotter.keyPressFunction = self.keypress
+            self._add_lod_observer()
 
     def _get_plotter(self) -> None:
         """
@@ -68,6 +110,72 @@ class Render:
         )
 
         self.plotter.keyPressFunction = self.keypress
+        self._add_lod_observer()
+
+    def _add_lod_observer(self) -> None:
+        """
+        Update the level of detail of the actors before each render.
+        """
+        self.plotter.renderer.AddObserver("StartEvent", self._update_lod)
+
+    def _lod_level(self, actor: Actor) -> int:
+        """
+        Pick the level of detail to render an actor at.
+
+        The lowest level is used while the camera is moved
+        interactively, otherwise the level is chosen from the actor's
+        size on screen (see ``settings.LOD_MIN_PIXELS``), unless a level
+        was passed to ``render`` or ``screenshot``.
+
+        Parameters
+        ----------
+        actor
+            Actor with meshes at lower levels of detail.
+
+        Returns
+        -------
+        int
+            Index of the level in ``settings.LOD_LEVELS``.
+        """
+        if self.lod is not None:
+            return self.lod
+
+        # the interactor raises the desired update rate while interacting
+        interactor = self.plotter.interactor
+        window = self.plotter.window
+        if (
+            interactor is not None
+            and window.GetDesiredUpdateRate()
+            >= interactor.GetDesiredUpdateRate()
+        ):
+            return len(settings.LOD_LEVELS) - 1
+
+        size = _screen_size(self.plotter.renderer, actor._mesh.bounds())
+        for level, min_pixels in enumerate(settings.LOD_MIN_PIXELS):
+            if size >= min_pixels:
+                return level
+        return len(settings.LOD_LEVELS) - 1
+
+    def _update_lod(self, *args: Any) -> None:
+        """
+        Render each actor's mesh at the selected level of detail by
+        swapping the dataset used by its mapper.
+        """
+        if not settings.USE_LOD:
+            return
+
+        for actor in self.clean_actors:
+            if not actor._lod_meshes or "_mesh" not in actor.__dict__:
+                continue
+
+            level = min(self._lod_level(actor), len(actor._lod_meshes))
+            dataset = (
+                actor._mesh.dataset
+                if level == 0
+                else actor._lod_meshes[level - 1].dataset
+            )
+            if actor._mesh.mapper.GetInput() is not dataset:
+                actor._mesh.mapper.SetInputData(dataset)
 
     def _make_axes(self) -> dict:
         """
@@ -183,28 +291,65 @@ class Render:
         if actor._needs_label and not self.backend:
             self.labels.extend(actor.make_label(self.atlas))
 
-    def _apply_style(self) -> None:
+    def _mark_dirty(self, *actors: Actor) -> None:
+        """
+        Flag actors to be prepared and styled at the next render.
+
+        Parameters
+        ----------
+        *actors
+            Actors that were added or changed.
+        """
+        for actor in actors:
+            self._dirty_actors[actor] = None
+
+    def _get_style(self) -> str:
+        """
+        Get the shader style to apply to the meshes.
+
+        Returns
+        -------
+        str
+        """
+        if settings.SHADER_STYLE != "cartoon":
+            return settings.SHADER_STYLE
+        elif self.backend:  # notebook backend
+            print('Shader style "cartoon" cannot be used in a notebook')
+        return "off"
+
+    def _apply_style(self, actors: list[Actor], style: str) -> None:
         """
         Set the rendering style for each mesh.
+
+        Parameters
+        ----------
+        actors
+            Actors to style, actors already rendered with *style*
+            are skipped. Meshes are reversed only the first time
+            an actor is styled.
+        style
+            Shader style, see ``settings.SHADER_STYLE``.
         """
-        for actor in self.clean_actors:
-            if settings.SHADER_STYLE != "cartoon":
-                style = settings.SHADER_STYLE
-            else:
-                if self.backend:  # notebook backend
-                    print(
-                        'Shader style "cartoon" cannot be used in a notebook'
-                    )
-                style = "off"
+        for actor in actors:
+            if actor._style == style:
+                continue
 
             try:
-                actor.mesh.reverse()  # flip normals
-                actor.mesh.lighting(style=style)
+                # flip normals when first styled, restyling
+                # must not flip them back
+                if actor._style is None:
+                    actor.mesh.reverse()
+                    actor._mesh.reverse()
+                    # lower levels of detail replace ._mesh's dataset
+                    # when rendered, they must have the same orientation
+                    for lod in actor._lod_meshes:
+                        lod.reverse()
 
-                actor._mesh.reverse()
+                actor.mesh.lighting(style=style)
                 actor._mesh.lighting(style=style)
             except AttributeError:
                 pass
+            actor._style = style
 
     def render(
         self,
@@ -212,6 +357,7 @@ class Render:
         camera: str | dict | None = None,
         zoom: float | None = None,
         resetcam: bool = False,
+        lod: int | None = None,
         **kwargs: Any,
     ) -> None:
         """
@@ -229,6 +375,11 @@ class Render:
             Camera zoom level. Falls back to the atlas default if None.
         resetcam
             Reset the camera between renders.
+        lod
+            Index of the level of detail (in ``settings.LOD_LEVELS``)
+            to render brain regions at, until the next call to
+            ``render``. If None the level is picked from the regions'
+            size on screen and lowered while the camera moves.
         **kwargs
             Additional arguments forwarded to ``self.plotter.show``.
         """
@@ -255,8 +406,17 @@ class Render:
         if not self.backend and camera is not None:
             _ = set_camera(self, camera)
 
+        # only actors added or changed since the last render need updating,
+        # unless the shader style changed
+        style = self._get_style()
+        if style != self._style:
+            self._style = style
+            self._mark_dirty(*self.clean_actors)
+        dirty = [actor for actor in self._dirty_actors if not actor.is_text]
+        self._dirty_actors.clear()
+
         # Apply axes correction
-        for actor in self.clean_actors:
+        for actor in dirty:
             if not actor._is_transformed:
                 self._prepare_actor(actor)
                 self.plotter.add(actor.mesh)
@@ -264,18 +424,19 @@ class Render:
             if actor._needs_silhouette or actor._needs_label:
                 self._prepare_actor(actor)
 
-        # add labels to the scene
-        for label in self.labels:
-            if label._is_added:
-                continue
-            else:
-                label._mesh = label.mesh.clone()
-                self._prepare_actor(label)
-                self.plotter.add(label._mesh.reverse())
-                label._is_added = True
+            # add labels to the scene
+            for label in actor.labels:
+                if label._is_added:
+                    continue
+                else:
+                    label._mesh = label.mesh.clone()
+                    self._prepare_actor(label)
+                    self.plotter.add(label._mesh.reverse())
+                    label._is_added = True
 
         # Apply style
-        self._apply_style()
+        self._apply_style(dirty, style)
+        self.lod = lod
 
         if self.inset and not self.is_rendered:
             self._get_inset()
@@ -378,6 +539,7 @@ class Render:
         self,
         name: str | None = None,
         scale: float | None = None,
+        lod: int | None = None,
         **kwargs: Any,
     ) -> str:
         """
@@ -393,6 +555,10 @@ class Render:
         scale
             Resolution multiplier. Values above 1 increase resolution.
             Falls back to ``settings.SCREENSHOT_SCALE`` if None.
+        lod
+            Index of the level of detail (in ``settings.LOD_LEVELS``)
+            to render brain regions at. If None the level set by
+            ``render`` is used.
         **kwargs
             Additional arguments forwarded to ``render``.
 
@@ -402,7 +568,7 @@ class Render:
             Absolute path of the saved screenshot.
         """
         if not self.is_rendered:
-            self.render(interactive=False, **kwargs)
+            self.render(interactive=False, lod=lod, **kwargs)
 
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         name = Path(name or f"brainrender_screenshot_{timestamp}")
@@ -417,7 +583,12 @@ class Render:
 
         savepath = str(self.screenshots_folder / name)
         logger.debug(f"Saving scene at {savepath}")
-        self.plotter.screenshot(filename=savepath, scale=scale)
+        previous_lod = self.lod
+        self.lod = lod if lod is not None else previous_lod
+        try:
+            self.plotter.screenshot(filename=savepath, scale=scale)
+        finally:
+            self.lod = previous_lod
         return savepath
 
     def keypress(self, key: str) -> None:  # pragma: no cover
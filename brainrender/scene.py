@@ -20,7 +20,7 @@ from brainrender._io import load_mesh_from_file
 from brainrender._jupyter import JupyterMixIn, not_on_jupyter
 from brainrender._utils import listify, return_list_smart
 from brainrender.actor import Actor
-from brainrender.actors import Volume
+from brainrender.actors import RegionSet, Volume
 from brainrender.atlas import Atlas
 from brainrender.render import Render
 
@@ -181,15 +181,14 @@ class Scene(JupyterMixIn, Render):
             for actor in actors:
                 self._prepare_actor(actor)
 
-        # add actors to plotter
-        for actor in actors:
-            try:
-                self.plotter.add(actor._mesh)
-            except AttributeError:  # e.g. for titles
-                self.plotter.add(actor.mesh)
+        # add all actors to plotter at once
+        self.plotter.add(
+            [getattr(actor, "_mesh", actor.mesh) for actor in actors]
+        )
 
         # Add to the lists actors
         self.actors.extend(actors)
+        self._mark_dirty(*actors)
         return return_list_smart(actors)
 
     def remove(self, *actors):
@@ -205,6 +204,8 @@ class Scene(JupyterMixIn, Render):
                     f"Could not remove ({act}, {pi.utils._class_name(act)}) from actors"
                 )
             else:
+                self._dirty_actors.pop(act, None)
+
                 # remove from plotter
                 try:
                     self.plotter.remove(act._mesh)
@@ -241,9 +242,14 @@ class Scene(JupyterMixIn, Render):
         silhouette=None,
         hemisphere="both",
         force=False,
+        n_workers=None,
+        merge=False,
+        lod=False,
     ):
         """
-        Dedicated method to add brain regions to render
+        Dedicated method to add brain regions to render.
+        All regions are loaded in one go and added to the
+        scene together.
 
         :param regions: str. String of regions names
         :param alpha: float. How opaque the regions are rendered.
@@ -256,6 +262,16 @@ class Scene(JupyterMixIn, Render):
                 of the mesh is returned
         :param force: bool. If true force adding of region even
             if already rendered
+        :param n_workers: int. Number of threads used to load
+            the regions' meshes concurrently
+        :param merge: bool. If true the regions are merged in a single
+            RegionSet actor, which is much faster to render when showing
+            many regions. Individual regions can still be recolored or
+            hidden through the RegionSet's methods.
+        :param lod: bool. If true meshes at lower levels of detail are
+            made too, this takes longer but large regions are then faster
+            to render when small on screen or while the camera moves
+            (if settings.USE_LOD is True)
         """
         if silhouette is None:
             silhouette = (
@@ -269,6 +285,8 @@ class Scene(JupyterMixIn, Render):
             already_in = [
                 r.name for r in self.get_actors(br_class="brain region")
             ]
+            for region_set in self.get_actors(br_class="region set"):
+                already_in.extend(region_set.regions)
             regions = [r for r in regions if r not in already_in]
 
         if not regions:  # they were all already rendered
@@ -282,9 +300,15 @@ class Scene(JupyterMixIn, Render):
         )
 
         # get regions actors from atlas
-        regions = self.atlas.get_region(*regions, alpha=alpha, color=color)
+        regions = self.atlas.get_region(
+            *regions, alpha=alpha, color=color, n_workers=n_workers, lod=lod
+        )
         regions = listify(regions) or []
 
+        if merge and regions:
+            ids = [self.atlas.structures[r.name]["id"] for r in regions]
+            regions = [RegionSet(regions, ids=ids, alpha=alpha)]
+
         # add actors
         actors = self.add(*regions)
 
@@ -300,19 +324,13 @@ class Scene(JupyterMixIn, Render):
             normal = (0, 0, 1) if hemisphere == "right" else (0, 0, -1)
             plane = self.atlas.get_plane(pos=mesh_center, norm=normal)
 
-            if not isinstance(actors, list):
-                actors._mesh.cut_with_plane(
-                    origin=plane.center,
-                    normal=plane.normal,
-                )
-                actors.cap()
-            else:
-                for actor in actors:
-                    actor._mesh.cut_with_plane(
+            for actor in listify(actors):
+                for mesh in [actor._mesh, *actor._lod_meshes]:
+                    mesh.cut_with_plane(
                         origin=plane.center,
                         normal=plane.normal,
                     )
-                    actor.cap()
+                    mesh.cap()
 
         # make silhouettes
         if silhouette and regions and alpha:
@@ -337,6 +355,7 @@ class Scene(JupyterMixIn, Render):
                 lw=lw or settings.LW,
                 color=color,
             )
+            self._mark_dirty(actor)
 
     @not_on_jupyter
     def add_label(self, actor, label, **kwargs):
@@ -350,6 +369,7 @@ class Scene(JupyterMixIn, Render):
         actor._needs_label = True
         actor._label_str = label
         actor._label_kwargs = kwargs
+        self._mark_dirty(actor)
 
     def slice(self, plane, actors=None, close_actors=False, invert=False):
         """
@@ -377,12 +397,15 @@ class Scene(JupyterMixIn, Render):
             actors = self.clean_actors.copy()
 
         for actor in listify(actors):
-            actor._mesh = actor._mesh.cut_with_plane(
-                origin=plane.center,
-                normal=plane.normal,
-            )
-            if close_actors:
-                actor.cap()
+            # lower levels of detail are cut too, or they'd show
+            # the whole actor when rendered instead of ._mesh
+            for mesh in [actor._mesh, *actor._lod_meshes]:
+                mesh.cut_with_plane(
+                    origin=plane.center,
+                    normal=plane.normal,
+                )
+                if close_actors:
+                    mesh.cap()
 
             if actor.silhouette is not None:
                 self.plotter.remove(actor.silhouette.mesh)
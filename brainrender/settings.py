@@ -25,15 +25,37 @@ vsettings.use_fxaa = False
 # --------------------------- brainrender settings --------------------------- #
 
 BACKGROUND_COLOR = "white"
+CACHE_MESHES = (
+    True  # cache atlas and neuron meshes as binary files for faster loading
+)
 DEFAULT_ATLAS = "allen_mouse_25um"  # default atlas
 DEFAULT_CAMERA = "three_quarters"  # Default camera settings (orientation etc. see brainrender.camera.py)
+GENE_CACHE_MAX_SIZE = None  # max size (in bytes) of the gene expression cache, least recently used data are removed first. If None the cache is not limited
+GENE_CATALOGUE_TTL = 30  # days after which the catalogue of the genes in the gene expression dataset is downloaded again
 INTERACTIVE = True  # rendering interactive ?
+LOD_LEVELS = (
+    1,
+    0.25,
+    0.05,
+)  # fraction of a region's vertices kept at each level of detail
+LOD_MIN_PIXELS = (
+    400,
+    100,
+)  # min size on screen (in pixels) to render a region at each level of detail
+LOD_MIN_VERTICES = (
+    10000  # regions with fewer vertices are always rendered at full detail
+)
+USE_LOD = True  # render actors with lower levels of detail (e.g. add_brain_region(lod=True)) at lower detail when small on screen or while the camera moves
 LW = 2  # e.g. for silhouettes
 ROOT_COLOR = [0.8, 0.8, 0.8]  # color of the overall brain model's actor
 ROOT_ALPHA = 0.2  # transparency of the overall brain model's actor'
 SCREENSHOT_SCALE = 1
 SHADER_STYLE = "cartoon"  # affects the look of rendered brain regions: [metallic, plastic, shiny, glossy, cartoon]
 SHOW_AXES = True
+STREAMLINES_LOD_TOLERANCES = (
+    10,
+    40,
+)  # max error (in microns) of the simplified streamlines at each lower level of detail
 WHOLE_SCREEN = False  # If true render window is full screen
 OFFSCREEN = False
 NUM_LOGS_KEPT = 100
@@ -1,4 +1,8 @@
 import os
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
 from pathlib import Path
 
 import numpy as np
@@ -9,7 +13,7 @@ from rich.progress import track
 
 import brainrender as br
 from brainrender._jupyter import not_on_jupyter
-from brainrender._video import Video
+from brainrender._video import StreamingVideo, Video
 from brainrender.camera import check_camera_param, get_camera_params
 
 
@@ -22,6 +26,7 @@ class VideoMaker:
         fmt="mp4",
         size="1620x1050",
         make_frame_func=None,
+        encoder="stream",
     ):
         """
         Creates a video by animating a scene and saving a sequence
@@ -36,6 +41,9 @@ class VideoMaker:
             the current frame number as second. At every frame this function
             can do what's needed to animate the scene
         :param size: str, size of video's frames in pixels
+        :param encoder: str. If "stream" the frames are streamed directly
+            to ffmpeg while they are rendered, if "png" the frames are
+            saved as images and encoded once all frames are rendered
         """
         logger.debug(
             f"Creating video with name {name}. Format: {fmt}, size: {size}, save folder: {save_fld}"
@@ -52,6 +60,11 @@ class VideoMaker:
             raise NotImplementedError(
                 "Video creation can only output mp4 videos for now"
             )
+        if encoder not in ("stream", "png"):
+            raise ValueError(
+                f'Video encoder should be "stream" or "png", not: {encoder}'
+            )
+        self.encoder = encoder
 
         self.make_frame_func = make_frame_func or self._make_frame
 
@@ -141,7 +154,25 @@ class VideoMaker:
         logger.debug(f"Saving a video {duration}s long ({fps} fps)")
         _off = br.settings.OFFSCREEN
         br.settings.OFFSCREEN = True  # render offscreen
+        try:
+            return self._make_video(
+                fps,
+                duration,
+                fix_camera,
+                resetcam,
+                render_kwargs,
+                args,
+                kwargs,
+            )
+        finally:
+            br.settings.OFFSCREEN = _off
 
+    def _make_video(
+        self, fps, duration, fix_camera, resetcam, render_kwargs, args, kwargs
+    ):
+        """
+        Renders the frames and encodes the video, see make_video.
+        """
         self.scene.render(interactive=False, **render_kwargs)
 
         if fix_camera:
@@ -159,20 +190,28 @@ class VideoMaker:
         print(f"[{amber}]Saving video in [{orange}]{self.save_fld}")
 
         # Create video
-        video = Video(
+        video_kwargs = dict(
             name=str(self.save_fld.resolve() / self.save_name),
             duration=duration,
             fps=fps,
             fmt=self.video_format,
             size=self.size,
         )
+        if self.encoder == "stream":
+            video = StreamingVideo(plotter=self.scene.plotter, **video_kwargs)
+        else:
+            video = Video(**video_kwargs)
 
-        # Make frames
-        self.generate_frames(fps, duration, video, resetcam, *args, **kwargs)
-        self.scene.close()
+        # Make frames, the video is closed even if that fails
+        # so that ffmpeg and the thread feeding it are stopped
+        try:
+            self.generate_frames(
+                fps, duration, video, resetcam, *args, **kwargs
+            )
+        finally:
+            self.scene.close()
+            out, command = video.close()
 
-        # Stitch frames into uncompressed video
-        out, command = video.close()
         spath = str(
             self.save_fld.resolve() / f"{self.save_name}.{self.video_format}"
         )
@@ -182,9 +221,6 @@ class VideoMaker:
             )
         else:
             print(f"[{amber}]Saved video at: [{orange} bold]{spath}")
-
-        # finish up
-        br.settings.OFFSCREEN = _off
         return spath
 
 
@@ -192,12 +228,8 @@ def sigma(x):
     """
     Sigmoid curve
     """
-    y = 1.05 / (1 + np.exp(-8 * (x - 0.5))) - 0.025
-    if y < 0:
-        y = 0
-    if y > 1:
-        y = 1
-    return y
+    y = 1.05 / (1 + np.exp(-8 * (np.asarray(x) - 0.5))) - 0.025
+    return np.clip(y, 0, 1)
 
 
 class Animation(VideoMaker):
@@ -212,7 +244,15 @@ class Animation(VideoMaker):
     _last_frame_params = None
     _first_zoom = 0
 
-    def __init__(self, scene, save_fld, name, fmt="mp4", size="1620x1050"):
+    def __init__(
+        self,
+        scene,
+        save_fld,
+        name,
+        fmt="mp4",
+        size="1620x1050",
+        encoder="stream",
+    ):
         """
         The animation class facilitates the creation of videos
         by specifying a series of keyframes at given moments during
@@ -224,8 +264,11 @@ class Animation(VideoMaker):
         :param save_fld: str, Path. Where the video will be savd
         :param save_name: str, name of the video
         :param fmt: str. Video format (e.g. 'mp4')
+        :param encoder: str, "stream" or "png" (see VideoMaker)
         """
-        VideoMaker.__init__(self, scene, save_fld, name, fmt=fmt, size=size)
+        VideoMaker.__init__(
+            self, scene, save_fld, name, fmt=fmt, size=size, encoder=encoder
+        )
         logger.debug("Creating animation")
 
         self.keyframes = {}
@@ -252,8 +295,8 @@ class Animation(VideoMaker):
 
         :param time: float, time in seconds during the video
             at which the keyframe takes place.
-        :param duration: float, if >0 the key frame is repeated
-            every 5ms to go from start to start+duration
+        :param duration: float, if >0 the key frame is held
+            from start to start+duration
         :param zoom: camera zoom
         :param camera: dictionary of camera parameters
         :param interpol: str, if `sigma` or `linear` specifies
@@ -273,37 +316,137 @@ class Animation(VideoMaker):
             previous_zoom = list(self.keyframes.values())[0]["zoom"] or 0
             zoom = previous_zoom
 
-        if not duration:
-            self.keyframes[time] = dict(
-                zoom=zoom,
-                camera=camera,
-                callback=callback,
-                interpol=interpol,
-                kwargs=kwargs,
-            )
-        else:
-            for time in np.arange(time, time + duration, 0.001):
-                self.keyframes[time] = dict(
-                    zoom=zoom if time == 0 else None,
-                    camera=camera,
-                    callback=callback,
-                    interpol=interpol,
-                    kwargs=kwargs,
-                )
+        self.keyframes[time] = dict(
+            zoom=zoom,
+            camera=camera,
+            callback=callback,
+            interpol=interpol,
+            kwargs=kwargs,
+            duration=duration,
+        )
 
     def get_keyframe_framenumber(self, fps):
         """
         Keyframes are defines in units of time (s), so we need
-        to know to which frame each keyframe corresponds
+        to know to which frame each keyframe corresponds.
+
+        The keyframes are then compiled into per frame tables with the
+        keyframe shown at each frame (held keyframes cover a range of
+        frames) and, for frames between keyframes, the interpolation
+        factor and interpolated camera and zoom, which are computed
+        for all frames at once.
 
         :param fps: int, frame rate
         """
-        self.keyframes = {
-            int(np.floor(s * fps)): v for s, v in self.keyframes.items()
-        }
-        self.keyframes_numbers = sorted(list(self.keyframes.keys()))
+        params, ranges = [], []
+        for time, kf in self.keyframes.items():
+            start = int(np.floor(time * fps))
+            if kf.get("duration"):
+                # last frame before the end of the hold
+                end = int(np.floor((time + kf["duration"] - 0.001) * fps))
+            else:
+                end = start
+            params.append(kf)
+            ranges.append((start, max(start, end)))
+
+        self.keyframes = {start: kf for kf, (start, _) in zip(params, ranges)}
+        self._keyframe_params = params
+
+        # index of the keyframe shown at each frame, later keyframes
+        # take precedence over overlapping earlier ones
+        nframes = max(self.nframes, max(end for _, end in ranges) + 1)
+        shown = np.full(nframes, -1)
+        for idx, (start, end) in enumerate(ranges):
+            shown[start : end + 1] = idx
+
+        key_frames = np.flatnonzero(shown >= 0)
+        self.keyframes_numbers = key_frames.tolist()
+        self.last_keyframe = int(key_frames[-1])
+
+        # frames after the last keyframe show the last keyframe
+        shown[self.last_keyframe + 1 :] = shown[self.last_keyframe]
+
+        # previous and next keyframes of frames between keyframes
+        frames = np.flatnonzero(shown < 0)
+        nxt_frame = key_frames[np.searchsorted(key_frames, frames)]
+        prev_frame = key_frames[np.searchsorted(key_frames, frames) - 1]
+        prev, nxt = shown[prev_frame], shown[nxt_frame]
+
+        fact = (nxt_frame - frames) / (nxt_frame - prev_frame)
+        use_sigma = np.array(
+            [params[i].get("interpol") == "sigma" for i in nxt], dtype=bool
+        )
+        fact[use_sigma] = sigma(fact[use_sigma])
+
+        self._frame_keyframe = shown
+        self._frame_prev = np.full(nframes, -1)
+        self._frame_next = np.full(nframes, -1)
+        self._frame_fact = np.full(nframes, np.nan)
+        self._frame_prev[frames] = prev
+        self._frame_next[frames] = nxt
+        self._frame_fact[frames] = fact
+
+        self._zoom_path = self._interpolate_path(
+            [kf["zoom"] for kf in params], prev, nxt, fact, frames, nframes
+        )
+
+        # camera of keyframes without one is only known when they are shown
+        cameras = [kf["camera"] for kf in params]
+        self._dynamic_camera = np.zeros(nframes, dtype=bool)
+        self._dynamic_camera[frames] = [
+            cameras[p] is None or cameras[n] is None for p, n in zip(prev, nxt)
+        ]
+
+        self._camera_path = {}
+        for key in {k for cam in cameras if cam is not None for k in cam}:
+            self._camera_path[key] = self._interpolate_path(
+                [None if c is None else c.get(key) for c in cameras],
+                prev,
+                nxt,
+                fact,
+                frames,
+                nframes,
+            )
+
+        # the keys of the interpolated cameras are those of the previous one
+        for p, n in set(zip(prev, nxt)):
+            if cameras[p] is not None and cameras[n] is not None:
+                if not set(cameras[p]) <= set(cameras[n]):
+                    raise ValueError(
+                        "Cameras to interpolate dont have the same set of parameters"
+                    )
 
-    def generate_frames(self, fps, duration, video, resetcam):
+    @staticmethod
+    def _interpolate_path(values, prev, nxt, fact, frames, nframes):
+        """
+        Interpolates the value of a parameter at each frame between
+        keyframes, like _interpolate_values does for a single frame.
+
+        :param values: list, value of the parameter at each keyframe
+            (None if not set)
+        :param prev: np.ndarray, index of the previous keyframe of each frame
+        :param nxt: np.ndarray, index of the next keyframe of each frame
+        :param fact: np.ndarray, interpolation factor of each frame
+        :param frames: np.ndarray, frames between keyframes
+        :param nframes: int, total number of frames
+        """
+        size = max((np.size(v) for v in values if v is not None), default=1)
+        table = np.full((len(values), size), np.nan)
+        for i, value in enumerate(values):
+            if value is not None:
+                table[i] = value
+
+        v1, v2 = table[prev], table[nxt]
+        v1 = np.where(np.isnan(v1), v2, v1)
+        v2 = np.where(np.isnan(v2), v1, v2)
+
+        path = np.full((nframes, size), np.nan)
+        path[frames] = fact[:, None] * v1 + (1 - fact[:, None]) * v2
+        return path
+
+    def generate_frames(
+        self, fps, duration, video, resetcam, start=0, stop=None
+    ):
         """
         Loop to generate frames
 
@@ -311,28 +454,210 @@ class Animation(VideoMaker):
         :param duration: float, video duration in seconds
         :param video: vedo Video class used to create the video
         :param resetcam: bool, if True the camera is reset
+        :param start: int, first frame added to the video. Frames before
+            it are still computed (but not drawn) so that the scene is in
+            the same state as when rendering the whole video
+        :param stop: int, frames from this one on are not generated.
+            If None all frames are generated
         """
         logger.debug(
             f"Generating animation keyframes. Duration: {duration}, fps: {fps}"
         )
-        self.get_keyframe_framenumber(fps)
-
         self.nframes = int(fps * duration)
-        self.last_keyframe = max(self.keyframes_numbers)
+        self.get_keyframe_framenumber(fps)
 
         if self.last_keyframe > self.nframes:
             print(
                 f"[b {orange}]The video will be {self.nframes} frames long, but you have defined keyframes after that, try increasing video duration?"
             )
 
-        for framen in track(
-            range(self.nframes), description="Generating frames..."
-        ):
+        stop = self.nframes if stop is None else min(stop, self.nframes)
+        for framen in track(range(stop), description="Generating frames..."):
             self._make_frame(framen, resetcam)
 
-            if framen > 1:
+            if framen > 1 and framen >= start:
                 video.add_frame()
 
+    @not_on_jupyter
+    def make_video(
+        self,
+        *args,
+        duration=10,
+        fps=30,
+        fix_camera=False,
+        resetcam=False,
+        render_kwargs={},
+        n_workers=None,
+        scene_func=None,
+        **kwargs,
+    ):
+        """
+        Creates a video using user defined parameters.
+
+        Frames are rendered serially unless n_workers > 1 is passed.
+        Then the frames are split in contiguous segments rendered in
+        parallel by separate processes. Each process creates its own
+        scene with `scene_func`, replays (without drawing them) the
+        frames before its segment so that the scene is in the same
+        state as when rendering serially, encodes its frames to a
+        segment and the segments are then joined without re-encoding.
+        This is only faster with as many CPU cores as workers and
+        frames that take long to draw, and only works with the
+        "stream" encoder.
+
+        :param duration: float, duration of the video in seconds
+        :param fps: int, frame rate
+        :param fix_camera: bool, if True the focal point of the camera is set based on the first frame
+        :param resetcam: bool, if True the camera is reset
+        :param render_kwargs: dict, any extra keyword argument to be passed to `scene.render`
+        :param n_workers: int, number of processes rendering the frames
+        :param scene_func: function returning the Scene to animate, used
+            by each process to re-create the scene. It must be picklable
+            (e.g. defined at the top level of a module), like the
+            keyframes' callbacks
+        """
+        if n_workers is None or n_workers <= 1:
+            return super().make_video(
+                *args,
+                duration=duration,
+                fps=fps,
+                fix_camera=fix_camera,
+                resetcam=resetcam,
+                render_kwargs=render_kwargs,
+                **kwargs,
+            )
+
+        if scene_func is None:
+            raise ValueError(
+                "A scene_func is needed to render frames in parallel"
+            )
+        if self.encoder != "stream":
+            raise ValueError(
+                "Frames rendered in parallel can only be streamed to ffmpeg, "
+                + f'use encoder="stream" instead of "{self.encoder}"'
+            )
+        if n_workers > (os.cpu_count() or 1):
+            logger.warning(
+                f"Rendering with {n_workers} workers on {os.cpu_count()} "
+                + "CPU cores, this is likely slower than rendering serially"
+            )
+
+        logger.debug(
+            f"Saving a video {duration}s long ({fps} fps) with {n_workers} workers"
+        )
+        _off = br.settings.OFFSCREEN
+        br.settings.OFFSCREEN = True  # render offscreen
+        try:
+            return self._make_video_parallel(
+                duration,
+                fps,
+                fix_camera,
+                resetcam,
+                render_kwargs,
+                n_workers,
+                scene_func,
+            )
+        finally:
+            br.settings.OFFSCREEN = _off
+
+    def _make_video_parallel(
+        self,
+        duration,
+        fps,
+        fix_camera,
+        resetcam,
+        render_kwargs,
+        n_workers,
+        scene_func,
+    ):
+        """
+        Renders segments of the video in parallel processes
+        and joins them, see make_video.
+        """
+        self.scene.render(interactive=False, **render_kwargs)
+        if fix_camera:
+            # see VideoMaker.make_video
+            self.keyframes[0]["camera"][
+                "focal_point"
+            ] = self.scene.root._mesh.center_of_mass()
+        self.scene.close()
+
+        print(f"[{amber}]Saving video in [{orange}]{self.save_fld}")
+
+        # the first two frames are never added to the video
+        nframes = int(fps * duration)
+        bounds = np.linspace(2, max(nframes, 2), n_workers + 1).astype(int)
+        segments = [(a, b) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+        spath = str(
+            self.save_fld.resolve() / f"{self.save_name}.{self.video_format}"
+        )
+        settings = {
+            k: getattr(br.settings, k) for k in dir(br.settings) if k.isupper()
+        }
+        with tempfile.TemporaryDirectory(dir=self.save_fld) as tmp:
+            names = [
+                str(Path(tmp) / f"segment_{i}") for i in range(len(segments))
+            ]
+
+            # VTK is not fork-safe, start fresh processes
+            with ProcessPoolExecutor(
+                max_workers=n_workers, mp_context=get_context("spawn")
+            ) as pool:
+                futures = [
+                    pool.submit(
+                        _render_segment,
+                        scene_func,
+                        settings,
+                        self.keyframes,
+                        dict(
+                            fps=fps,
+                            duration=duration,
+                            resetcam=resetcam,
+                            start=start,
+                            stop=stop,
+                        ),
+                        render_kwargs,
+                        dict(name=name, fmt=self.video_format, size=self.size),
+                    )
+                    for (start, stop), name in zip(segments, names)
+                ]
+                results = [future.result() for future in futures]
+
+            # join the segments without re-encoding them
+            segments_list = Path(tmp) / "segments.txt"
+            segments_list.write_text(
+                "".join(f"file '{n}.{self.video_format}'\n" for n in names)
+            )
+            command = [
+                "ffmpeg",
+                "-hide_banner",
+                "-loglevel",
+                "error",
+                "-y",
+                "-f",
+                "concat",
+                "-safe",
+                "0",
+                "-i",
+                str(segments_list),
+                "-c",
+                "copy",
+                spath,
+            ]
+            failed = [cmd for out, cmd in results if out]
+            if not failed:
+                out = subprocess.run(command).returncode
+                failed = [" ".join(command)] if out else []
+
+        if failed:
+            print(
+                f"[{orange} bold]ffmpeg returned an error while trying to save video with command:\n    [{salmon}]{failed[0]}"
+            )
+        else:
+            print(f"[{amber}]Saved video at: [{orange} bold]{spath}")
+        return spath
+
     def get_frame_params(self, frame_number):
         """
         Get current parameters (e.g. camera position)
@@ -343,27 +668,32 @@ class Animation(VideoMaker):
         Else the params of two consecutive keyframes are interpolate
         using either a linear or sigmoid function.
         """
-        if frame_number in self.keyframes_numbers:
-            # Check if current frame is a key frame
-            params = self.keyframes[frame_number]
+        frame_number = min(frame_number, len(self._frame_keyframe) - 1)
+        keyframe = self._frame_keyframe[frame_number]
 
-        elif frame_number > self.last_keyframe:
-            # check if current frame is past the last keyframe
-            params = self.keyframes[self.last_keyframe]
+        if keyframe >= 0:
+            # key frame, held key frame or past the last keyframe
+            params = self._keyframe_params[keyframe]
 
         else:
             # interpolate between two key frames
-            prev = [n for n in self.keyframes_numbers if n < frame_number][-1]
-            nxt = [n for n in self.keyframes_numbers if n > frame_number][0]
-            kf1, kf2 = self.keyframes[prev], self.keyframes[nxt]
+            self.segment_fact = self._frame_fact[frame_number]
+            kf1 = self._keyframe_params[self._frame_prev[frame_number]]
+            kf2 = self._keyframe_params[self._frame_next[frame_number]]
 
-            self.segment_fact = (nxt - frame_number) / (nxt - prev)
-            if kf2["interpol"] == "sigma":
-                self.segment_fact = sigma(self.segment_fact)
+            if self._dynamic_camera[frame_number]:
+                camera = self._interpolate_cameras(
+                    kf1["camera"], kf2["camera"]
+                )
+            else:
+                camera = {
+                    key: self._path_value(self._camera_path[key], frame_number)
+                    for key in kf1["camera"]
+                }
 
             params = dict(
-                camera=self._interpolate_cameras(kf1["camera"], kf2["camera"]),
-                zoom=self._interpolate_values(kf1["zoom"], kf2["zoom"]),
+                camera=camera,
+                zoom=self._path_value(self._zoom_path, frame_number),
                 callback=None,
             )
 
@@ -372,6 +702,16 @@ class Animation(VideoMaker):
             params["camera"] = get_camera_params(self.scene)
         return params
 
+    @staticmethod
+    def _path_value(path, frame_number):
+        """
+        Value of an interpolated parameter at a frame, None if not set.
+        """
+        value = path[frame_number]
+        if np.isnan(value).all():
+            return None
+        return value if len(value) > 1 else value[0]
+
     def _make_frame(self, frame_number, resetcam):
         """
         Creates a frame with the correct params
@@ -435,3 +775,37 @@ class Animation(VideoMaker):
         return self.segment_fact * np.array(v1) + (
             1 - self.segment_fact
         ) * np.array(v2)
+
+
+def _render_segment(
+    scene_func, settings, keyframes, frames_kwargs, render_kwargs, video_kwargs
+):
+    """
+    Renders a segment of an Animation in a worker process.
+
+    :param scene_func: function returning the Scene to animate
+    :param settings: dict, values of brainrender's settings
+    :param keyframes: dict, the Animation's keyframes
+    :param frames_kwargs: dict, keyword arguments for Animation.generate_frames
+    :param render_kwargs: dict, keyword arguments for Scene.render
+    :param video_kwargs: dict, keyword arguments for StreamingVideo
+    """
+    for key, value in settings.items():
+        setattr(br.settings, key, value)
+    br.settings.OFFSCREEN = True
+
+    scene = scene_func()
+    name = Path(video_kwargs["name"])
+    anim = Animation(scene, name.parent, name.name, fmt=video_kwargs["fmt"])
+    anim.keyframes = keyframes
+
+    scene.render(interactive=False, **render_kwargs)
+    video = StreamingVideo(
+        fps=frames_kwargs["fps"], plotter=scene.plotter, **video_kwargs
+    )
+    try:
+        anim.generate_frames(video=video, **frames_kwargs)
+    finally:
+        scene.close()
+        out = video.close()
+    return out
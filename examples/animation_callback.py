@@ -1,6 +1,7 @@
-from brainrender import Animation, Scene, settings
 from pathlib import Path
 
+from brainrender import Animation, Scene, settings
+
 settings.SHOW_AXES = False
 
 scene = Scene(atlas_name="allen_mouse_25um")
@@ -14,9 +14,9 @@ from pathlib import Path
 from myterial import orange
 from rich import print
 
-from brainrender.scene import Scene
-from brainrender.actors import Points
 from brainrender import settings
+from brainrender.actors import Points
+from brainrender.scene import Scene
 
 settings.SHADER_STYLE = "plastic"
 
@@ -11,14 +11,13 @@ For more details on brainmapper, please see:
 
 from pathlib import Path
 
+import numpy as np
 from myterial import orange
 from rich import print
 
-from brainrender.scene import Scene
-from brainrender.actors import Points
 from brainrender import settings
-
-import numpy as np
+from brainrender.actors import Points
+from brainrender.scene import Scene
 
 settings.SHADER_STYLE = "plastic"
 settings.SHOW_AXES = False
@@ -32,32 +31,21 @@ regions = ["VISp1", "VISp4", "VISp5"]
 print(f"[{orange}]Running example: {Path(__file__).name}")
 
 
-def get_cells_in_regions(scene, cells_path, regions):
-    cells = np.load(cells_path)
-    new_cells = []
-
-    for cell in cells:
-        if (
-            scene.atlas.structure_from_coords(
-                cell, as_acronym=True, microns=True
-            )
-            in regions
-        ):
-            if cell[0] > 0:
-                new_cells.append(cell)
-
-    new_cells = np.asarray(new_cells)
-
-    return new_cells
-
-
 # Create a brainrender scene
 scene = Scene(title=f"brainmapper cells in {regions}", inset=False)
 
-cells_points = get_cells_in_regions(scene, cells_path, regions)
-
-# Create points actor
-cells = Points(cells_points, radius=45, colors="palegoldenrod", alpha=0.8)
+cells_points = np.load(cells_path)
+cells_points = cells_points[cells_points[:, 0] > 0]
+
+# Create points actor with only the cells in the regions of interest
+cells = Points.filter_by_region(
+    cells_points,
+    scene.atlas,
+    regions,
+    radius=45,
+    colors="palegoldenrod",
+    alpha=0.8,
+)
 
 # Add specific regions
 for region in regions:
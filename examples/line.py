@@ -4,7 +4,7 @@ import vedo
 vedo.settings.default_backend = "vtk"
 
 from brainrender import Scene
-from brainrender.actors import Points, Line
+from brainrender.actors import Line, Points
 
 # Display the Allen Brain mouse atlas.
 scene = Scene(atlas_name="allen_mouse_25um")
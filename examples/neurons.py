@@ -4,7 +4,7 @@ import requests.exceptions
 from morphapi.api.mouselight import MouseLightAPI
 from myterial import orange
 from rich import print
-from urllib3.exceptions import NewConnectionError, MaxRetryError
+from urllib3.exceptions import MaxRetryError, NewConnectionError
 
 from brainrender import Scene
 from brainrender.actors import Neuron, make_neurons
@@ -34,7 +34,7 @@ except (
     MaxRetryError,
     requests.exceptions.ConnectionError,
     requests.exceptions.ReadTimeout,
-) as e:
+):
     print("Failed to download neurons data from neuromorpho.org.")
 
 # Render!
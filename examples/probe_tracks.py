@@ -3,6 +3,7 @@ This example visualizes `.npy` files exported from brainglobe-segmentation
 """
 
 from pathlib import Path
+
 import numpy as np
 
 from brainrender import Scene
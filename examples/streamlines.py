@@ -16,7 +16,7 @@ scene = Scene()
 scene.add_brain_region("TH")
 
 # Get stramlines data and add
-streams = get_streamlines_for_region("TH")[:2]
+streams = get_streamlines_for_region("TH", as_arrays=True)[:2]
 scene.add(*make_streamlines(*streams, color="salmon", alpha=0.5))
 
 # Render!
@@ -16,8 +16,8 @@ This examples shows how to:
 """
 
 from pathlib import Path
-import pooch
 
+import pooch
 from brainglobe_space import AnatomicalSpace
 from brainglobe_utils.IO.image.load import load_any
 from myterial import blue_grey, orange
@@ -5,16 +5,15 @@ data in brainrender. The data used are is the localized expression of
 and saved to a numpy file
 """
 
-import numpy as np
-
-from brainrender import Scene, settings
-from brainrender.actors import Volume
-
 from pathlib import Path
 
+import numpy as np
 from myterial import orange
 from rich import print
 
+from brainrender import Scene, settings
+from brainrender.actors import Volume
+
 settings.SHOW_AXES = False
 volume_file = Path(__file__).parent.parent / "resources" / "volume.npy"
 
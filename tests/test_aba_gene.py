@@ -1,3 +1,483 @@
+import io
+import json
+import os
+import re
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from unittest.mock import patch
+from urllib.parse import parse_qs, unquote, urlparse
+
+import numpy as np
+import pytest
+
+from brainrender import Scene, settings
+from brainrender.atlas_specific import GeneExpressionAPI
+from brainrender.atlas_specific.allen_brain_atlas.gene_expression import (
+    ge_utils,
+)
+from brainrender.atlas_specific.allen_brain_atlas.gene_expression.ge_utils import (
+    MANIFEST,
+    GeneCache,
+    GeneStore,
+    check_gene_cached,
+    download_and_cache,
+    read_raw,
+)
+
+GRID_SIZE = GeneExpressionAPI.grid_size
+GENES = [
+    dict(id="10", gene_symbol="A", gene_name="gene a", entrez_gene_id=None),
+    dict(id="11", gene_symbol="B", gene_name="gene b", entrez_gene_id="5"),
+    dict(id="12", gene_symbol="A", gene_name="gene a2", entrez_gene_id=None),
+]
+
+
+def _write_gene(folder, gene, exp_id, value=1.0, metrics=("energy",)):
+    """Saves fake gene data like the files downloaded from the Allen API"""
+    exp_folder = folder / f"{gene}-{exp_id}"
+    exp_folder.mkdir(parents=True, exist_ok=True)
+    for metric in metrics:
+        data = np.full(GRID_SIZE, value, dtype=np.float32)
+        data.tofile(exp_folder / f"{metric}.raw")
+        (exp_folder / f"{metric}.mhd").write_text("ObjectType = Image")
+    return exp_folder
+
+
+def _gene_zip(exp_id, metrics):
+    """Zipped grid data like those downloaded from the Allen API"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as z:
+        for i, metric in enumerate(metrics):
+            data = np.full(GRID_SIZE, exp_id + i, dtype=np.float32)
+            z.writestr(f"{metric}.raw", data.tobytes())
+            z.writestr(f"{metric}.mhd", "ObjectType = Image")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def allen_server():
+    """
+    Local stand-in for the Allen grid data download server, it supports
+    Range requests and can drop the connection part way through.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), None)
+    server.requested = []
+    server.cut_at = None  # bytes sent before dropping the next response
+    server.fail = 0  # number of requests answered with a server error
+    server.experiments = {"A": [1, 2], "B": [3]}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            server.requested.append((url.path, self.headers.get("Range")))
+            if server.fail:
+                server.fail -= 1
+                self.send_response(503)
+                self.end_headers()
+                return
+
+            if url.path.startswith("/api/genes"):
+                body = json.dumps(dict(success=True, msg=GENES)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+
+            if url.path.startswith("/api"):
+                gene = re.search(r"acronym\$eq'(\w+)'", unquote(url.query))[1]
+                msg = [dict(id=i) for i in server.experiments.get(gene, [])]
+                body = json.dumps(dict(success=True, msg=msg)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            exp_id = int(re.search(r"download/(\d+)", url.path)[1])
+            metrics = parse_qs(url.query)["include"][0].split(",")
+            body = _gene_zip(exp_id, metrics)
+
+            start = 0
+            if self.headers.get("Range"):
+                start = int(
+                    re.search(r"bytes=(\d+)-", self.headers["Range"])[1]
+                )
+            if start >= len(body):
+                self.send_response(416)
+                self.end_headers()
+                return
+
+            self.send_response(206 if start else 200)
+            self.send_header("Content-Type", "application/zip")
+            self.send_header("Content-Length", str(len(body) - start))
+            self.end_headers()
+
+            if server.cut_at is not None:
+                self.wfile.write(body[start : server.cut_at])
+                server.cut_at = None
+                self.close_connection = True
+            else:
+                self.wfile.write(body[start:])
+
+        def log_message(self, *args):
+            pass
+
+    server.RequestHandlerClass = Handler
+    Thread(target=server.serve_forever, daemon=True).start()
+    server.url = (
+        f"http://127.0.0.1:{server.server_port}/grid_data/download/EXP_ID"
+        + "?include=METRICS"
+    )
+    server.genes_url = f"http://127.0.0.1:{server.server_port}/api/genes"
+    server.query_url = (
+        f"http://127.0.0.1:{server.server_port}/api/v2/data/query.json?"
+        + "criteria=genes[acronym$eq'-GENE_SYMBOL-']"
+    )
+    with patch("brainrender._io.RETRY_BACKOFF", 0):
+        yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def geapi(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        GeneExpressionAPI, "gene_expression_cache", tmp_path / "cache"
+    )
+    monkeypatch.setattr(ge_utils, "_caches", {})
+    return GeneExpressionAPI()
+
+
+def test_gene_cache(tmp_path):
+    folder = tmp_path / "cache"
+    _write_gene(folder, "Gene1", 1, metrics=("energy", "density"))
+
+    # data cached before the manifest existed are indexed
+    cache = GeneCache(folder)
+    assert (folder / MANIFEST).exists()
+    assert len(cache) == 1
+    path = cache.get("Gene1", 1, "energy")
+    assert path == folder / "Gene1-1" / "energy.raw"
+    assert cache.get("Gene1", 1, "intensity") is None
+    assert cache.get("Gene1", 2, "energy") is None
+    assert cache.size == 2 * np.prod(GRID_SIZE) * 4
+
+    entry = cache.entries["Gene1-1"]["files"]["energy"]
+    assert entry["size"] == path.stat().st_size
+
+    _write_gene(folder, "Gene2", 5)
+    cache.add("Gene2", 5)
+    assert GeneCache(folder).entries == cache.entries  # saved
+    assert check_gene_cached(folder, "Gene2", 5).endswith("Gene2-5")
+    assert not check_gene_cached(folder, "Gene2", 6)
+
+    cache.remove("Gene1", 1)
+    assert not (folder / "Gene1-1").exists()
+    assert cache.get("Gene1", 1) is None
+
+    # data removed from outside brainrender are dropped from the index
+    (folder / "Gene2-5" / "energy.raw").unlink()
+    assert cache.get("Gene2", 5, "energy") is None
+    assert len(GeneCache(folder)) == 0
+
+
+def test_gene_cache_processes(tmp_path):
+    # two instances of the same folder, as used by two processes
+    folder = tmp_path / "cache"
+    first, second = GeneCache(folder), GeneCache(folder)
+    for cache, gene in [(first, "A"), (second, "B")]:
+        _write_gene(folder, gene, 1)
+        cache.add(gene, 1)
+    assert sorted(GeneCache(folder).entries) == ["A-1", "B-1"]
+    assert first.get("B", 1, "energy") is not None  # reloaded
+    assert not list(folder.glob(".*.lock"))
+
+    # truncated files aren't used
+    path = first.get("A", 1, "energy")
+    with open(path, "r+b") as fout:
+        fout.truncate(10)
+    assert second.get("A", 1, "energy") is None
+    assert sorted(GeneCache(folder).entries) == ["B-1"]
+
+    # locks left by crashed processes are ignored
+    lock = folder / f".{MANIFEST}.lock"
+    lock.touch()
+    with pytest.raises(TimeoutError):
+        with ge_utils.file_lock(lock, timeout=0.05):
+            pass
+    os.utime(lock, (0, 0))
+    first.remove("B", 1)
+    assert not lock.exists()
+    assert len(GeneCache(folder)) == 0
+
+
+def test_gene_cache_eviction(tmp_path, monkeypatch):
+    gene_size = np.prod(GRID_SIZE) * 4
+    monkeypatch.setattr(settings, "GENE_CACHE_MAX_SIZE", 2 * gene_size)
+
+    folder = tmp_path / "cache"
+    cache = GeneCache(folder)
+    for exp_id in range(3):
+        _write_gene(folder, "Gene", exp_id)
+        cache.add("Gene", exp_id)
+        os.utime(folder / f"Gene-{exp_id}", (exp_id, exp_id))
+    assert len(cache) == 2
+    assert not (folder / "Gene-0").exists()
+
+    cache.get("Gene", 1)  # now used more recently than 2
+    _write_gene(folder, "Gene", 3)
+    cache.add("Gene", 3)
+    assert sorted(cache.entries) == ["Gene-1", "Gene-3"]
+    assert cache.size <= 2 * gene_size
+
+
+def test_read_raw(tmp_path):
+    path = _write_gene(tmp_path, "Gene", 1, value=2) / "energy.raw"
+    data = read_raw(path, GRID_SIZE)
+    assert isinstance(data, np.memmap)
+    assert np.all(data == 2)
+
+    data[0, 0, 0] = 5  # copy on write, the file isn't changed
+    assert np.all(read_raw(path, GRID_SIZE) == 2)
+
+
+def test_gene_store(geapi):
+    folder = geapi.gene_expression_cache
+    for i, gene in enumerate(["A", "B", "C"]):
+        _write_gene(folder, gene, i, value=i)
+        geapi.cache.add(gene, i)
+
+    store = geapi.get_gene_store()
+    assert isinstance(store, GeneStore)
+    assert store.data.shape == (3, *GRID_SIZE)
+    assert isinstance(store.data, np.memmap)
+    assert store.genes == ["A", "B", "C"]
+    assert store.exp_ids == [0, 1, 2]
+    assert np.all(store.get("B", 1) == 1)
+    assert store.gene_rows("C") == [2]
+
+    # reopened without rebuilding
+    path = store.path
+    mtime = path.stat().st_mtime_ns
+    assert geapi.get_gene_store().keys == store.keys
+    assert path.stat().st_mtime_ns == mtime
+
+    # updated when new experiments are cached
+    _write_gene(folder, "A", 7, value=7)
+    geapi.cache.add("A", 7)
+    store = geapi.get_gene_store()
+    assert len(store) == 4
+    assert store.gene_rows("A") == [0, 1]
+    assert np.all(store.get("A", 7) == 7)
+    assert np.all(store.get("C", 2) == 2)
+
+    # the store isn't indexed as a gene experiment
+    (folder / MANIFEST).unlink()
+    assert len(GeneCache(folder)) == 4
+
+
+def test_download_and_cache(allen_server, tmp_path):
+    url = allen_server.url.replace("EXP_ID", "3").replace(
+        "METRICS", "energy,density"
+    )
+    folder = tmp_path / "Gene-3"
+    download_and_cache(url, folder, metrics=["energy"])
+    assert sorted(f.name for f in folder.iterdir()) == [
+        "energy.mhd",
+        "energy.raw",
+    ]
+    assert np.all(read_raw(folder / "energy.raw", GRID_SIZE) == 3)
+    assert not list(tmp_path.glob(".*.part"))
+
+    # interrupted downloads are resumed
+    allen_server.cut_at = 1 << 20
+    allen_server.requested.clear()
+    download_and_cache(url, folder)
+    assert allen_server.requested[1][1] == f"bytes={1 << 20}-"
+    assert np.all(read_raw(folder / "density.raw", GRID_SIZE) == 4)
+
+
+def test_download_and_cache_corrupted(allen_server, tmp_path):
+    url = allen_server.url.replace("EXP_ID", "3").replace("METRICS", "energy")
+    part = tmp_path / ".Gene-3.zip.part"
+    part.write_bytes(b"not a zip file" * 100000)  # bigger than the data
+
+    with pytest.raises(ValueError):
+        download_and_cache(url, tmp_path / "Gene-3")
+    assert not part.exists()  # downloaded again next time
+
+
+def test_get_gene_data_download(geapi, allen_server, monkeypatch):
+    monkeypatch.setattr(geapi, "download_url", allen_server.url)
+    monkeypatch.setattr(geapi, "get_gene_experiments", lambda gene: [5, 6])
+
+    data = geapi.get_gene_data("Gene", 6, metric="density")
+    assert np.all(data == 6)
+    assert [url for url, _ in allen_server.requested] == [
+        "/grid_data/download/5",
+        "/grid_data/download/6",
+    ]
+    assert geapi.cache.get("Gene", 6, "energy") is None
+    assert geapi.cache.get("Gene", 5, "density") is not None
+
+
+def test_fetch_genes(geapi, allen_server, monkeypatch):
+    monkeypatch.setattr(geapi, "download_url", allen_server.url)
+    monkeypatch.setattr(geapi, "gene_experiments_url", allen_server.query_url)
+
+    def no_probe(*args, **kwargs):
+        raise AssertionError("Connection probed before request")
+
+    monkeypatch.setattr("brainrender._io.connected_to_internet", no_probe)
+
+    allen_server.fail = 2  # retried with backoff
+    data = geapi.fetch_genes(["A", "B", "C", "A"], max_concurrency=3)
+    assert list(data) == ["A", "B", "C"]
+    assert sorted(data["A"]) == [1, 2]
+    assert np.all(data["A"][2] == 2)
+    assert np.all(data["B"][3] == 3)
+    assert data["C"] == {}
+    assert len(geapi.cache) == 3
+
+    # cached experiments aren't downloaded again
+    allen_server.requested.clear()
+    data = geapi.fetch_genes(["A", "B"])
+    assert np.all(data["A"][1] == 1)
+    assert not any("download" in url for url, _ in allen_server.requested)
+
+    # experiments that can't be downloaded are skipped
+    allen_server.experiments["D"] = [4]
+    allen_server.fail = 100
+    assert geapi.fetch_genes(["D"]) == {"D": {}}
+
+
+def test_genes_catalogue(geapi, allen_server, monkeypatch):
+    monkeypatch.setattr(
+        GeneExpressionAPI, "all_genes_url", allen_server.genes_url
+    )
+
+    assert geapi.get_gene_id_by_name("A") == 10  # the first with the symbol
+    assert geapi.get_gene_symbol_by_id(11) == "B"
+    assert geapi.get_gene_id_by_name("C") is None
+    assert len(allen_server.requested) == 1
+
+    # saved in the cache
+    path = geapi.gene_expression_cache / geapi.genes_catalogue
+    assert path.exists()
+    other = GeneExpressionAPI()
+    assert other.get_gene_symbol_by_id("12") == "A"
+    assert list(other.genes.gene_name) == ["gene a", "gene b", "gene a2"]
+    assert len(allen_server.requested) == 1
+
+    # downloaded again when outdated
+    old = path.stat().st_mtime - (settings.GENE_CATALOGUE_TTL + 1) * 24 * 3600
+    os.utime(path, (old, old))
+    GeneExpressionAPI().load_all_genes()
+    assert len(allen_server.requested) == 2
+
+    # the outdated catalogue is used if it can't be downloaded
+    os.utime(path, (old, old))
+    allen_server.fail = 100
+    assert GeneExpressionAPI().get_gene_id_by_name("B") == 11
+
+
+def test_region_expression(geapi):
+    scene = Scene()
+    atlas = scene.atlas
+    annotation = geapi.get_grid_annotation(atlas)
+    assert annotation.shape == tuple(GRID_SIZE)
+    assert (geapi.gene_expression_cache / ".annotations").is_dir()
+    assert geapi.get_grid_annotation(atlas) is annotation
+
+    rng = np.random.default_rng(0)
+    grids = rng.random((3, *GRID_SIZE))
+    grids[0, :10] = -1  # no data
+
+    table = geapi.get_region_expression(grids, atlas, ["TH", "MOs", "root"])
+    assert table.shape == (3, 3)
+    for region in ("TH", "MOs"):
+        ids = [atlas.structures[region]["id"]] + [
+            atlas.structures[r]["id"]
+            for r in atlas.get_structure_descendants(region)
+        ]
+        mask = np.isin(annotation, ids)
+        for row, grid in enumerate(grids):
+            valid = mask & (grid >= 0)
+            assert np.isclose(table[region][row], grid[valid].mean())
+
+    maxima = geapi.get_region_expression(
+        {"A": grids[0], "B": {5: grids[1]}}, atlas, stat="max"
+    )
+    assert list(maxima.index) == ["A", "B-5"]
+    assert "TH" in maxima.columns and "root" in maxima.columns
+    assert maxima["root"]["B-5"] == grids[1][annotation > 0].max()
+
+    with pytest.raises(ValueError):
+        geapi.get_region_expression(grids, atlas, stat="median")
+
+    # region actors colored by expression
+    actors = scene.add_brain_region("TH", "MOs")
+    scene.render(interactive=False)
+    geapi.color_regions(actors, table.iloc[1], cmap="Reds", vmin=0, vmax=1)
+    merged = scene.add_brain_region("TH", "MOs", force=True, merge=True)
+    geapi.color_regions(merged, table.iloc[1], cmap="Reds", vmin=0, vmax=1)
+    for actor in actors:
+        color = merged._colors[merged.regions.index(actor.name)]
+        assert np.allclose(actor.mesh.color(), color)
+        assert np.allclose(actor._mesh.color(), color)  # rendered
+    scene.close()
+
+
+def test_griddata_to_regions(geapi):
+    # a linear grid is interpolated exactly: its value is the AP index
+    grid = np.broadcast_to(
+        np.arange(GRID_SIZE[2], dtype=float), GRID_SIZE
+    ).copy()
+    points = np.array([[1000.0, 2000, 3000], [1100, 50, 50], [-500, 0, 0]])
+    values = ge_utils.sample_grid(grid, points, geapi.voxel_size)
+    assert np.allclose(values[:2], [4.5, 5])
+    assert np.isnan(values[2])  # outside of the grid
+
+    # voxels without data are left out
+    grid[:, :, 5] = -1
+    assert ge_utils.sample_grid(grid, points[:1], geapi.voxel_size) == 4
+
+    scene = Scene()
+    actors = scene.add_brain_region("TH", "MOs")
+    geapi.griddata_to_regions(grid, actors, cmap="Reds")
+    for actor in actors:
+        expected = ge_utils.sample_grid(
+            grid, actor.mesh.vertices, geapi.voxel_size
+        )
+        sampled = actor.mesh.pointdata["expression"]
+        assert np.allclose(sampled, expected, equal_nan=True)
+
+        # rendered meshes are in brainrender's space, same values
+        for mesh in [actor._mesh] + actor._lod_meshes:
+            assert mesh.dataset.GetPointData().GetScalars() is not None
+            assert (
+                mesh.mapper.GetScalarRange() == actor.mapper.GetScalarRange()
+            )
+        assert np.allclose(
+            actor._mesh.pointdata["expression"], sampled, equal_nan=True
+        )
+
+    scene.render(interactive=False)
+    scene.close()
+
+
+def test_get_gene_data_from_cache(geapi):
+    _write_gene(geapi.gene_expression_cache, "Gene", 10, value=3)
+    geapi.cache.add("Gene", 10)
+
+    data = geapi.get_gene_data("Gene", 10)
+    assert data.shape == tuple(GRID_SIZE)
+    assert np.all(data == 3)
+
+
 # from brainrender import Scene
 # from brainrender.atlas_specific import GeneExpressionAPI
 # from brainrender.actor import Actor
@@ -1,7 +1,9 @@
+import numpy as np
 import pytest
 
 from brainrender import Scene
 from brainrender.actor import Actor
+from brainrender.actors import Points
 
 
 @pytest.mark.parametrize(
@@ -23,3 +25,42 @@ def test_atlas_plane(pos, plane, norm):
 
     # # s.render(interactive=False)
     del s
+
+
+def test_structures_from_coords():
+    s = Scene()
+    atlas = s.atlas
+    coords = np.array(
+        [
+            atlas.root.center_of_mass(),
+            [-1000, -1000, -1000],
+            np.array(atlas.shape_um) * 2,
+        ]
+    )
+
+    ids = atlas.structures_from_coords(coords)
+    assert ids.shape == (3,)
+    assert ids[0] == atlas.structure_from_coords(coords[0], microns=True)
+    assert ids[1] == 0 and ids[2] == 0
+
+    acronyms = atlas.structures_from_coords(coords, as_acronym=True)
+    assert acronyms[1] == "Outside atlas"
+
+    hems = atlas.hemispheres_from_coords(coords)
+    assert hems[0] == atlas.hemisphere_from_coords(coords[0], microns=True)
+    assert hems[1] == 0
+
+    assert atlas.in_region(coords, "root").tolist() == [True, False, False]
+    assert not atlas.in_region(coords, "root", include_descendants=False).any()
+    del s
+
+
+def test_points_filter_by_region():
+    s = Scene()
+    th = s.add_brain_region("TH")
+    coords = np.vstack([th.center_of_mass(), [-1000, -1000, -1000]])
+
+    pts = Points.filter_by_region(coords, s.atlas, "TH", mode="glyph")
+    assert isinstance(pts, Actor)
+    assert pts.mesh.npoints == s.atlas.in_region(coords, "TH").sum()
+    del s
@@ -0,0 +1,52 @@
+import numpy as np
+from vedo import Sphere
+
+from brainrender import _cache
+from brainrender.render import mtx
+
+
+def test_mesh_cache_roundtrip(tmp_path):
+    mesh = Sphere(r=100).apply_transform(mtx)
+    key = f"997_{_cache.transform_key(mtx)}"
+
+    assert _cache.load_mesh(tmp_path, key) is None
+    _cache.save_mesh(mesh, tmp_path, key)
+
+    for fname in _cache.MESH_FILES:
+        assert np.load(tmp_path / key / fname, mmap_mode="r").dtype in (
+            np.float32,
+            np.int32,
+        )
+
+    cached = _cache.load_mesh(tmp_path, key)
+    assert cached.npoints == mesh.npoints
+    assert cached.ncells == mesh.ncells
+    assert np.allclose(cached.vertices, mesh.vertices)
+    assert np.array_equal(cached.cells, mesh.cells)
+
+
+def test_transform_key():
+    assert _cache.transform_key(mtx) == _cache.transform_key(np.array(mtx))
+    assert _cache.transform_key(mtx) != _cache.transform_key(np.eye(4))
+
+
+def test_mesh_cache_folder_versions(tmp_path, monkeypatch):
+    monkeypatch.setattr(_cache, "cache_dir", tmp_path)
+
+    old = _cache.mesh_cache_folder("allen_mouse_25um", "1.1")
+    _cache.save_mesh(Sphere(), old, "key")
+    other = _cache.mesh_cache_folder("allen_mouse_100um", "1.1")
+
+    # other versions in use by other processes are kept
+    new = _cache.mesh_cache_folder("allen_mouse_25um", "1.2")
+    assert new.exists()
+    assert _cache.load_mesh(old, "key") is not None
+
+    _cache.prune_mesh_cache("allen_mouse_25um", keep_version="1.2")
+    assert new.exists()
+    assert not old.exists()
+    assert other.exists()
+    assert set(tmp_path.iterdir()) == {other, new}  # no leftovers
+
+    _cache.prune_mesh_cache("allen_mouse_100um")
+    assert not other.exists()
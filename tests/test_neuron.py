@@ -1,11 +1,12 @@
 from pathlib import Path
 
+import numpy as np
 import pytest
 from vedo import Sphere
 
-from brainrender import Scene
+from brainrender import Scene, _cache
 from brainrender.actor import Actor
-from brainrender.actors import Neuron, make_neurons
+from brainrender.actors import Neuron, make_neurons, neurons
 
 resources_dir = Path(__file__).parent.parent / "resources"
 
@@ -31,3 +32,53 @@ def test_neuron():
 def test_make_neurons():
     data_path = resources_dir / "neuron1.swc"
     make_neurons(data_path, data_path)
+
+
+def test_neuron_mesh_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(neurons, "neurons_cache_dir", tmp_path)
+    data_path = resources_dir / "neuron1.swc"
+
+    neuron = Neuron(data_path)
+    key = _cache.neuron_mesh_key(data_path, 8, 15, True)
+    assert (tmp_path / key).is_dir()
+    assert key != _cache.neuron_mesh_key(data_path, 4, 15, True)
+    assert key != _cache.neuron_mesh_key(data_path, 8, 15, False)
+
+    cached = Neuron(data_path)
+    assert cached.name == neuron.name == "neuron1.swc"
+    assert np.allclose(cached.mesh.vertices, neuron.mesh.vertices, atol=1e-3)
+
+    # a copy of the file shares the same cache entry
+    copy = tmp_path / "copy.swc"
+    copy.write_bytes(data_path.read_bytes())
+    assert _cache.neuron_mesh_key(copy, 8, 15, True) == key
+
+
+def test_make_neurons_parallel(tmp_path, monkeypatch):
+    monkeypatch.setattr(neurons, "neurons_cache_dir", tmp_path / "cache")
+    data_path = resources_dir / "neuron1.swc"
+    other = tmp_path / "neuron2.swc"
+    other.write_bytes(b"# copy\n" + data_path.read_bytes())
+
+    parallel = make_neurons(
+        data_path, other, data_path, neurite_radius=4, n_workers=2
+    )
+    assert [n.name for n in parallel] == [
+        "neuron1.swc",
+        "neuron2.swc",
+        "neuron1.swc",
+    ]
+    assert len(list((tmp_path / "cache").iterdir())) == 2
+
+    # the same file gives actors that don't share their mesh
+    assert parallel[0].mesh is not parallel[2].mesh
+    parallel[2].mesh.c("red")
+    assert not np.allclose(parallel[0].mesh.color(), parallel[2].mesh.color())
+
+    serial = Neuron(data_path, neurite_radius=4)
+    assert np.allclose(serial.mesh.vertices, parallel[0].mesh.vertices)
+
+    # cached meshes are not created again
+    monkeypatch.setattr(neurons, "MorphoNeuron", None)
+    again = make_neurons(data_path, other, neurite_radius=4, n_workers=2)
+    assert again[1].mesh.npoints == parallel[1].mesh.npoints
@@ -69,3 +69,27 @@ def test_points_error():
             resources_dir / "random_cells.h5",
             colors="k",
         )
+
+
+@pytest.mark.parametrize("mode", ["glyph", "sprite"])
+def test_points_instanced(mode):
+    data = np.load(resources_dir / "random_cells.npy")
+    colors = ["k" if i % 2 else "salmon" for i in range(len(data))]
+    radius = np.linspace(10, 30, len(data))
+
+    act = Points(data, colors=colors, radius=radius, mode=mode)
+    assert isinstance(act, Actor)
+    assert act.mesh.npoints == len(data)
+    assert act.mesh.pointdata["radius"].dtype == np.float32
+    assert act.mesh.pointdata["rgb"].shape == (len(data), 3)
+
+    # the instancing mapper should survive cloning (e.g. when rendered)
+    cloned = act.mesh.clone()
+    assert type(cloned.mapper) is type(act.mesh.mapper)
+    assert cloned.mode == mode
+
+
+def test_points_mode_error():
+    data = np.load(resources_dir / "random_cells.npy")
+    with pytest.raises(ValueError):
+        Points(data, mode="blobs")
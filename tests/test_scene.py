@@ -1,5 +1,11 @@
-from brainrender import Scene
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from brainrender import Scene, settings
 from brainrender.actor import Actor
+from brainrender.actors import RegionSet
 
 
 def test_scene_creation():
@@ -120,3 +126,197 @@ def test_get_actors():
     assert len(found2) == 2
     assert th in found2
     assert s.root in found2
+
+
+def test_brain_regions_parallel():
+    scene = Scene()
+    regions = ["TH", "MOs", "CA1", "STN"]
+    serial = scene.atlas.get_region(*regions)
+
+    regs = scene.add_brain_region(*regions, n_workers=4)
+    assert [r.name for r in regs] == regions
+    for reg, ref in zip(regs, serial):
+        assert reg.mesh.npoints == ref.mesh.npoints
+        assert list(reg.mesh.color()) == list(ref.mesh.color())
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        regs = scene.atlas.get_region(*regions, executor=executor)
+    assert [r.name for r in regs] == regions
+
+
+def test_brain_regions_merged():
+    scene = Scene()
+    regions = ["TH", "MOs", "CA1"]
+    region_set = scene.add_brain_region(*regions, merge=True)
+    assert isinstance(region_set, RegionSet)
+    assert scene.actors[-1] == region_set
+    assert region_set.regions == regions
+
+    # regions already in the set are not added again
+    assert scene.add_brain_region("TH", merge=True) is None
+
+    scene.render(interactive=False)
+    ids = region_set._mesh.celldata["region_id"]
+    assert set(ids) == {scene.atlas.structures[r]["id"] for r in regions}
+    assert region_set.region_from_cell(0) == regions[0]
+
+    region_set.set_color("MOs", [1, 0, 0]).set_alpha(382, 0.5)
+    region_set.hide("TH")
+    assert region_set.lut.GetTableValue(0)[3] == 0
+    assert region_set.lut.GetTableValue(1)[:3] == (1, 0, 0)
+    assert abs(region_set.lut.GetTableValue(2)[3] - 0.5) < 0.01
+    region_set.show()
+    assert region_set.lut.GetTableValue(0)[3] == 1
+
+
+def test_region_set_inputs(monkeypatch):
+    monkeypatch.setattr(settings, "CACHE_MESHES", False)
+    scene = Scene()
+    th, mos = scene.atlas.get_region("TH", "MOs")
+
+    region_set = RegionSet([th, mos], ids=[5, 6])
+    assert "region_id" not in th.mesh.celldata.keys()
+    assert "region_id" not in mos.mesh.celldata.keys()
+
+    # before rendering the region set has no transformed mesh
+    assert "_mesh" not in region_set.__dict__
+    assert region_set.region_from_cell(0) == "TH"
+
+    with pytest.raises(ValueError):
+        RegionSet([th, mos], ids=[5, 5])
+
+
+def test_region_set_pick_lod(monkeypatch):
+    monkeypatch.setattr(settings, "LOD_MIN_VERTICES", 0)
+    scene = Scene()
+    region_set = scene.add_brain_region("TH", "MOs", merge=True, lod=True)
+    assert len(region_set._lod_meshes) == 2
+
+    # cells are those of the rendered level of detail
+    for level in (0, 2):
+        scene.render(interactive=False, lod=level)
+        scene.plotter.render()
+        rendered = region_set._mesh.mapper.GetInput()
+        last = rendered.GetNumberOfCells() - 1
+        assert region_set.region_from_cell(0) == "TH"
+        assert region_set.region_from_cell(last) == "MOs"
+    assert last < region_set._mesh.ncells - 1  # a smaller mesh
+
+
+def signed_volume(mesh):
+    """Volume of a closed mesh, negative if its faces point inwards"""
+    v0, v1, v2 = mesh.vertices[np.array(mesh.cells)].transpose(1, 0, 2)
+    return np.einsum("ij,ij->", v0, np.cross(v1, v2)) / 6
+
+
+def test_brain_regions_lod(monkeypatch):
+    monkeypatch.setattr(settings, "LOD_MIN_VERTICES", 0)
+    scene = Scene()
+
+    # levels of detail are only made on request
+    assert scene.add_brain_region("MOs")._lod_meshes == []
+
+    th = scene.add_brain_region("TH", lod=True)
+    lods = th._lod_meshes
+    assert len(lods) == len(settings.LOD_LEVELS) - 1
+    assert th._mesh.npoints > lods[0].npoints > lods[1].npoints
+
+    def rendered():
+        datasets = [m.dataset for m in (th._mesh, *lods)]
+        return datasets.index(th._mesh.mapper.GetInput())
+
+    scene.render(interactive=False, lod=2)
+    scene.plotter.render()
+    assert rendered() == 2
+
+    # all levels have the faces oriented the same way
+    orientation = np.sign(signed_volume(th._mesh))
+    for lod in lods:
+        assert np.sign(signed_volume(lod)) == orientation
+
+    # picked from the size on screen
+    scene.lod = None
+    scene.plotter.camera.Zoom(0.01)
+    scene.plotter.render()
+    assert rendered() == 2
+    scene.plotter.camera.Zoom(1000)
+    scene.plotter.render()
+    assert rendered() == 0
+
+    # lowest detail while interacting
+    interactor = scene.plotter.interactor
+    if interactor is not None:
+        window = scene.plotter.window
+        window.SetDesiredUpdateRate(interactor.GetDesiredUpdateRate())
+        scene.plotter.render()
+        assert rendered() == 2
+        window.SetDesiredUpdateRate(interactor.GetStillUpdateRate())
+        scene.plotter.render()
+        assert rendered() == 0
+
+
+def test_slice_lod(monkeypatch):
+    monkeypatch.setattr(settings, "LOD_MIN_VERTICES", 0)
+    scene = Scene()
+    th = scene.add_brain_region("TH", lod=True)
+    scene.render(interactive=False)
+    scene.slice("sagittal", close_actors=True)
+
+    bounds = th._mesh.bounds()
+    for level in range(len(settings.LOD_LEVELS)):
+        scene.render(interactive=False, lod=level)
+        scene.plotter.render()
+        rendered = th._mesh.mapper.GetInput().GetBounds()
+        assert rendered[4] >= bounds[4] - 1
+        assert rendered[5] <= bounds[5] + 1
+
+
+def test_render_only_changed_actors(monkeypatch):
+    scene = Scene()
+    scene.render(interactive=False)
+    assert not scene._dirty_actors
+    assert scene.root._style is not None
+
+    styled = []
+    apply_style = scene._apply_style
+
+    def _apply_style(actors, style):
+        styled.extend(actors)
+        apply_style(actors, style)
+
+    monkeypatch.setattr(scene, "_apply_style", _apply_style)
+
+    # only the camera changes
+    scene.render(interactive=False, camera="sagittal")
+    assert styled == []
+
+    th = scene.add_brain_region("TH")
+    scene.add_label(th, "TH")
+    scene.render(interactive=False)
+    assert styled == [th]
+    assert th.labels and all(label._is_added for label in th.labels)
+
+    # changing the shader style restyles all actors
+    styled.clear()
+    monkeypatch.setattr(settings, "SHADER_STYLE", "plastic")
+    scene.render(interactive=False)
+    assert styled == scene.clean_actors
+    assert th._style == "plastic"
+
+
+def test_restyle_keeps_orientation(monkeypatch):
+    scene = Scene()
+    th = scene.add_brain_region("TH")
+    scene.render(interactive=False)
+    cells = th._mesh.cells[:10]
+    normals = th._mesh.clone().compute_normals().vertex_normals.copy()
+
+    # each style change mustn't reverse the meshes again
+    for style in ("plastic", "metallic"):
+        monkeypatch.setattr(settings, "SHADER_STYLE", style)
+        scene.render(interactive=False)
+        assert th._style == style
+        assert th._mesh.cells[:10] == cells
+        assert np.allclose(
+            th._mesh.clone().compute_normals().vertex_normals, normals
+        )
@@ -1,16 +1,37 @@
+import json
+import re
 import tempfile
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
+from threading import Thread
 from unittest.mock import MagicMock, patch
+from urllib.parse import unquote
 
 import numpy as np
 import pandas as pd
 import pytest
 
-from brainrender.atlas_specific import get_streamlines_for_region
+from brainrender import Scene
+from brainrender.actors import Volume
+from brainrender.actors.streamlines import (
+    Streamlines,
+    StreamlinesData,
+    make_streamlines,
+    make_streamlines_density,
+)
+from brainrender.atlas_specific import (
+    StreamlinesIndex,
+    get_streamlines_for_region,
+)
 from brainrender.atlas_specific.allen_brain_atlas.streamlines import (
+    DOWNLOAD_RETRIES,
+    SkeletonDecodeError,
     _get_injection_site_um,
     _get_ml_extent_um,
-    _skeleton_to_dataframe,
+    _get_skeleton,
+    _label_planes,
+    _skeleton_to_streamlines,
     get_streamlines_data,
 )
 
@@ -38,6 +59,175 @@ def _make_fake_skeleton():
     return skeleton
 
 
+def _make_streamlines_data():
+    lines = [
+        [{"x": float(i), "y": 0.0, "z": 0.0} for i in range(0, 500, 100)],
+        [{"x": 0.0, "y": float(i), "z": 0.0} for i in range(0, 300, 100)],
+        [{"x": 1.0, "y": 1.0, "z": 1.0}],  # single point, not drawn
+    ]
+    return pd.DataFrame(
+        {"lines": [lines], "injection_sites": [[{"x": 0, "y": 0, "z": 0}]]}
+    )
+
+
+def test_streamlines_data(tmp_path):
+    data = StreamlinesData.from_dataframe(_make_streamlines_data())
+    assert len(data) == 3
+    assert data.points.dtype == np.float32
+    assert data.offsets.tolist() == [0, 5, 8, 9]
+    assert [len(line) for line in data.lines] == [5, 3, 1]
+    assert np.allclose(data.injection_sites, [[0, 0, 0]])
+
+    data.save(tmp_path / "data.npz")
+    loaded = StreamlinesData.load(tmp_path / "data.npz")
+    assert np.array_equal(loaded.points, data.points)
+    assert np.array_equal(loaded.offsets, data.offsets)
+    assert list(tmp_path.iterdir()) == [tmp_path / "data.npz"]
+
+    df = data.to_dataframe()
+    assert df["lines"].iloc[0][1][2] == {"x": 0, "y": 200, "z": 0}
+
+    lines = StreamlinesData.from_lines(data.lines, data.injection_sites)
+    assert np.array_equal(lines.offsets, data.offsets)
+
+    with pytest.raises(ValueError):
+        StreamlinesData(data.points, [0, 5])
+
+
+def test_streamlines_actor():
+    data = _make_streamlines_data()
+
+    tubes = Streamlines(data, radius=10, show_injection=False)
+    assert tubes.mesh.dataset.GetNumberOfLines() == 0
+    assert tubes.mesh.npoints == 8 * (5 + 3) + 2 * 2 * 8  # tubes and caps
+    assert np.allclose(tubes.mesh.bounds()[:2], [0, 400], atol=10)
+
+    lines = Streamlines(data, lines_only=True, show_injection=False)
+    assert lines.mesh.dataset.GetNumberOfLines() == 2
+    assert lines.mesh.npoints == 7  # the lines share their first point
+
+    actors = make_streamlines(
+        data, StreamlinesData.from_dataframe(data), lines_only=True
+    )
+    assert len(actors) == 2
+    assert actors[0].mesh.npoints > 7  # injection site sphere
+
+
+def _distance_to_polyline(points, polyline):
+    """Distance of each point from the closest segment of a polyline"""
+    start, segment = polyline[:-1], np.diff(polyline, axis=0)
+    vec = points[:, None] - start
+    t = np.clip(
+        (vec * segment).sum(2) / np.maximum((segment**2).sum(1), 1e-12), 0, 1
+    )
+    return np.linalg.norm(vec - t[..., None] * segment, axis=2).min(1)
+
+
+def test_streamlines_simplify():
+    rng = np.random.default_rng(0)
+    data = _random_streamlines(rng, 50, np.array([5000, 4000, 5000]))
+    straight = StreamlinesData.from_lines(
+        [np.linspace([0, 0, 0], [1000, 0, 0], 11), [[5, 5, 5]]]
+    )
+
+    simplified = straight.simplify(1)
+    assert np.array_equal(simplified.offsets, [0, 2, 3])
+    assert simplified.max_error == 0
+    assert straight.simplify(None) is straight
+
+    for tolerance in (10, 50, 200):
+        simplified = data.simplify(tolerance)
+        assert data.simplify(tolerance) is simplified  # cached
+        assert len(simplified) == len(data)
+        assert len(simplified.points) < len(data.points)
+
+        errors = [
+            _distance_to_polyline(line, simple).max()
+            for line, simple in zip(data.lines, simplified.lines)
+        ]
+        assert 0 < simplified.max_error <= tolerance
+        assert np.isclose(max(errors), simplified.max_error, atol=1e-3)
+
+
+def test_streamlines_lod():
+    rng = np.random.default_rng(0)
+    data = _random_streamlines(rng, 50, np.array([5000, 4000, 5000]))
+
+    # levels of detail are only made on request
+    assert Streamlines(data, show_injection=False)._lod_meshes == []
+
+    actor = Streamlines(data, show_injection=False, lod=True)
+    assert len(actor._lod_meshes) == 2
+    assert actor.max_errors[0] == 0
+    npoints = [actor.mesh.npoints] + [m.npoints for m in actor._lod_meshes]
+    assert npoints[0] > npoints[1] > npoints[2]
+
+    simplified = Streamlines(
+        data, show_injection=False, tolerance=20, lod=True
+    )
+    assert len(simplified._lod_meshes) == 1  # only levels above tolerance
+    assert 0 < simplified.max_errors[0] <= 20
+    assert simplified.mesh.npoints < npoints[0]
+
+    scene = Scene()
+    scene.add(simplified)
+    scene.render(interactive=False, lod=1)
+    scene.plotter.render()
+    assert (
+        simplified._mesh.mapper.GetInput() is simplified._lod_meshes[0].dataset
+    )
+    assert np.allclose(
+        simplified._mesh.bounds(),
+        simplified._lod_meshes[0].bounds(),
+        atol=50,
+    )
+
+    # sliced streamlines stay sliced at all levels of detail
+    scene.slice("sagittal", actors=[simplified])
+    bounds = simplified._mesh.bounds()
+    for level in (0, 1):
+        scene.render(interactive=False, lod=level)
+        scene.plotter.render()
+        rendered = simplified._mesh.mapper.GetInput().GetBounds()
+        assert rendered[4] >= bounds[4] - 1
+        assert rendered[5] <= bounds[5] + 1
+    scene.close()
+
+
+def test_streamlines_density():
+    scene = Scene()
+    atlas = scene.atlas
+    data = StreamlinesData.from_lines(
+        [
+            [[1010, 1050, 1050], [1090, 1050, 1050], [1390, 1050, 1050]],
+            [[1050, 1010, 1050], [1050, 1210, 1050]],
+            [[-500, 50, 50], [-100, 50, 50]],  # outside the atlas
+        ]
+    )
+
+    actor = make_streamlines_density(data, data, atlas=atlas, voxel_size=100)
+    assert isinstance(actor, Volume)
+    density = actor.mesh.tonumpy().transpose(2, 1, 0)
+    assert density.shape == tuple(np.ceil(np.array(atlas.shape_um) / 100))
+
+    # the length of streamlines in each voxel
+    assert density.sum() == pytest.approx(2 * (380 + 200))
+    assert density[10, 10, 10] == pytest.approx(2 * (90 + 90))
+    assert density[13, 10, 10] == pytest.approx(2 * 90)
+    assert density[10, 12, 10] == pytest.approx(2 * 10)
+
+    # mean density of each region
+    actor = make_streamlines_density(
+        data, atlas=atlas, voxel_size=100, per_region=True
+    )
+    density = actor.mesh.tonumpy().transpose(2, 1, 0)
+    region = atlas.structure_from_coords([1050, 1050, 1050], microns=True)
+    assert density[10, 10, 10] == pytest.approx(density[10, 11, 10])
+    if region == 0:
+        assert density[10, 10, 10] == 0
+    del scene
+
+
 @patch(
     "brainrender.atlas_specific.allen_brain_atlas.streamlines.BrainGlobeAtlas"
 )
@@ -89,35 +279,26 @@ def test_get_injection_site_network_error(mock_get):
 @patch(
     "brainrender.atlas_specific.allen_brain_atlas.streamlines._get_injection_site_um"
 )
-def test_skeleton_to_dataframe_with_injection(mock_inj):
+def test_skeleton_to_streamlines_with_injection(mock_inj):
     mock_inj.return_value = {"x": 10.0, "y": 20.0, "z": 30.0}
     skeleton = _make_fake_skeleton()
-    df = _skeleton_to_dataframe(skeleton, 99, ML_EXTENT)
-    assert isinstance(df, pd.DataFrame)
-    assert "lines" in df.columns
-    assert "injection_sites" in df.columns
-    lines = df["lines"].iloc[0]
-    assert len(lines) == 2
-    pt = lines[0][0]
-    assert set(pt.keys()) == {"x", "y", "z"}
-    assert pt["x"] == pytest.approx(1.0)
-    assert pt["y"] == pytest.approx(2.0)
-    assert pt["z"] == pytest.approx(ML_EXTENT - 3.0)
-    assert df["injection_sites"].iloc[0] == [{"x": 10.0, "y": 20.0, "z": 30.0}]
+    streamlines = _skeleton_to_streamlines(skeleton, 99, ML_EXTENT)
+    assert isinstance(streamlines, StreamlinesData)
+    assert len(streamlines) == 2
+    assert streamlines.offsets.tolist() == [0, 2, 4]
+    assert streamlines.points[0] == pytest.approx([1.0, 2.0, ML_EXTENT - 3.0])
+    assert np.allclose(streamlines.injection_sites, [[10.0, 20.0, 30.0]])
 
 
 @patch(
     "brainrender.atlas_specific.allen_brain_atlas.streamlines._get_injection_site_um"
 )
-def test_skeleton_to_dataframe_fallback_centroid(mock_inj):
+def test_skeleton_to_streamlines_fallback_centroid(mock_inj):
     mock_inj.return_value = None
     skeleton = _make_fake_skeleton()
-    df = _skeleton_to_dataframe(skeleton, 99, ML_EXTENT)
-    injection = df["injection_sites"].iloc[0][0]
-    assert set(injection.keys()) == {"x", "y", "z"}
-    assert injection["x"] == pytest.approx(1.0)
-    assert injection["y"] == pytest.approx(2.0)
-    assert injection["z"] == pytest.approx(ML_EXTENT - 3.0)
+    streamlines = _skeleton_to_streamlines(skeleton, 99, ML_EXTENT)
+    injection = streamlines.injection_sites[0]
+    assert injection == pytest.approx([1.0, 2.0, ML_EXTENT - 3.0])
 
 
 @patch(
@@ -128,12 +309,11 @@ def test_skeleton_to_dataframe_fallback_centroid(mock_inj):
     True,
 )
 @patch(
-    "brainrender.atlas_specific.allen_brain_atlas.streamlines._skeleton_to_dataframe"
+    "brainrender.atlas_specific.allen_brain_atlas.streamlines._skeleton_to_streamlines"
 )
-def test_get_streamlines_data_downloads(mock_s2df, mock_ml):
+def test_get_streamlines_data_downloads(mock_s2sl, mock_ml):
     mock_ml.return_value = ML_EXTENT
-    fake_df = pd.DataFrame({"lines": [[]], "injection_sites": [[]]})
-    mock_s2df.return_value = fake_df
+    mock_s2sl.return_value = StreamlinesData(np.empty((0, 3)), [0])
     mock_cv_module = MagicMock()
     mock_cv_instance = MagicMock()
     mock_cv_instance.skeleton.get.return_value = _make_fake_skeleton()
@@ -152,8 +332,11 @@ def test_get_streamlines_data_downloads(mock_s2df, mock_ml):
                     result = get_streamlines_data(
                         [111, 222], force_download=True
                     )
+                    arrays = get_streamlines_data([111, 222], as_arrays=True)
+        assert (Path(tmpdir) / "111.npz").exists()
     assert len(result) == 2
     assert all(isinstance(r, pd.DataFrame) for r in result)
+    assert all(isinstance(r, StreamlinesData) for r in arrays)
 
 
 @patch(
@@ -180,9 +363,17 @@ def test_get_streamlines_data_uses_cache(mock_ml):
                 mock_cv_module,
                 create=True,
             ):
-                result = get_streamlines_data([111], force_download=False)
+                result = get_streamlines_data(
+                    [111], force_download=False, as_arrays=True
+                )
+
+        # json caches are converted
+        assert not (Path(tmpdir) / "111.json").exists()
+        assert (Path(tmpdir) / "111.npz").exists()
     mock_cv_module.CloudVolume.return_value.skeleton.get.assert_not_called()
     assert len(result) == 1
+    assert len(result[0]) == 1
+    assert np.allclose(result[0].injection_sites, [[1, 2, 3]])
 
 
 @patch(
@@ -200,6 +391,10 @@ def test_get_streamlines_data_no_cloudvolume():
     "brainrender.atlas_specific.allen_brain_atlas.streamlines.cloudvolume_installed",
     True,
 )
+@patch(
+    "brainrender._io.RETRY_BACKOFF",
+    0,
+)
 def test_get_streamlines_data_skips_failed_experiment(mock_ml):
     mock_ml.return_value = ML_EXTENT
     mock_cv_module = MagicMock()
@@ -218,6 +413,248 @@ def test_get_streamlines_data_skips_failed_experiment(mock_ml):
             ):
                 result = get_streamlines_data([999], force_download=True)
     assert result == []
+    assert mock_cv_instance.skeleton.get.call_count == 1 + DOWNLOAD_RETRIES
+
+
+@patch(
+    "brainrender._io.RETRY_BACKOFF",
+    0,
+)
+def test_get_skeleton_retries():
+    cv = MagicMock()
+    skeleton = _make_fake_skeleton()
+    cv.skeleton.get.side_effect = [ConnectionError("reset"), skeleton]
+    assert _get_skeleton(cv, 111) is skeleton
+
+    # missing data is not downloaded again
+    cv.skeleton.get.reset_mock(side_effect=True)
+    cv.skeleton.get.side_effect = SkeletonDecodeError("do not exist")
+    with pytest.raises(SkeletonDecodeError):
+        _get_skeleton(cv, 111)
+    assert cv.skeleton.get.call_count == 1
+
+
+@pytest.fixture
+def allen_server(tmp_path):
+    """
+    Local stand-in for the Allen servers, serving a precomputed
+    skeletons volume and the injection sites API.
+    """
+    import cloudvolume
+
+    volume = tmp_path / "mesoscale"
+    (volume / "skeletons").mkdir(parents=True)
+    info = cloudvolume.CloudVolume.create_new_info(
+        num_channels=1,
+        layer_type="segmentation",
+        data_type="uint64",
+        encoding="raw",
+        resolution=[1000, 1000, 1000],
+        voxel_offset=[0, 0, 0],
+        volume_size=[64, 64, 64],
+        chunk_size=[64, 64, 64],
+    )
+    info["skeletons"] = "skeletons"
+    (volume / "info").write_text(json.dumps(info))
+    (volume / "skeletons" / "info").write_text(
+        json.dumps(
+            {
+                "@type": "neuroglancer_skeletons",
+                "transform": [1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0],
+                "vertex_attributes": [],
+            }
+        )
+    )
+    for eid in (111, 222, 333):
+        skeleton = cloudvolume.Skeleton(
+            vertices=np.array(
+                [[0, 0, 0], [eid, 0, 0], [0, 0, 0], [0, eid, 0], [0, 0, eid]]
+            )
+            * 1000.0,
+            edges=np.array([[0, 1], [2, 3], [3, 4]]),
+            segid=eid,
+        )
+        (volume / "skeletons" / str(eid)).write_bytes(
+            skeleton.to_precomputed()
+        )
+
+    requested = []
+
+    class Handler(SimpleHTTPRequestHandler):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, directory=str(tmp_path), **kwargs)
+
+        def do_GET(self):
+            requested.append(self.path)
+            if not self.path.startswith("/api"):
+                return super().do_GET()
+
+            eid = int(re.search(r"id\$eq(\d+)", unquote(self.path))[1])
+            voxel = dict(max_voxel_x=eid, max_voxel_y=1, max_voxel_z=2)
+            body = json.dumps(dict(success=True, num_rows=1, msg=[voxel]))
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(body.encode())
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+
+    module = "brainrender.atlas_specific.allen_brain_atlas.streamlines"
+    with (
+        patch(
+            f"{module}.ALLEN_MESOSCALE_URL", f"precomputed://{url}/mesoscale"
+        ),
+        patch(f"{module}.ALLEN_API_URL", f"{url}/api/query.json"),
+        patch(f"{module}._get_ml_extent_um", return_value=ML_EXTENT),
+        patch(f"{module}.streamlines_folder", tmp_path),
+    ):
+        yield requested
+    server.shutdown()
+    server.server_close()
+
+
+def test_get_streamlines_data_local_server(allen_server, tmp_path):
+    data = get_streamlines_data(
+        [111, 999, 222, 333], max_workers=3, as_arrays=True
+    )
+
+    # missing experiments are skipped, the others keep their order
+    assert [d.points[1, 0] for d in data] == [111, 222, 333]
+    assert [len(d) for d in data] == [2, 2, 2]
+    assert np.allclose(data[0].injection_sites, [[111, 1, ML_EXTENT - 2]])
+    assert sorted(p.name for p in tmp_path.glob("*.npz")) == [
+        "111.npz",
+        "222.npz",
+        "333.npz",
+    ]
+
+    # cached experiments are not downloaded again
+    allen_server.clear()
+    data = get_streamlines_data([111, 222, 333])
+    assert len(data) == 3
+    assert list(data[0].columns) == ["lines", "injection_sites"]
+    assert data[0]["lines"].iloc[0][0][1]["x"] == 111
+    assert allen_server == []
+
+
+def _random_streamlines(rng, n_lines, center):
+    lines = [
+        np.cumsum(rng.normal(0, 50, (rng.integers(2, 50), 3)), axis=0)
+        + center
+        + rng.normal(0, 500, 3)
+        for _ in range(n_lines)
+    ]
+    return StreamlinesData.from_lines(lines, [center])
+
+
+def _brute_force_segments(index, mask):
+    """Segments with an end point in a mask of points"""
+    segments = set()
+    offset = 0
+    for d in index.data:
+        for line in d.lines:
+            for i in range(len(line) - 1):
+                if mask[offset + i] or mask[offset + i + 1]:
+                    segments.add(offset + i)
+            offset += len(line)
+    return sorted(segments)
+
+
+def test_streamlines_index():
+    rng = np.random.default_rng(0)
+    data = [
+        _random_streamlines(rng, 20, [5000, 4000, 5000]),
+        _random_streamlines(rng, 20, [8000, 4000, 5000]),
+        StreamlinesData(np.empty((0, 3)), [0]),
+    ]
+    index = StreamlinesIndex(data, eids=[11, 22, 33], cell_size=100)
+    assert len(index) == 3
+
+    bounds = [4500, 5500, 3500, 4500, 4500, 5500]
+    lo, hi = np.reshape(bounds, (3, 2)).T
+    inside = np.all((index.points >= lo) & (index.points <= hi), axis=1)
+    segments = index.segments_in_box(bounds)
+    assert segments.tolist() == _brute_force_segments(index, inside)
+    assert index.experiments(segments).tolist() == [11]
+
+    near = index.segments_near([8000, 4000, 5000], 300)
+    distance = np.linalg.norm(index.points - [8000, 4000, 5000], axis=1)
+    assert near.tolist() == _brute_force_segments(index, distance <= 300)
+    assert index.experiments(near).tolist() == [22]
+
+    assert len(index.segments_in_box([0, 10, 0, 10, 0, 10])) == 0
+
+    # consecutive segments are joined in a single streamline
+    actor = index.streamlines(segments, lines_only=True)
+    assert isinstance(actor, Streamlines)
+    breaks = np.flatnonzero(np.diff(segments) != 1)
+    assert actor.mesh.dataset.GetNumberOfLines() == len(breaks) + 1
+    assert len(index.streamlines([]).mesh.vertices) == 0
+
+
+def test_streamlines_index_from_cache(tmp_path):
+    rng = np.random.default_rng(0)
+    for eid in (111, 222):
+        _random_streamlines(rng, 5, [0, 0, 0]).save(tmp_path / f"{eid}.npz")
+
+    with patch(
+        "brainrender.atlas_specific.allen_brain_atlas.streamlines.streamlines_folder",
+        tmp_path,
+    ):
+        index = StreamlinesIndex.from_cache()
+    assert index.eids.tolist() == [111, 222]
+    assert len(index.points) == sum(len(d.points) for d in index.data)
+
+
+def test_streamlines_index_region():
+    scene = Scene()
+    atlas = scene.atlas
+    center = atlas.get_region("TH").mesh.center_of_mass()
+    rng = np.random.default_rng(1)
+    index = StreamlinesIndex([_random_streamlines(rng, 30, center)])
+
+    # region meshes are not needed to find the segments
+    with patch.object(atlas, "get_region") as get_region:
+        segments = index.segments_in_region(atlas, "TH")
+        get_region.assert_not_called()
+    inside = atlas.in_region(index.points, "TH")
+    assert inside.any()
+    assert segments.tolist() == _brute_force_segments(index, inside)
+
+    with pytest.raises(ValueError):
+        index.segments_in_region(atlas, "XYZ")
+
+    # the annotation is scanned once, later queries take milliseconds
+    with patch(
+        "brainrender.atlas_specific.allen_brain_atlas.streamlines._label_planes"
+    ) as scan:
+        start = time.perf_counter()
+        for region in ("TH", "MOs", "TH"):
+            index.segments_in_region(atlas, region)
+        elapsed = (time.perf_counter() - start) / 3
+        scan.assert_not_called()
+    assert elapsed < 0.05
+    del scene
+
+
+def test_label_planes():
+    annotation = np.zeros((4, 5, 6), dtype=np.uint32)
+    annotation[1:3, 2, 1:4] = 7
+    annotation[3, 4, 5] = 9
+    annotation[0, 0, 0] = 3  # not a known label
+    planes = _label_planes(annotation, [9, 0, 7])
+
+    assert [p.shape for p in planes] == [(4, 3), (5, 3), (6, 3)]
+    for axis, p in enumerate(planes):
+        for col, label in enumerate([9, 0, 7]):
+            other = tuple(a for a in range(3) if a != axis)
+            expected = (annotation == label).any(axis=other)
+            assert p[:, col].tolist() == expected.tolist()
 
 
 @patch(
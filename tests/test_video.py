@@ -1,16 +1,23 @@
+import re
+import subprocess
 from pathlib import Path
 from unittest.mock import patch
 
+import pytest
+
+from brainrender import settings
+from brainrender._video import StreamingVideo
 from brainrender.scene import Scene
-from brainrender.video import Animation, VideoMaker
+from brainrender.video import Animation, VideoMaker, sigma
 
 
-def test_video(tmp_path):
+@pytest.mark.parametrize("encoder", ["stream", "png"])
+def test_video(tmp_path, encoder):
     s = Scene(title="BR")
 
     s.add_brain_region("TH")
 
-    vm = VideoMaker(s, tmp_path, "test")
+    vm = VideoMaker(s, tmp_path, "test", encoder=encoder)
     savepath = vm.make_video(duration=1, fps=15, azimuth=3)
 
     assert savepath == str((tmp_path / "test.mp4").resolve())
@@ -85,3 +92,180 @@ def test_compress(tmp_path):
     ), f"Output path missing from ffmpeg cmd: {cmd}"
     # No bare filenames — must be absolute paths
     assert "myvideo.mp4" not in cmd.replace(expected_output, "")
+
+
+def test_streaming_video(tmp_path):
+    s = Scene(title="BR")
+    s.render(interactive=False)
+
+    video = StreamingVideo(
+        name=tmp_path / "test", fps=10, size=None, plotter=s.plotter
+    )
+    for _ in range(12):
+        s.plotter.camera.Azimuth(3)
+        video.add_frame()
+    out, command = video.close()
+    s.close()
+
+    assert out == 0
+    assert "rawvideo" in command
+
+    # count the frames in the encoded video
+    probe = subprocess.run(
+        ["ffmpeg", "-i", str(tmp_path / "test.mp4"), "-f", "null", "-"],
+        capture_output=True,
+        text=True,
+    )
+    assert int(re.findall(r"frame=\s*(\d+)", probe.stderr)[-1]) == 12
+
+
+def test_video_encoder_error(tmp_path):
+    s = Scene(title="BR")
+    with pytest.raises(ValueError):
+        VideoMaker(s, tmp_path, "test", encoder="gif")
+
+
+def test_video_frames_error(tmp_path, monkeypatch):
+    def broken(scene, frame, *args, **kwargs):
+        if frame == 3:
+            raise RuntimeError("frame failed")
+
+    videos = []
+    close = StreamingVideo.close
+
+    def spy_close(video):
+        videos.append(video)
+        return close(video)
+
+    s = Scene(title="BR")
+    vm = VideoMaker(s, tmp_path, "test", make_frame_func=broken)
+    monkeypatch.setattr(settings, "OFFSCREEN", False)
+    monkeypatch.setattr(StreamingVideo, "close", spy_close)
+    with pytest.raises(RuntimeError):
+        vm.make_video(duration=1, fps=10)
+
+    # ffmpeg and the thread writing to it are stopped, settings restored
+    assert settings.OFFSCREEN is False
+    (video,) = videos
+    assert video._process.poll() is not None
+    assert not video._writer.is_alive()
+
+
+def make_scene():
+    scene = Scene(title="brain regions", inset=False)
+    scene.add_brain_region("TH")
+    return scene
+
+
+def make_broken_scene():
+    raise RuntimeError("Scene creation failed")
+
+
+def test_animation_parallel(tmp_path):
+    anim = Animation(make_scene(), tmp_path, "test")
+    anim.add_keyframe(0, camera="top", zoom=1.3)
+    anim.add_keyframe(1, camera="sagittal", zoom=2.1)
+
+    savepath = anim.make_video(
+        duration=1, fps=10, n_workers=2, scene_func=make_scene
+    )
+    assert savepath == str((tmp_path / "test.mp4").resolve())
+
+    # the first two frames are not saved, like when rendering serially
+    probe = subprocess.run(
+        ["ffmpeg", "-i", savepath, "-f", "null", "-"],
+        capture_output=True,
+        text=True,
+    )
+    assert int(re.findall(r"frame=\s*(\d+)", probe.stderr)[-1]) == 8
+
+    with pytest.raises(ValueError):
+        anim.make_video(duration=1, fps=10, n_workers=2)
+
+    png = Animation(make_scene(), tmp_path, "png", encoder="png")
+    with pytest.raises(ValueError):
+        png.make_video(duration=1, fps=10, n_workers=2, scene_func=make_scene)
+
+
+def test_animation_parallel_error(tmp_path, monkeypatch):
+    anim = Animation(make_scene(), tmp_path, "test")
+    monkeypatch.setattr(settings, "OFFSCREEN", False)
+    with pytest.raises(RuntimeError):
+        anim.make_video(
+            duration=1, fps=10, n_workers=2, scene_func=make_broken_scene
+        )
+    assert settings.OFFSCREEN is False
+
+
+class FrameCounter:
+    """Stands in for a video, counts the frames added to it"""
+
+    def __init__(self, scene):
+        self.scene = scene
+        self.frames = []
+
+    def add_frame(self):
+        self.frames.append(self.scene.plotter.camera.GetPosition())
+
+
+def test_animation_segment_replay(tmp_path):
+    calls = []
+
+    def callback(scene, frame, nframes):
+        calls.append(frame)
+
+    def animation():
+        anim = Animation(make_scene(), tmp_path, "test")
+        anim.add_keyframe(0, camera="top", zoom=1)
+        anim.add_keyframe(0.2, duration=0.2, camera="top", callback=callback)
+        anim.add_keyframe(0.9, camera="sagittal", zoom=2)
+        anim.scene.render(interactive=False)
+        return anim
+
+    serial = animation()
+    full = FrameCounter(serial.scene)
+    serial.generate_frames(10, 1, full, False)
+    assert calls == [2, 3]  # the held frames
+
+    # a segment replays the frames before it, without adding them
+    calls.clear()
+    segment = animation()
+    part = FrameCounter(segment.scene)
+    segment.generate_frames(10, 1, part, False, start=6, stop=9)
+    assert calls == [2, 3]
+    assert len(part.frames) == 3
+    assert part.frames == full.frames[4:7]  # frames 0 and 1 are not added
+
+
+def test_animation_frame_params(tmp_path):
+    scene = Scene(title="brain regions", inset=False)
+    anim = Animation(scene, tmp_path, "test")
+    anim.add_keyframe(0, camera="top", zoom=1)
+    anim.add_keyframe(1, camera="top", zoom=2, duration=1)  # hold
+    anim.add_keyframe(3, camera="top", zoom=4, interpol="sigma")
+
+    # a held keyframe is stored once
+    assert len(anim.keyframes) == 3
+
+    anim.nframes = 40
+    anim.get_keyframe_framenumber(10)
+    assert anim.keyframes_numbers == [0, *range(10, 20), 30]
+    assert anim.last_keyframe == 30
+
+    # sigmoid interpolation (the default) between the first keyframes
+    assert anim.get_frame_params(5)["zoom"] == pytest.approx(1.5)
+    fact = sigma((10 - 2) / 10)
+    expected = fact * 1 + (1 - fact) * 2
+    assert anim.get_frame_params(2)["zoom"] == pytest.approx(expected)
+
+    # held keyframe
+    for frame in (10, 15, 19):
+        assert anim.get_frame_params(frame)["zoom"] == 2
+
+    # sigmoid interpolation from the end of the hold
+    anim.segment_fact = sigma((30 - 25) / (30 - 19))
+    expected = anim._interpolate_values(2, 4)
+    assert anim.get_frame_params(25)["zoom"] == pytest.approx(expected)
+
+    # after the last keyframe
+    assert anim.get_frame_params(35)["zoom"] == 4